@@ -21,3 +21,10 @@
 from .client import Client
 from .state import State
 from .crypto import Method as EncryptionMethod
+from .pool import Pool
+from .queue import OverflowPolicy
+from .protocol import Report
+from .relay import Relay
+from .spool import Spool
+from .stats import Stats
+from .sync import SyncClient
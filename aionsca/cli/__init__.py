@@ -0,0 +1,82 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from functools import wraps
+from typing import Dict, TextIO
+
+import click
+import click_log
+
+
+def comain(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return asyncio.run(f(*args, **kwargs))
+
+    return wrapper
+
+
+class LogFormatter(logging.Formatter):
+    colors = {
+        "error": dict(fg="red"),
+        "exception": dict(fg="red"),
+        "critical": dict(fg="red"),
+        "debug": dict(fg="blue"),
+        "warning": dict(fg="yellow"),
+    }
+
+    def format(self, record: logging.LogRecord):
+        if not record.exc_info:
+            level = record.levelname.lower()
+            msg = record.getMessage()
+            if level in self.colors:
+                prefix = click.style(f"{level}:{record.name}: ", **self.colors[level])
+                msg = "\n".join(prefix + x for x in msg.splitlines())
+            return msg
+        return logging.Formatter.format(self, record)
+
+
+def get_logger() -> logging.Logger:
+    """Return the root logger, logging through click with colored levels"""
+    logger = logging.getLogger()
+    if not any(isinstance(h, click_log.ClickHandler) for h in logger.handlers):
+        handler = click_log.ClickHandler()
+        handler.formatter = LogFormatter()
+        logger.addHandler(handler)
+    return logger
+
+
+def parse_config_file(fp: TextIO) -> Dict[str, str]:
+    """Parse a ``key=value`` config file as used by ``nsca`` and
+    ``send_nsca``"""
+    config: Dict[str, str] = dict()
+    line: str
+    for line in fp:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            key, value = line.split("=", 1)
+            config[key.strip()] = value.strip()
+        except ValueError as e:
+            raise ValueError(f"Invalid config key {line}") from e
+    return config
@@ -0,0 +1,181 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import signal
+import sys
+from typing import List, Optional, Union
+
+import click
+import click_log
+
+from .. import Client, EncryptionMethod, Pool
+from ..relay import Relay
+from ..server import Server
+from . import comain, get_logger, parse_config_file
+
+logger = get_logger()
+
+
+@click.command()
+@click_log.simple_verbosity_option(logger)
+@click.option(
+    "--host", "-H", required=True, metavar="ADDRESS", help="Upstream NSCA server host"
+)
+@click.option(
+    "--port",
+    "-p",
+    default=5667,
+    type=int,
+    metavar="NUM",
+    help="Upstream NSCA server port",
+)
+@click.option(
+    "--config-file",
+    "-c",
+    default="/etc/send_nsca.cfg",
+    type=click.Path(dir_okay=False),
+    help="send_nsca config file, used for local and upstream connections",
+)
+@click.option(
+    "--listen-address",
+    default="127.0.0.1",
+    metavar="ADDRESS",
+    help="Address to accept local connections on",
+)
+@click.option(
+    "--listen-port",
+    default=5667,
+    type=click.IntRange(min=0),
+    metavar="NUM",
+    help="Port to accept local connections on, 0 to only use --socket",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Also accept local connections on this Unix domain socket",
+)
+@click.option(
+    "--connections",
+    default=2,
+    type=click.IntRange(min=1),
+    metavar="NUM",
+    help="Number of upstream connections",
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    type=click.IntRange(min=1),
+    metavar="NUM",
+    help="Maximum number of reports sent upstream at once",
+)
+@comain
+async def relay(
+    host: str,
+    port: int,
+    config_file: str,
+    listen_address: str,
+    listen_port: int,
+    socket_path: Optional[str],
+    connections: int,
+    batch_size: int,
+) -> int:
+    """Accept NSCA reports from local senders and relay them to an upstream
+    NSCA server over a few persistent connections."""
+    try:
+        with open(config_file, "r") as fp:
+            config = parse_config_file(fp)
+        password = config.get("password", "")
+        encryption_method = EncryptionMethod.parse(
+            config.get("encryption_method", EncryptionMethod.PLAINTEXT)
+        )
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Failed to read config file {config_file}: {e}")
+        return 1
+
+    servers: List[Server] = list()
+    if listen_port:
+        servers.append(
+            Server(
+                host=listen_address,
+                port=listen_port,
+                password=password,
+                encryption_method=encryption_method,
+            )
+        )
+    if socket_path is not None:
+        servers.append(
+            Server(
+                path=socket_path,
+                password=password,
+                encryption_method=encryption_method,
+            )
+        )
+    if not servers:
+        raise click.UsageError("Need --listen-port or --socket")
+
+    upstream: Union[Client, Pool]
+    client_kwargs = dict(
+        host=host, port=port, password=password, encryption_method=encryption_method
+    )
+    if connections > 1:
+        upstream = Pool(size=connections, **client_kwargs)
+    else:
+        upstream = Client(**client_kwargs)
+
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, main_task.cancel)
+
+    nsca_relay = Relay(servers, upstream, batch_size=batch_size)
+    try:
+        async with nsca_relay:
+            logger.info(f"Relaying reports to {host}:{port}")
+            await nsca_relay.run()
+    except asyncio.CancelledError:
+        logger.info("Shutting down")
+    except OSError as e:
+        logger.error(f"Relay failed: {e}")
+        return 1
+    finally:
+        logger.info(
+            f"Relayed {nsca_relay.relayed_reports} report(s), "
+            f"{nsca_relay.failed_reports} failed"
+        )
+    return 0
+
+
+def main():
+    """Entry point of ``aionsca-relay``"""
+    try:
+        status = relay.main(standalone_mode=False)
+    except click.ClickException as e:
+        e.show()
+        status = e.exit_code
+    except click.Abort:
+        status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
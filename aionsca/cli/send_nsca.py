@@ -0,0 +1,330 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import codecs
+import sys
+import time
+from typing import AsyncIterator, List, Optional, TextIO, Tuple, Union
+
+import click
+import click_log
+
+from .. import Client, EncryptionMethod, Pool, State
+from . import comain, get_logger, parse_config_file
+
+logger = get_logger()
+
+ReportTuple = Tuple[str, Optional[str], int, str]
+
+# send_nsca separates multi-line reports by ASCII "end of transmission block"
+BLOCK_SEPARATOR = "\x17"
+
+
+class InputParser:
+    def __init__(self, delimiter: str = "\t"):
+        """Incrementally parse check results read by ``send_nsca``
+
+        Each report is a line ``host<delim>service<delim>state<delim>message``
+        for service checks or ``host<delim>state<delim>message`` for host
+        checks.  If the input contains a :py:data`BLOCK_SEPARATOR`, reports
+        are separated by it instead of newlines, so that messages can span
+        several lines.
+
+        The format applies to the whole input, so nothing is parsed until it
+        is known: once the first :py:data`BLOCK_SEPARATOR` was read, or at
+        the end of the input.
+        """
+        self.delimiter = delimiter
+        # None until the format of the input is known
+        self.block_mode: Optional[bool] = None
+        self.invalid = 0
+        self._tail = ""
+
+    def feed(self, text: str) -> List[ReportTuple]:
+        """Parse all reports completed by ``text``"""
+        data = self._tail + text
+        if self.block_mode is None:
+            if BLOCK_SEPARATOR not in text:
+                self._tail = data
+                return []
+            self.block_mode = True
+
+        records = data.split(BLOCK_SEPARATOR if self.block_mode else "\n")
+        self._tail = records.pop()
+        return self._parse(records)
+
+    def close(self) -> List[ReportTuple]:
+        """Parse the reports at the end of the input, including one that is
+        not terminated"""
+        if self.block_mode is None:
+            self.block_mode = False
+        tail, self._tail = self._tail, ""
+        return self._parse(tail.split(BLOCK_SEPARATOR if self.block_mode else "\n"))
+
+    def _parse(self, records: List[str]) -> List[ReportTuple]:
+        reports: List[ReportTuple] = list()
+        for record in records:
+            if self.block_mode:
+                record = record.strip("\n")
+            if not record.strip():
+                continue
+
+            fields = record.split(self.delimiter, 3)
+            try:
+                if len(fields) == 4:
+                    host, service, state, message = fields
+                elif len(fields) == 3:
+                    host, state, message = fields
+                    service = None
+                else:
+                    raise ValueError(f"expected 3 or 4 fields, got {len(fields)}")
+                reports.append(
+                    (host, service, int(state), message.replace("\\n", "\n"))
+                )
+            except ValueError as e:
+                self.invalid += 1
+                logger.warning(f"Ignoring invalid report {record!r}: {e}")
+        return reports
+
+
+async def read_chunks(stream: TextIO, chunk_size: int) -> AsyncIterator[bytes]:
+    """Read ``stream`` in chunks of up to ``chunk_size`` bytes without
+    blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=chunk_size)
+    try:
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), stream
+        )
+    except ValueError:
+        # Regular files cannot be watched by the event loop
+        reader = None
+
+    while True:
+        if reader is not None:
+            chunk = await reader.read(chunk_size)
+        else:
+            chunk = await loop.run_in_executor(None, stream.buffer.read, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def read_batches(
+    stream: TextIO,
+    parser: InputParser,
+    batches: asyncio.Queue,
+    batch_size: int,
+    chunk_size: int,
+):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    batch: List[ReportTuple] = list()
+    async for chunk in read_chunks(stream, chunk_size):
+        batch.extend(parser.feed(decoder.decode(chunk)))
+        while len(batch) >= batch_size:
+            await batches.put(batch[:batch_size])
+            del batch[:batch_size]
+
+    batch.extend(parser.feed(decoder.decode(b"", final=True)))
+    batch.extend(parser.close())
+    if batch:
+        await batches.put(batch)
+
+
+class Summary:
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.start = time.monotonic()
+
+    def add(self, results: List[Optional[Exception]]):
+        self.batches += 1
+        for error in results:
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+                if self.failed == 1:
+                    logger.error(f"Failed to send report: {error}")
+
+    def __str__(self):
+        duration = time.monotonic() - self.start
+        rate = self.sent / duration if duration > 0 else 0
+        return (
+            f"Sent {self.sent} report(s) in {self.batches} batch(es) "
+            f"in {duration:.3f}s ({rate:.0f} reports/s), {self.failed} failed"
+        )
+
+
+async def send_batches(
+    sender: Union[Client, Pool],
+    batches: asyncio.Queue,
+    summary: Summary,
+    retries: int,
+):
+    while True:
+        batch = await batches.get()
+        if batch is None:
+            return
+        summary.add(await sender.send_reports(batch, retries=retries))
+
+
+@click.command()
+@click_log.simple_verbosity_option(logger)
+@click.option(
+    "--host", "-H", default="localhost", metavar="ADDRESS", help="NSCA server host"
+)
+@click.option(
+    "--port", "-p", default=5667, type=int, metavar="NUM", help="NSCA server port"
+)
+@click.option(
+    "--timeout",
+    "-to",
+    default=10.0,
+    type=float,
+    metavar="SEC",
+    help="Seconds to wait for the connection to the NSCA server",
+)
+@click.option(
+    "--delimiter",
+    "-d",
+    default="\t",
+    type=str,
+    metavar="DELIM",
+    help="Delimiter to used when parsing input",
+)
+@click.option(
+    "--config-file",
+    "-c",
+    default="/etc/send_nsca.cfg",
+    type=click.Path(dir_okay=False),
+    help="Name of config file to use",
+)
+@click.option(
+    "--connections",
+    default=1,
+    type=click.IntRange(min=1),
+    metavar="NUM",
+    help="Number of concurrent connections to the NSCA server",
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    type=click.IntRange(min=1),
+    metavar="NUM",
+    help="Maximum number of reports sent at once",
+)
+@click.option(
+    "--chunk-size",
+    default=1 << 20,
+    type=click.IntRange(min=1),
+    metavar="BYTES",
+    help="Number of bytes read from standard input at once",
+)
+@comain
+async def send_nsca(
+    host: str,
+    port: int,
+    timeout: float,
+    delimiter: str,
+    config_file: str,
+    connections: int,
+    batch_size: int,
+    chunk_size: int,
+) -> int:
+    """Send check results read from standard input to an NSCA server.
+
+    Compatible with the input format, options and exit codes of the
+    ``send_nsca`` program shipped with NSCA.
+    """
+    try:
+        with open(config_file, "r") as fp:
+            config = parse_config_file(fp)
+        password = config.get("password", "")
+        encryption_method = EncryptionMethod.parse(
+            config.get("encryption_method", EncryptionMethod.PLAINTEXT)
+        )
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Failed to read config file {config_file}: {e}")
+        return State.CRITICAL.value
+
+    client_kwargs = dict(
+        host=host,
+        port=port,
+        encryption_method=encryption_method,
+        password=password,
+        retry_deadline=timeout,
+    )
+    if connections > 1:
+        sender = Pool(size=connections, acquire_timeout=timeout, **client_kwargs)
+        retries = connections
+    else:
+        sender = Client(**client_kwargs)
+        retries = 5
+
+    try:
+        await asyncio.wait_for(sender.connect(), timeout)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        logger.error(f"Could not connect to {host}:{port}: {e!r}")
+        return State.CRITICAL.value
+
+    parser = InputParser(delimiter)
+    summary = Summary()
+    batches: asyncio.Queue = asyncio.Queue(maxsize=2 * connections)
+    senders = [
+        asyncio.ensure_future(send_batches(sender, batches, summary, retries))
+        for _ in range(connections)
+    ]
+    try:
+        await read_batches(sys.stdin, parser, batches, batch_size, chunk_size)
+        for _ in senders:
+            await batches.put(None)
+        await asyncio.gather(*senders)
+    finally:
+        for task in senders:
+            task.cancel()
+        await sender.disconnect(flush=True)
+
+    click.echo(f"{summary.sent} data packet(s) sent to host successfully.")
+    click.echo(str(summary), err=True)
+
+    if summary.failed:
+        return State.CRITICAL.value
+    return State.OK.value
+
+
+def main():
+    """Entry point of ``aionsca-send-nsca``, exiting with the status codes of
+    ``send_nsca``: ``0`` if all reports were sent, ``2`` if sending failed and
+    ``3`` for invalid usage."""
+    try:
+        status = send_nsca.main(standalone_mode=False)
+    except click.ClickException as e:
+        e.show()
+        status = State.UNKNOWN.value
+    except click.Abort:
+        status = State.UNKNOWN.value
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import signal
+import sys
+from typing import Dict, Optional, Union
+
+import click
+import click_log
+
+from .. import EncryptionMethod
+from ..nagios import CheckResultWriter, CommandFileWriter, fresh_reports
+from ..server import Server
+from ..workers import MultiprocessServer
+from . import comain, get_logger, parse_config_file
+
+logger = get_logger()
+
+
+def _flag(config: Dict[str, str], key: str) -> bool:
+    return config.get(key, "0").strip() == "1"
+
+
+@click.command()
+@click_log.simple_verbosity_option(logger)
+@click.option(
+    "--config-file",
+    "-c",
+    default="/etc/nsca.cfg",
+    type=click.Path(dir_okay=False),
+    help="Name of config file to use",
+)
+@click.option(
+    "--workers",
+    default=0,
+    type=click.IntRange(min=0),
+    metavar="NUM",
+    help="Number of processes decoding reports, 0 to decode in this process",
+)
+@click.option(
+    "--batch-size",
+    default=1024,
+    type=click.IntRange(min=1),
+    metavar="NUM",
+    help="Maximum number of reports written to the command file at once",
+)
+@click.option(
+    "--atomic-writes/--no-atomic-writes",
+    default=True,
+    help=(
+        "Write at most PIPE_BUF bytes at once to the command file, "
+        "so that lines of other writers are not interleaved"
+    ),
+)
+@comain
+async def server(
+    config_file: str, workers: int, batch_size: int, atomic_writes: bool
+) -> int:
+    """Receive NSCA reports and submit them to Nagios/Centreon as passive
+    check results.
+
+    Reads the ``nsca.cfg`` config file of the ``nsca`` daemon and writes to
+    its ``command_file``, or to ``check_result_path`` if set.
+    """
+    try:
+        with open(config_file, "r") as fp:
+            config = parse_config_file(fp)
+        encryption_method = EncryptionMethod.parse(
+            config.get("decryption_method", EncryptionMethod.XOR)
+        )
+        port = int(config.get("server_port", 5667))
+        max_packet_age = int(config.get("max_packet_age", 30))
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Failed to read config file {config_file}: {e}")
+        return 1
+
+    server_kwargs = dict(
+        host=config.get("server_address") or None,
+        port=port,
+        password=config.get("password", ""),
+        encryption_method=encryption_method,
+    )
+    receiver: Union[Server, MultiprocessServer]
+    if workers:
+        receiver = MultiprocessServer(
+            workers=workers, batch_size=batch_size, **server_kwargs
+        )
+    else:
+        receiver = Server(**server_kwargs)
+
+    writer: Union[CommandFileWriter, CheckResultWriter]
+    check_result_path: Optional[str] = config.get("check_result_path")
+    if check_result_path:
+        writer = CheckResultWriter(check_result_path)
+        logger.info(f"Writing check results to {check_result_path}")
+    else:
+        command_file = config.get("command_file", "/usr/local/nagios/var/rw/nagios.cmd")
+        writer = CommandFileWriter(
+            command_file,
+            append=_flag(config, "append_to_file"),
+            atomic_writes=atomic_writes,
+        )
+        logger.info(f"Writing external commands to {command_file}")
+
+    stale = 0
+    try:
+        async with receiver:
+            # Only once the workers have been forked, so that they keep the
+            # default signal handlers
+            main_task = asyncio.current_task()
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, main_task.cancel)
+
+            logger.info(f"Listening on port {port}")
+            batches = (
+                receiver.reports_batched()
+                if workers
+                else receiver.reports_batched(batch_size)
+            )
+            async for batch in batches:
+                reports = fresh_reports(batch, max_packet_age)
+                if len(reports) < len(batch):
+                    stale += len(batch) - len(reports)
+                    logger.warning(
+                        f"Dropped {len(batch) - len(reports)} report(s) older "
+                        f"than {max_packet_age}s"
+                    )
+                await writer.write_reports(reports)
+    except asyncio.CancelledError:
+        logger.info("Shutting down")
+    except OSError as e:
+        logger.error(f"NSCA server failed: {e}")
+        return 1
+    finally:
+        if isinstance(writer, CommandFileWriter):
+            writer.close()
+        logger.info(
+            f"Wrote {writer.written_reports} report(s) in {writer.writes} "
+            f"write(s), dropped {stale} stale report(s)"
+        )
+    return 0
+
+
+def main():
+    """Entry point of ``aionsca-server``"""
+    try:
+        status = server.main(standalone_mode=False)
+    except click.ClickException as e:
+        e.show()
+        status = e.exit_code
+    except click.Abort:
+        status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
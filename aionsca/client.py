@@ -21,15 +21,73 @@
 import asyncio
 from asyncio import StreamReader, StreamWriter
 import logging
+import random
+import socket
 import struct
-from typing import Optional, Union
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 from .state import State
-from .crypto import Method, Crypter, get_crypter_by_method
-from .protocol import InitPacket, ReportPacket
+from .crypto import Method, Crypter, get_crypter_by_method, run_crypto
+from .protocol import InitPacket, ReportPacket, Padding
+from .queue import OverflowPolicy, ReportQueue
+from .spool import Spool
+from .stats import Stats
 
 logger = logging.getLogger(__name__)
 
+ReportTuple = Tuple[str, Optional[str], Union[State, int], str]
+
+
+def prepare_report(
+    host: str, service: Optional[str], state: Union[State, int], message: str
+) -> Tuple[str, str, State, str]:
+    """Validate a report and convert it to the form expected by
+    :py:meth`ReportPacket.pack`.
+
+    Raises :py:class`TypeError` or :py:class`ValueError` if the report
+    cannot be packed.
+    """
+    # A report with an empty service name is interpreted as a host report.
+    service = "" if service is None else service
+
+    for name, value in (("host", host), ("service", service), ("message", message)):
+        if not isinstance(value, str):
+            raise TypeError(f"Report {name} must be a str, got {type(value).__name__}")
+
+    return host, service, State(state), message
+
+
+def same_state(pending: ReportTuple, new: ReportTuple) -> bool:
+    """Coalescing rule that only lets a report replace a pending report for
+    the same host and service if both have the same state.
+
+    This way every state change reaches the NSCA host, e.g. a ``CRITICAL``
+    report is never replaced by a following ``OK`` report before it was sent.
+    """
+    return pending[2] == new[2]
+
+
+class _PendingReport:
+    __slots__ = ("report", "superseded")
+
+    def __init__(self, report: Tuple[str, str, State, str]):
+        self.report = report
+        self.superseded = False
+
 
 class Client:
     def __init__(
@@ -39,6 +97,27 @@ class Client:
         encryption_method: Union[Method, int, str] = Method.PLAINTEXT,
         password: str = "",
         loop: Optional[asyncio.AbstractEventLoop] = None,
+        queue_size: int = 10000,
+        overflow_policy: Union[OverflowPolicy, str] = OverflowPolicy.BLOCK,
+        submit_batch_size: int = 1000,
+        coalesce: bool = False,
+        keep_state_changes: bool = True,
+        padding: Union[Padding, str] = Padding.POOL,
+        crypto_executor: Optional[Executor] = None,
+        crypto_offload_threshold: int = 16 * ReportPacket.SIZE,
+        crypto_backend: Optional[Union[str, Sequence[str]]] = None,
+        retry_backoff: float = 0.05,
+        retry_backoff_max: float = 5.0,
+        retry_deadline: Optional[float] = 30.0,
+        spool: Optional[Spool] = None,
+        keepalive: Optional[float] = None,
+        nodelay: bool = True,
+        quickack: bool = False,
+        idle_timeout: Optional[float] = None,
+        health_check_interval: Optional[float] = None,
+        session_max_age: Optional[float] = None,
+        stats: Optional[Stats] = None,
+        path: Optional[str] = None,
     ):
         """A client for sending NSCA reports
 
@@ -53,12 +132,104 @@ class Client:
             Password used to encrypt reports
         :param loop: Optional[asyncio.AbstractEventLoop]
             Event loop to open connection in
+        :param queue_size: int
+            Maximum number of reports queued by :py:meth`submit`
+        :param overflow_policy: Union[OverflowPolicy, str]
+            What :py:meth`submit` does when the queue is full, see
+            :py:class`aionsca.queue.ReportQueue`.  Reports are coalesced by
+            ``(host, service)``.
+        :param submit_batch_size: int
+            Maximum number of queued reports sent in one batch
+        :param coalesce: bool
+            If set, a report passed to :py:meth`send_report` that is still
+            waiting for the connection is dropped when a newer report for the
+            same host and service is sent
+        :param keep_state_changes: bool
+            Only coalesce reports with the same state, see
+            :py:func`same_state`.  Applies to :py:meth`send_report` and to the
+            ``coalesce`` overflow policy of :py:meth`submit`.
+        :param padding: Union[Padding, str]
+            How unused bytes of report fields are filled, see
+            :py:class`aionsca.protocol.Padding`
+        :param crypto_executor: Optional[Executor]
+            If set, batches of at least ``crypto_offload_threshold`` bytes are
+            encrypted in this executor instead of on the event loop
+        :param crypto_offload_threshold: int
+            Minimum size in bytes of a batch to be encrypted in
+            ``crypto_executor``
+        :param crypto_backend: Optional[Union[str, Sequence[str]]]
+            Library or libraries used for encryption, see
+            :py:func`aionsca.crypto.get_crypter_by_method`
+        :param retry_backoff: float
+            Maximum delay in seconds before the first retry of a failed send.
+            The maximum delay doubles with each retry, the actual delay is
+            chosen randomly below it.
+        :param retry_backoff_max: float
+            Upper bound in seconds for the maximum retry delay
+        :param retry_deadline: Optional[float]
+            Seconds after which a failed send is given up, regardless of the
+            number of retries left, or ``None`` for no limit
+        :param spool: Optional[Spool]
+            If given, reports that cannot be sent are appended to this
+            :py:class`aionsca.spool.Spool` instead of raising a
+            :py:class`ConnectionError`.  Spooled reports are sent before any
+            other report after the next successful connect.  While the spool
+            is not empty, sending is tried only once before reports are
+            spooled.
+        :param keepalive: Optional[float]
+            Enable TCP keepalive on the connection, probing the NSCA host
+            after ``keepalive`` seconds without traffic
+        :param nodelay: bool
+            Set ``TCP_NODELAY`` on the connection, so that writes are not
+            delayed to be coalesced by the kernel
+        :param quickack: bool
+            Set ``TCP_QUICKACK`` on the connection where supported (Linux)
+        :param idle_timeout: Optional[float]
+            Reconnect in the background after ``idle_timeout`` seconds without
+            sending a report, for example shortly before the NSCA host would
+            close the idle connection, so that a fresh connection is ready for
+            the next report
+        :param health_check_interval: Optional[float]
+            Check the connection in the background every
+            ``health_check_interval`` seconds and reconnect if it was closed
+            or is idle for too long.  Defaults to a quarter of
+            ``idle_timeout`` if only that is set; without either, the
+            connection is only checked when sending fails.
+        :param session_max_age: Optional[float]
+            Reconnect before sending once a connection is ``session_max_age``
+            seconds old, which also measures :py:attr`clock_skew` again.  Set
+            this below the ``max_packet_age`` of the NSCA host if its clock
+            may drift away from the local one.
+        :param stats: Optional[Stats]
+            Collect counters and durations of the pack, encrypt, write and
+            drain stages in this :py:class`aionsca.stats.Stats`
+        :param path: Optional[str]
+            Connect to the Unix domain socket ``path`` instead of ``host`` and
+            ``port``, for example of a local :py:class`aionsca.relay.Relay`
         """
         self._host = host
         self._port = port
         self._encryption_method = Method.parse(encryption_method)
         self._password: bytes = str(password).encode("utf-8")
         self._loop = loop
+        self._padding = Padding.parse(padding)
+        self._crypto_executor = crypto_executor
+        self._crypto_offload_threshold = crypto_offload_threshold
+        self._crypto_backend = crypto_backend
+        self._retry_backoff = retry_backoff
+        self._retry_backoff_max = retry_backoff_max
+        self._retry_deadline = retry_deadline
+        self._spool = spool
+        self._keepalive = keepalive
+        self._nodelay = nodelay
+        self._quickack = quickack
+        self._idle_timeout = idle_timeout
+        if health_check_interval is None and idle_timeout is not None:
+            health_check_interval = idle_timeout / 4
+        self._health_check_interval = health_check_interval
+        self._session_max_age = session_max_age
+        self._stats = stats
+        self._path = path
 
         if self._encryption_method is not Method.PLAINTEXT and not self._password:
             logger.warning(
@@ -76,9 +247,33 @@ class Client:
         self._reader: Optional[StreamReader] = None
         self._writer: Optional[StreamWriter] = None
         self._timestamp: Optional[int] = None
+        self._clock_skew: Optional[float] = None
+        self._connected_at = 0.0
         self._crypter: Optional[Crypter] = None
         self._send_lock = asyncio.Lock()
 
+        # Batches written on the current connection that may still be
+        # buffered by the transport, with the stream offset of their end
+        self._in_flight: Deque[Tuple[int, List[Tuple[str, str, State, str]]]] = deque()
+        self._bytes_written = 0
+        self._last_activity = 0.0
+        self._monitor_task: Optional[asyncio.Task] = None
+
+        self._queue: ReportQueue[Tuple[str, str, State, str]] = ReportQueue(
+            queue_size,
+            policy=overflow_policy,
+            key=lambda report: (report[0], report[1]),
+            supersedes=same_state if keep_state_changes else None,
+        )
+        self._submit_batch_size = submit_batch_size
+        self._sender_task: Optional[asyncio.Task] = None
+        self._failed_reports = 0
+
+        self._coalesce = coalesce
+        self._supersedes = same_state if keep_state_changes else None
+        self._pending: Dict[Tuple[str, str], _PendingReport] = dict()
+        self._superseded_reports = 0
+
     async def _receive_init_packet(self) -> (bytes, int):
         packet = await self._reader.readexactly(InitPacket.SIZE)
         iv, timestamp = InitPacket.unpack(packet)
@@ -87,15 +282,182 @@ class Client:
 
     async def connect(self):
         logger.debug(f"Connecting to {self._host}:{self._port}...")
-        self._reader, self._writer = await asyncio.open_connection(
-            host=self._host, port=self._port, loop=self._loop
-        )
+        if self._path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(
+                path=self._path
+            )
+        else:
+            self._reader, self._writer = await asyncio.open_connection(
+                host=self._host, port=self._port
+            )
+        self._configure_socket(self._writer.get_extra_info("socket"))
         iv, self._timestamp = await self._receive_init_packet()
+        self._clock_skew = self._timestamp - time.time()
+        self._connected_at = self._time()
+        self._in_flight.clear()
+        self._bytes_written = 0
+        self._last_activity = self._time()
         self._crypter = get_crypter_by_method(
-            self._encryption_method, iv=iv, password=self._password
+            self._encryption_method,
+            iv=iv,
+            password=self._password,
+            backend=self._crypto_backend,
         )
+        if self._spool is not None:
+            await self._replay_spool()
+
+        if self._health_check_interval is not None and (
+            self._monitor_task is None or self._monitor_task.done()
+        ):
+            self._monitor_task = asyncio.ensure_future(self._run_monitor())
+
+    def _configure_socket(self, sock: Optional[socket.socket]):
+        if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+            return
+
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self._nodelay))
+        if self._quickack and hasattr(socket, "TCP_QUICKACK"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        if self._keepalive is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            interval = max(1, int(self._keepalive))
+            for option in ("TCP_KEEPIDLE", "TCP_KEEPINTVL"):
+                if hasattr(socket, option):
+                    sock.setsockopt(
+                        socket.IPPROTO_TCP, getattr(socket, option), interval
+                    )
+
+    def _time(self) -> float:
+        return (self._loop or asyncio.get_event_loop()).time()
+
+    def _session_problem(self) -> Optional[str]:
+        """Why the current connection should be replaced, if at all"""
+        if self._writer is None:
+            return None
+        if self._writer.is_closing() or self._reader.at_eof():
+            return "connection closed"
+        if self._session_expired():
+            return "session expired"
+        if (
+            self._idle_timeout is not None
+            and self._time() - self._last_activity >= self._idle_timeout
+        ):
+            return "connection idle"
+        return None
+
+    def _session_expired(self) -> bool:
+        return (
+            self._session_max_age is not None
+            and self._time() - self._connected_at >= self._session_max_age
+        )
+
+    def _server_time(self) -> int:
+        """Current time on the NSCA host, as far as known from the last init
+        packet"""
+        return int(time.time() + self._clock_skew)
+
+    @property
+    def stats(self) -> Optional[Stats]:
+        """Statistics collected by this client, if enabled"""
+        return self._stats
+
+    @property
+    def clock_skew(self) -> Optional[float]:
+        """Offset in seconds of the NSCA host's clock from the local clock, as
+        measured from the init packet of the current connection.  This is
+        only accurate to about a second, since the init packet only contains
+        whole seconds.  ``None`` before the first connection."""
+        return self._clock_skew
+
+    async def _run_monitor(self):
+        while True:
+            await asyncio.sleep(self._health_check_interval)
+            if self._session_problem() is None:
+                continue
+
+            async with self._send_lock:
+                problem = self._session_problem()
+                if problem is None:
+                    continue
+                logger.info(
+                    f"Reconnecting to NSCA host {self._host}:{self._port} "
+                    f"({problem})"
+                )
+                if not self._writer.is_closing():
+                    # An idle or expired connection had time to flush
+                    self._forget_flushed()
+                unflushed = self._unflushed_reports()
+                try:
+                    await self._reconnect_locked()
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    logger.warning(f"Failed to reconnect to NSCA host: {e}")
+                    # Try again after the next interval instead of every time
+                    self._last_activity = self._time()
+                    continue
+
+                if unflushed:
+                    logger.info(
+                        f"Replaying {len(unflushed)} report(s) that were not "
+                        f"flushed to the network"
+                    )
+                    try:
+                        await self._send_batch_locked(unflushed, retries=5)
+                    except ConnectionError as e:
+                        logger.warning(f"Failed to replay reports: {e}")
+
+    def _stop_monitor(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+
+    async def _replay_spool(self):
+        # A spool shared by several clients is replayed by one of them at a time
+        if self._spool.claimed or len(self._spool) == 0:
+            return
+
+        logger.info(f"Sending {len(self._spool)} spooled report(s)")
+        loop = self._loop or asyncio.get_event_loop()
+        while True:
+            # The spool blocks on disk I/O, use it from an executor
+            taken = loop.run_in_executor(
+                None, self._spool.take, self._submit_batch_size
+            )
+            try:
+                reports = await asyncio.shield(taken)
+            except RuntimeError:
+                # Another client sharing the spool is replaying it
+                return
+            except asyncio.CancelledError:
+                # The reports are taken nevertheless, put them back
+                taken.add_done_callback(
+                    lambda f: f.exception() is None and self._spool.release()
+                )
+                raise
+            if not reports:
+                await loop.run_in_executor(None, self._spool.commit)
+                return
+            try:
+                await self._write_reports(reports)
+                await self._writer.drain()
+            except BaseException:
+                self._spool.release()
+                raise
+            await loop.run_in_executor(None, self._spool.commit)
 
     async def disconnect(self, flush=False):
+        """Close the connection to the NSCA host.
+
+        :param flush: bool
+            Send all reports queued by :py:meth`submit` and drain the send
+            buffer before closing the connection
+        """
+        if flush and self._sender_task is not None:
+            await self.flush()
+        self._stop_sender()
+        self._stop_monitor()
+        await self._close(flush=flush)
+
+    async def _close(self, flush=False):
         logger.debug(f"Disconnecting...")
         if self._writer is None:
             return
@@ -104,11 +466,35 @@ class Client:
             if flush:
                 logger.debug(f"Draining send buffer...")
                 await self._writer.drain()
-        except ConnectionError:
+        except OSError:
             pass
         finally:
             self._writer.close()
 
+        if flush:
+            # drain() only waits for the buffer to fall below its low-water
+            # mark, the transport writes the rest before the socket is closed.
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+
+    async def reconnect(self):
+        """Replace the connection to the NSCA host with a new one.
+
+        Waits until a batch being sent has been written, so that no batch
+        encrypted for the old connection is written to the new one.
+        """
+        async with self._send_lock:
+            await self._reconnect_locked()
+
+    async def _reconnect_locked(self):
+        if self._stats is not None and self._writer is not None:
+            # Only count replacing a connection, not connecting the first time
+            self._stats.count("reconnects")
+        await self._close(flush=False)
+        await self.connect()
+
     async def __aenter__(self):
         await self.connect()
         return self
@@ -123,7 +509,7 @@ class Client:
         state: State,
         message: str,
         retries: int = 5,
-    ):
+    ) -> bool:
         """Asynchronously send a state report for the service ``service`` on
         host ``host`` to the connected NSCA host.
 
@@ -141,52 +527,327 @@ class Client:
         :param retries: int
             Number of tries to send attempted before raising a
             :py:class`ConnectionError`
+        :return: bool
+            ``True`` if the report was sent, ``False`` if it was superseded by
+            a newer report before it could be sent (only if the client was
+            created with ``coalesce=True``)
         """
 
-        # A report with an empty service name is interpreted as a host report.
-        service = "" if service is None else service
-
-        state = State(state)
+        report = prepare_report(host, service, state, message)
+        host, service, state, message = report
 
         logger.debug(
-            f"Sending report: "
-            f"host={host!r}, "
-            f"service={service!r}, "
-            f"state={state!r}, "
-            f"message={message!r}"
+            "Sending report: host=%r, service=%r, state=%r, message=%r",
+            host,
+            service,
+            state,
+            message,
         )
 
+        if not self._coalesce:
+            await self._send_batch([report], retries=retries)
+            return True
+
+        key = (host, service)
+        pending = _PendingReport(report)
+        queued = self._pending.get(key)
+        if queued is not None and (
+            self._supersedes is None or self._supersedes(queued.report, report)
+        ):
+            queued.superseded = True
+            self._superseded_reports += 1
+        self._pending[key] = pending
+
+        try:
+            async with self._send_lock:
+                if pending.superseded:
+                    return False
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+                await self._send_batch_locked([report], retries=retries)
+                return True
+        finally:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+
+    async def send_reports(
+        self, reports: Iterable[ReportTuple], retries: int = 5
+    ) -> List[Optional[Exception]]:
+        """Asynchronously send a batch of reports to the connected NSCA host.
+
+        All reports are packed and encrypted into a single buffer, written to
+        the connection at once and the send buffer is drained only once.  If
+        the connection fails, the whole batch is sent again after
+        reconnecting.
+
+        :param reports: Iterable[ReportTuple]
+            Reports as tuples of ``(host, service, state, message)``, see
+            :py:meth`send_report` for a description of each field
+        :param retries: int
+            Number of tries to send the batch before giving up
+        :return: List[Optional[Exception]]
+            For each report, in order, ``None`` if it was sent successfully, or
+            the exception that prevented it from being sent
+        """
+        results: List[Optional[Exception]] = list()
+        batch: List[Tuple[str, str, State, str]] = list()
+        indices: List[int] = list()
+
+        for report in reports:
+            try:
+                batch.append(prepare_report(*report))
+            except (TypeError, ValueError) as e:
+                results.append(e)
+            else:
+                indices.append(len(results))
+                results.append(None)
+
+        if batch:
+            logger.debug("Sending batch of %d reports", len(batch))
+            try:
+                await self._send_batch(batch, retries=retries)
+            except ConnectionError as e:
+                for index in indices:
+                    results[index] = e
+
+        return results
+
+    async def send_report_stream(
+        self,
+        reports: AsyncIterable[ReportTuple],
+        batch_size: int = 1000,
+        retries: int = 5,
+    ) -> AsyncIterator[Tuple[ReportTuple, Optional[Exception]]]:
+        """Send reports from an asynchronous iterable in batches of up to
+        ``batch_size`` reports, see :py:meth`send_reports`.
+
+        This is an asynchronous generator yielding, for each report, a tuple
+        of the report and ``None`` if it was sent successfully or the
+        exception that prevented it from being sent.
+        """
+        batch: List[ReportTuple] = list()
+        async for report in reports:
+            batch.append(report)
+            if len(batch) >= batch_size:
+                results = await self.send_reports(batch, retries=retries)
+                for result in zip(batch, results):
+                    yield result
+                batch = list()
+
+        if batch:
+            results = await self.send_reports(batch, retries=retries)
+            for result in zip(batch, results):
+                yield result
+
+    async def _send_batch(
+        self, reports: List[Tuple[str, str, State, str]], retries: int
+    ):
         async with self._send_lock:
-            for retry in range(1, retries + 1):
+            await self._send_batch_locked(reports, retries=retries)
+
+    async def _send_batch_locked(
+        self, reports: List[Tuple[str, str, State, str]], retries: int
+    ):
+        loop = self._loop or asyncio.get_event_loop()
+        deadline = (
+            None if self._retry_deadline is None else loop.time() + self._retry_deadline
+        )
+        delay = self._retry_backoff
+        pending = reports
+        connected = self._writer is not None and not self._session_expired()
+        stats = self._stats
+        if self._spool is not None and len(self._spool) > 0 and not self._spool.claimed:
+            # The connection failed before, try once to reconnect and send the
+            # spooled reports, then spool these as well
+            connected = False
+            retries = 1
+
+        for retry in range(1, retries + 1):
+            if not connected:
                 try:
-                    report_bytes = ReportPacket.pack(
-                        hostname=host,
-                        service=service,
-                        state=state,
-                        message=message,
-                        timestamp=self._timestamp,
+                    # A silent host must not block the send past the deadline
+                    await asyncio.wait_for(
+                        self._reconnect_locked(),
+                        None if deadline is None else max(0, deadline - loop.time()),
                     )
-                    encrypted = self._crypter.encrypt(report_bytes)
-                    self._writer.write(encrypted)
+                    connected = True
+                except asyncio.TimeoutError:
+                    logger.warning(
+                        f"Timed out reconnecting to NSCA host ({retry}/{retries})"
+                    )
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    logger.warning(
+                        f"Failed to reconnect to NSCA host ({retry}/{retries}): {e}"
+                    )
+
+            if connected:
+                try:
+                    await self._write_reports(pending)
+                    if stats is not None:
+                        start = time.perf_counter()
                     await self._writer.drain()
-                except ConnectionError as e:
+                    if stats is not None:
+                        stats.observe("drain", time.perf_counter() - start)
+                        stats.count("reports_sent", len(pending))
+                    self._forget_flushed()
+                    # no exceptions raised, reports were sent successfully
+                    return
+                except OSError as e:
+                    # Includes timeouts of TCP keepalive probes (ETIMEDOUT)
+                    if stats is not None:
+                        stats.count("send_errors")
                     logger.warning(
-                        f"Error sending report to NSCA host: {e}, "
-                        f"reconnecting ({retry}/{retries})..."
+                        f"Error sending report to NSCA host ({retry}/{retries}): {e}"
                     )
-                    try:
-                        await self.disconnect(flush=False)
-                        await self.connect()
-                    except ConnectionError as e:
-                        logger.warning(
-                            f"Failed to reconnect to NSCA host ({retry}/{retries}): {e}"
+                    connected = False
+                    pending = self._unflushed_reports()
+                    if len(pending) > len(reports):
+                        logger.info(
+                            f"Replaying {len(pending) - len(reports)} previously "
+                            f"sent report(s) that were not flushed to the network"
                         )
-                else:
-                    # no exceptions raised, report was sent successfully
-                    break
-            else:
-                # retries exhausted
-                raise ConnectionError(
-                    f"Failed to send report to NSCA host {self._host}:{self._port} "
-                    f"after {retry} {'try' if retry == 1  else 'tries'}"
-                )
+
+            if retry == retries:
+                break
+
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+
+            # Exponential backoff with full jitter
+            backoff = random.uniform(0, delay)
+            if remaining is not None:
+                backoff = min(backoff, remaining)
+            await asyncio.sleep(backoff)
+            delay = min(delay * 2, self._retry_backoff_max)
+            if stats is not None:
+                stats.count("retries")
+
+        # retries exhausted
+        self._in_flight.clear()
+        if self._spool is not None:
+            logger.warning(
+                f"Failed to send {len(pending)} report(s) to NSCA host "
+                f"{self._host}:{self._port}, spooling them"
+            )
+            await loop.run_in_executor(None, self._spool.append, pending)
+            if stats is not None:
+                stats.count("reports_spooled", len(pending))
+            return
+        raise ConnectionError(
+            f"Failed to send {len(pending)} report(s) to NSCA host {self._host}:{self._port} "
+            f"after {retry} {'try' if retry == 1  else 'tries'}"
+        )
+
+    async def _write_reports(self, reports: List[Tuple[str, str, State, str]]):
+        stats = self._stats
+        if stats is not None:
+            start = time.perf_counter()
+        packets = ReportPacket.pack_many(
+            reports, timestamp=self._server_time(), padding=self._padding
+        )
+        if stats is not None:
+            packed = time.perf_counter()
+            stats.observe("pack", packed - start)
+        # Still holding the send lock, so no other batch can use the crypter
+        # before this one is encrypted.
+        encrypted = await run_crypto(
+            self._crypter.encrypt,
+            packets,
+            executor=self._crypto_executor,
+            threshold=self._crypto_offload_threshold,
+            loop=self._loop,
+        )
+        if stats is not None:
+            encrypted_at = time.perf_counter()
+            stats.observe("encrypt", encrypted_at - packed)
+        self._bytes_written += len(encrypted)
+        self._last_activity = self._time()
+        self._in_flight.append((self._bytes_written, reports))
+        self._writer.write(encrypted)
+        if stats is not None:
+            stats.observe("write", time.perf_counter() - encrypted_at)
+            stats.count("bytes_sent", len(encrypted))
+
+    def _forget_flushed(self):
+        """Forget batches that the transport has handed to the kernel"""
+        flushed = self._bytes_written - self._writer.transport.get_write_buffer_size()
+        while self._in_flight and self._in_flight[0][0] <= flushed:
+            self._in_flight.popleft()
+
+    def _unflushed_reports(self) -> List[Tuple[str, str, State, str]]:
+        """Reports of all batches written on the current connection that were
+        not known to be handed to the kernel"""
+        return [report for _, batch in self._in_flight for report in batch]
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of reports queued by :py:meth`submit` and not yet sent"""
+        return len(self._queue)
+
+    @property
+    def dropped_reports(self) -> int:
+        """Number of reports dropped because the submit queue was full"""
+        return self._queue.dropped
+
+    @property
+    def coalesced_reports(self) -> int:
+        """Number of queued reports replaced by a newer report for the same
+        host and service"""
+        return self._queue.coalesced + self._superseded_reports
+
+    @property
+    def failed_reports(self) -> int:
+        """Number of queued reports that could not be sent"""
+        return self._failed_reports
+
+    async def submit(
+        self, host: str, service: Optional[str], state: State, message: str
+    ) -> bool:
+        """Queue a report to be sent in the background.
+
+        Queued reports are sent in batches by a background task, see
+        :py:meth`send_reports`.  This only waits if the queue is full and the
+        overflow policy is ``BLOCK``.
+
+        Raises :py:class`TypeError` or :py:class`ValueError` for reports that
+        cannot be sent.  Reports that fail to send in the background are
+        logged and counted in :py:attr`failed_reports`.
+
+        :return: bool
+            ``False`` if the report was dropped because the queue was full
+        """
+        report = prepare_report(host, service, state, message)
+        if self._sender_task is None or self._sender_task.done():
+            self._sender_task = asyncio.ensure_future(self._run_sender())
+        return await self._queue.put(report)
+
+    async def flush(self):
+        """Wait until all reports queued by :py:meth`submit` have been sent
+        or have failed to send"""
+        await self._queue.join()
+
+    def _stop_sender(self):
+        if self._sender_task is not None:
+            self._sender_task.cancel()
+            self._sender_task = None
+
+    async def _run_sender(self):
+        while True:
+            batch = await self._queue.get_batch(self._submit_batch_size)
+            try:
+                results = await self.send_reports(batch)
+                errors = [e for e in results if e is not None]
+                if errors:
+                    self._failed_reports += len(errors)
+                    logger.warning(
+                        f"Failed to send {len(errors)} of {len(batch)} queued "
+                        f"report(s): {errors[0]}"
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._failed_reports += len(batch)
+                logger.exception(f"Failed to send {len(batch)} queued report(s)")
+            finally:
+                self._queue.task_done(len(batch))
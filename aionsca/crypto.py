@@ -19,16 +19,45 @@
 # along with metricq.  If not, see <http://www.gnu.org/licenses/>.
 
 from abc import abstractmethod
+from asyncio import AbstractEventLoop, get_event_loop
+from collections import OrderedDict
+from concurrent.futures import Executor
 from enum import IntEnum
-from typing import Callable, Union
+from importlib import import_module
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Union
 import os
 
-import Crypto.Cipher.Blowfish
+from .protocol import InitPacket, ReportPacket
 
 
 class Method(IntEnum):
+    """Encryption methods as numbered in the ``nsca`` and ``send_nsca``
+    configuration files"""
+
     PLAINTEXT = 0
+    XOR = 1
+    DES = 2
+    TRIPLE_DES = 3
+    CAST128 = 4
+    CAST256 = 5
+    XTEA = 6
+    THREEWAY = 7
     BLOWFISH = 8
+    TWOFISH = 9
+    LOKI97 = 10
+    RC2 = 11
+    ARCFOUR = 12
+    RIJNDAEL128 = 14
+    RIJNDAEL192 = 15
+    RIJNDAEL256 = 16
+    WAKE = 19
+    SERPENT = 20
+    ENIGMA = 22
+    GOST = 23
+    SAFER64 = 24
+    SAFER128 = 25
+    SAFERPLUS = 26
 
     def __str__(self):
         return f"{self.name.lower()} ({self.value})"
@@ -38,8 +67,11 @@ class Method(IntEnum):
         """Parse an encryption method from an integral value or string.
 
         Input is either an integer as defined in the legacy `send_nsca.c`
-        config format or the name of the encryption method:
+        config format or the name of the encryption method, ignoring case,
+        dashes and underscores.  The names used by libmcrypt are accepted as
+        well:
         >>> assert Method.parse('8') == Method.parse("blowfish")
+        >>> assert Method.parse('3') == Method.parse("tripledes")
 
         This function is idempotent, i.e. returns already valid isinstances of
         :py:class`Method` unchanged:
@@ -52,28 +84,128 @@ class Method(IntEnum):
         try:
             return Method(int(value))
         except ValueError:
-            return Method[str(value).upper()]
+            name = str(value).upper().replace("-", "").replace("_", "")
+            try:
+                return _METHOD_NAMES[name]
+            except KeyError:
+                raise KeyError(value) from None
+
+
+_METHOD_NAMES = {method.name.replace("_", ""): method for method in Method}
+_METHOD_NAMES.update(
+    NONE=Method.PLAINTEXT,
+    **{"3DES": Method.TRIPLE_DES, "3WAY": Method.THREEWAY},
+    SAFERSK64=Method.SAFER64,
+    SAFERSK128=Method.SAFER128,
+)
 
+# Backends in order of preference
+BACKENDS = ("builtin", "pycryptodomex", "cryptography", "pycrypto")
 
-_crypters = dict()
+_crypters: Dict[Method, Dict[str, type]] = dict()
 
 
 class _MetaCrypter(type):
     def __new__(clsarg, *args, **kwargs):
         cls = super().__new__(clsarg, *args, **kwargs)
         if cls.method is not None:
-            _crypters[cls.method] = cls
+            _crypters.setdefault(cls.method, dict())[cls.backend] = cls
 
         return cls
 
 
+def _truncate_or_extend(obj: bytes, max_len: int, extend_by: Callable[[int], bytes]):
+    if len(obj) >= max_len:
+        return obj[:max_len]
+    else:
+        return obj + extend_by(max_len - len(obj))
+
+
+class KeyScheduleCache:
+    def __init__(self, maxsize: int = 64):
+        """A bounded cache of keyed ciphers, shared by all connections using
+        the same encryption method and password
+
+        Entries are evicted least recently used first.  Call
+        :py:meth`invalidate` after rotating a password to drop the entries
+        derived from the old one.
+
+        :param maxsize: int
+            Maximum number of cached key schedules
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Hashable, Any] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(
+        self,
+        method: "Method",
+        backend: str,
+        password: bytes,
+        factory: Callable[[], Any],
+    ) -> Any:
+        """Return the cached cipher for ``(method, backend, password)``,
+        creating it by calling ``factory`` if it is not cached"""
+        key = (method, backend, password)
+        with self._lock:
+            cipher = self._entries.pop(key, None)
+            if cipher is not None:
+                self._entries[key] = cipher
+                self.hits += 1
+                return cipher
+
+        cipher = factory()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = cipher
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return cipher
+
+    def invalidate(self, password: Optional[bytes] = None):
+        """Drop all entries for ``password``, or all entries if ``None``"""
+        with self._lock:
+            if password is None:
+                self._entries.clear()
+                return
+
+            for key in [key for key in self._entries if key[2] == password]:
+                del self._entries[key]
+
+
+key_schedules = KeyScheduleCache()
+
+
 class Crypter(metaclass=_MetaCrypter):
     method = None
+    backend = "builtin"
+    key_size = None
 
-    def __init__(self, password, iv, rng):
+    def __init__(self, password, iv, rng, key_cache: Optional[KeyScheduleCache] = None):
         self.password = password
         self.iv = iv
         self.rng = rng
+        self.key_cache = key_cache
+
+    @classmethod
+    def available(cls) -> bool:
+        """Whether the libraries required by this crypter are installed"""
+        return True
+
+    def _key(self) -> bytes:
+        # Like nsca, use the password as key, truncated or padded with zero
+        # bytes to the cipher's maximum key size.
+        return _truncate_or_extend(
+            self.password, self.key_size, lambda diff: b"\0" * diff
+        )
+
+    def _iv(self, block_size: int) -> bytes:
+        return _truncate_or_extend(self.iv, block_size, self.rng)
 
     @abstractmethod
     def encrypt(self, _message: bytes) -> bytes:
@@ -98,47 +230,395 @@ class PlaintextCrypter(Crypter):
         return bytes(message)
 
 
-class Pep272Crypter(Crypter):
-    """Base class for implementing crypters supporting the PEP 272 interface
+class XorCrypter(Crypter):
+    """XOR "encryption" as implemented by nsca
+
+    Each packet is XORed with the repeated initialization vector and then
+    with the repeated password, both starting over at the beginning of every
+    packet.  Data passed to :py:meth`encrypt` and :py:meth`decrypt` is thus
+    treated as a stream of consecutive packets.
     """
 
-    CypherCls = None
-    key_size = None
+    method = Method.XOR
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        def truncate_or_extend(
-            obj: bytes, max_len: int, extend_by: Callable[[int], bytes]
-        ):
-            if len(obj) >= max_len:
-                return obj[:max_len]
-            else:
-                return obj + extend_by(max_len - len(obj))
+        size = ReportPacket.SIZE
+        iv = self.iv[: InitPacket.IV_SIZE] or b"\0"
+        password = self.password or b"\0"
+        pad = bytes(iv[i % len(iv)] ^ password[i % len(password)] for i in range(size))
+        self._pad = pad
+        self._offset = 0
 
-        key = truncate_or_extend(
-            self.password, self.key_size, lambda diff: b"\0" * diff
-        )
-        iv = truncate_or_extend(self.iv, self.CypherCls.block_size, self.rng)
+    def _apply(self, message) -> bytes:
+        length = len(message)
+        if not length:
+            return b""
+
+        size = len(self._pad)
+        start = self._offset
+        repeats = (start + length + size - 1) // size
+        keystream = (self._pad * repeats)[start : start + length]
+        self._offset = (start + length) % size
+
+        result = int.from_bytes(message, "big") ^ int.from_bytes(keystream, "big")
+        return result.to_bytes(length, "big")
+
+    encrypt = _apply
+    decrypt = _apply
+
+
+class Pep272Crypter(Crypter):
+    """Base class for implementing crypters supporting the PEP 272 interface
+
+    Used with the ``Crypto.Cipher`` modules of pycrypto or pycryptodome.
+
+    If created with a :py:class`KeyScheduleCache`, decryption does not set up
+    a cipher in CFB mode for each connection.  Instead, it uses a cipher in
+    ECB mode from the cache, which was keyed only once, and computes the CFB
+    keystream for all received bytes with a single call to it.  This is
+    possible since, unlike for encryption, all ciphertext that makes up the
+    CFB shift register is known in advance when decrypting.
+    """
+
+    backend = "pycrypto"
+    package = "Crypto.Cipher"
+    cipher_name = None
+    stream = False
+    # Whether decrypting with a cached key schedule pays off.  It saves the
+    # key setup of each connection, but replaces the library's CFB mode by
+    # the one in _decrypt_cfb8.  Measured with pycryptodomex as native time
+    # over cached time, for reads of 1, 8 and 64 packets:
+    #
+    #   DES          0.93-1.19  0.93-1.08  0.93-1.15
+    #   Triple DES   1.00-1.12  1.00-1.09  0.96-1.11
+    #   CAST-128     1.02-1.19  0.97-1.19  0.98-1.19
+    #   Blowfish     1.35-1.62  1.25-1.78  1.13-1.27
+    #   RC2          0.99-1.07  0.97-1.02  0.89-0.93
+    #   Rijndael-128 1.41-2.36  1.57-2.37  0.68-0.95
+    #
+    # Only Blowfish, with its expensive key setup, gains on every read size.
+    cache_key_schedule = False
+
+    @classmethod
+    def cipher_module(cls):
+        return import_module(f"{cls.package}.{cls.cipher_name}")
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            cls.cipher_module()
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
 
-        self.crypter = self.CypherCls.new(key, self.CypherCls.MODE_CFB, iv)
+        self._ecb = None
+        self.crypter = None
+
+        CypherCls, key = self._cipher()
+        if self.stream:
+            self.crypter = CypherCls.new(key)
+            return
+
+        iv = self._iv(CypherCls.block_size)
+        if self.key_cache is not None and self.cache_key_schedule:
+            self._ecb = self.key_cache.get(
+                self.method,
+                self.backend,
+                self.password,
+                lambda: CypherCls.new(key, CypherCls.MODE_ECB),
+            )
+            self._register = iv
+        else:
+            self.crypter = CypherCls.new(key, CypherCls.MODE_CFB, iv)
+
+    def _cipher(self):
+        """Return the cipher module and the key to create ciphers with"""
+        return self.cipher_module(), self._key()
 
     def encrypt(self, message):
+        if self.crypter is None:
+            CypherCls, key = self._cipher()
+            self.crypter = CypherCls.new(
+                key, CypherCls.MODE_CFB, self._iv(CypherCls.block_size)
+            )
+
+        # PEP 272 implementations may only accept immutable buffers
+        if not isinstance(message, bytes):
+            message = bytes(message)
         return self.crypter.encrypt(message)
 
     def decrypt(self, message):
+        if not isinstance(message, bytes):
+            message = bytes(message)
+        if self._ecb is not None:
+            return self._decrypt_cfb8(message)
         return self.crypter.decrypt(message)
 
+    def _decrypt_cfb8(self, message: bytes) -> bytes:
+        length = len(message)
+        if not length:
+            return b""
+
+        # In 8 bit CFB mode, the keystream byte for ciphertext byte i is the
+        # first byte of the encrypted block (IV + ciphertext)[i : i + block].
+        # Lay out all these blocks one after another and encrypt them at once.
+        block_size = len(self._register)
+        stream = self._register + message
+        blocks = bytearray(length * block_size)
+        for column in range(block_size):
+            blocks[column::block_size] = stream[column : column + length]
+        self._register = stream[-block_size:]
+
+        keystream = self._ecb.encrypt(bytes(blocks))[::block_size]
+        result = int.from_bytes(message, "big") ^ int.from_bytes(keystream, "big")
+        return result.to_bytes(length, "big")
+
+
+class DesCrypter(Pep272Crypter):
+    method = Method.DES
+    cipher_name = "DES"
+    key_size = 8
+
+
+class TripleDesCrypter(Pep272Crypter):
+    method = Method.TRIPLE_DES
+    cipher_name = "DES3"
+    key_size = 24
+
+    def _cipher(self):
+        CypherCls, key = super()._cipher()
+        # pycryptodome refuses Triple DES keys that degenerate to single DES,
+        # e.g. those padded from passwords of at most 8 bytes.  Encrypt with
+        # the equivalent DES key instead, as libmcrypt and OpenSSL do.
+        # DES ignores the lowest bit of each key byte.
+        k1, k2, k3 = (bytes(b & 0xFE for b in key[i : i + 8]) for i in range(0, 24, 8))
+        if k2 == k3:
+            return import_module(f"{self.package}.DES"), key[:8]
+        if k1 == k2:
+            return import_module(f"{self.package}.DES"), key[16:]
+        return CypherCls, key
+
+
+class Cast128Crypter(Pep272Crypter):
+    method = Method.CAST128
+    cipher_name = "CAST"
+    key_size = 16
+
 
 class BlowfishCrypter(Pep272Crypter):
     method = Method.BLOWFISH
-    CypherCls = Crypto.Cipher.Blowfish
+    cipher_name = "Blowfish"
     key_size = 56
+    cache_key_schedule = True
+
+
+class Rc2Crypter(Pep272Crypter):
+    method = Method.RC2
+    cipher_name = "ARC2"
+    key_size = 128
+
 
+class ArcfourCrypter(Pep272Crypter):
+    method = Method.ARCFOUR
+    cipher_name = "ARC4"
+    key_size = 256
+    stream = True
 
-def get_crypter_by_method(method: Method, iv: bytes, password: bytes, rng=os.urandom):
-    try:
-        CrypterCls = _crypters[method]
-        return CrypterCls(password, iv, rng)
-    except KeyError as e:
-        raise ValueError(f"Unknown encryption method {method!s}") from e
+
+class Rijndael128Crypter(Pep272Crypter):
+    method = Method.RIJNDAEL128
+    cipher_name = "AES"
+    key_size = 32
+
+
+# pycryptodomex provides the same ciphers in the ``Cryptodome`` package
+for _Pep272Crypter in (
+    DesCrypter,
+    TripleDesCrypter,
+    Cast128Crypter,
+    BlowfishCrypter,
+    Rc2Crypter,
+    ArcfourCrypter,
+    Rijndael128Crypter,
+):
+    type(
+        f"Cryptodome{_Pep272Crypter.__name__}",
+        (_Pep272Crypter,),
+        dict(backend="pycryptodomex", package="Cryptodome.Cipher"),
+    )
+del _Pep272Crypter
+
+
+class OpenSSLCrypter(Crypter):
+    """Base class for crypters using OpenSSL via the ``cryptography`` package
+
+    OpenSSL implements 8 bit CFB mode only for DES and AES, and limits RC4 to
+    keys shorter than the 256 bytes used by nsca, so other methods are left
+    to the PEP 272 backends.
+    """
+
+    backend = "cryptography"
+    algorithm_name = None
+    stream = False
+
+    @classmethod
+    def algorithm(cls):
+        # Legacy ciphers have moved to the "decrepit" module in recent
+        # versions of cryptography.
+        try:
+            from cryptography.hazmat.decrepit.ciphers import algorithms
+
+            return getattr(algorithms, cls.algorithm_name)
+        except (ImportError, AttributeError):
+            from cryptography.hazmat.primitives.ciphers import algorithms
+
+            return getattr(algorithms, cls.algorithm_name)
+
+    @staticmethod
+    def cfb8():
+        # 8 bit CFB mode has moved to the "decrepit" module as well
+        try:
+            from cryptography.hazmat.decrepit.ciphers.modes import CFB8
+        except ImportError:
+            from cryptography.hazmat.primitives.ciphers.modes import CFB8
+        return CFB8
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            cls.algorithm()
+        except (ImportError, AttributeError):
+            return False
+        return True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        from cryptography.hazmat.primitives.ciphers import Cipher
+
+        algorithm = self.algorithm()(self._key())
+        if self.stream:
+            cipher = Cipher(algorithm, mode=None)
+        else:
+            iv = self._iv(algorithm.block_size // 8)
+            cipher = Cipher(algorithm, self.cfb8()(iv))
+
+        self._encryptor = cipher.encryptor()
+        self._decryptor = cipher.decryptor()
+
+    def encrypt(self, message):
+        return self._encryptor.update(message)
+
+    def decrypt(self, message):
+        return self._decryptor.update(message)
+
+
+class OpenSSLDesCrypter(OpenSSLCrypter):
+    method = Method.DES
+    algorithm_name = "TripleDES"
+    key_size = 8
+
+    def _key(self) -> bytes:
+        # Triple DES with three equal keys is equivalent to DES.  Passing a
+        # single 8 byte key instead is deprecated by cryptography.
+        return super()._key() * 3
+
+
+class OpenSSLTripleDesCrypter(OpenSSLCrypter):
+    method = Method.TRIPLE_DES
+    algorithm_name = "TripleDES"
+    key_size = 24
+
+
+class OpenSSLRijndael128Crypter(OpenSSLCrypter):
+    method = Method.RIJNDAEL128
+    algorithm_name = "AES"
+    key_size = 32
+
+
+def available_backends(method: Union[Method, int, str]) -> List[str]:
+    """Return the backends that can be used for an encryption method, in
+    order of preference"""
+    crypters = _crypters.get(Method.parse(method), dict())
+    return [
+        backend
+        for backend in BACKENDS
+        if backend in crypters and crypters[backend].available()
+    ]
+
+
+async def run_crypto(
+    func: Callable[[bytes], bytes],
+    data: bytes,
+    executor: Optional[Executor],
+    threshold: int,
+    loop: Optional[AbstractEventLoop] = None,
+) -> bytes:
+    """Run ``func(data)``, where ``func`` is a crypter's ``encrypt`` or
+    ``decrypt`` method, in ``executor`` if ``data`` holds at least
+    ``threshold`` bytes, or inline otherwise.
+
+    Crypters are stateful, so callers must not start another operation on
+    the same crypter before the previous one has finished.
+    """
+    if executor is None or len(data) < threshold:
+        return func(data)
+
+    loop = loop or get_event_loop()
+    return await loop.run_in_executor(executor, func, data)
+
+
+def get_crypter_by_method(
+    method: Method,
+    iv: bytes,
+    password: bytes,
+    rng=os.urandom,
+    backend: Optional[Union[str, Sequence[str]]] = None,
+    key_cache: Optional[KeyScheduleCache] = None,
+):
+    """Create a crypter for an encryption method
+
+    :param backend: Optional[Union[str, Sequence[str]]]
+        Name of the backend to use, or a sequence of names to try in order.
+        By default, the first available backend from :py:data`BACKENDS` is
+        used.
+    :param key_cache: Optional[KeyScheduleCache]
+        Cache of key schedules used by crypters that support it when
+        decrypting
+    """
+    method = Method.parse(method)
+    crypters = _crypters.get(method, dict())
+    if not crypters:
+        raise ValueError(f"Encryption method {method!s} is not supported")
+
+    if backend is None:
+        backends = BACKENDS
+    elif isinstance(backend, str):
+        backends = (backend,)
+    else:
+        backends = tuple(backend)
+
+    error = None
+    for name in backends:
+        CrypterCls = crypters.get(name)
+        if CrypterCls is not None and CrypterCls.available():
+            try:
+                return CrypterCls(password, iv, rng, key_cache=key_cache)
+            except ValueError as e:
+                # Some libraries reject keys others accept
+                error = e
+
+    if error is not None:
+        raise ValueError(
+            f"Failed to create a crypter for encryption method {method!s}: {error}"
+        ) from error
+    raise ValueError(
+        f"No backend available for encryption method {method!s}, "
+        f"tried {', '.join(backends)}.  "
+        f"Supported backends: {', '.join(crypters)}"
+    )
@@ -0,0 +1,265 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import errno
+import logging
+import os
+import random
+import select
+import string
+import time
+from typing import Iterable, List, Optional, Sequence
+
+from .protocol import Report
+
+logger = logging.getLogger(__name__)
+
+# Writes of up to PIPE_BUF bytes to a FIFO are atomic, so that lines are not
+# interleaved with those of other processes writing to the command file
+PIPE_BUF = getattr(select, "PIPE_BUF", 4096)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\r", "").replace("\n", "\\n")
+
+
+def format_command(report: Report) -> str:
+    """Format a report as the external command submitting it as a passive
+    check result, the same way the ``nsca`` daemon does.  Reports without a
+    service are host check results."""
+    if report.service:
+        return (
+            f"[{report.timestamp}] PROCESS_SERVICE_CHECK_RESULT;"
+            f"{report.hostname};{report.service};{report.state.value};"
+            f"{_escape(report.message)}\n"
+        )
+    return (
+        f"[{report.timestamp}] PROCESS_HOST_CHECK_RESULT;"
+        f"{report.hostname};{report.state.value};{_escape(report.message)}\n"
+    )
+
+
+def format_check_result(report: Report) -> str:
+    """Format a report as an entry of a Nagios check result file"""
+    lines = [
+        f"host_name={report.hostname}",
+        f"service_description={report.service}" if report.service else None,
+        "check_type=1",
+        "check_options=0",
+        "scheduled_check=0",
+        "reschedule_check=0",
+        "latency=0",
+        f"start_time={report.timestamp}.0",
+        f"finish_time={report.timestamp}.0",
+        "early_timeout=0",
+        "exited_ok=1",
+        f"return_code={report.state.value}",
+        f"output={_escape(report.message)}",
+    ]
+    return "".join(f"{line}\n" for line in lines if line is not None) + "\n"
+
+
+class CommandFileWriter:
+    def __init__(
+        self,
+        path: str,
+        append: bool = False,
+        atomic_writes: bool = True,
+        reopen_interval: float = 1.0,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+        """Write reports as external commands to the Nagios/Centreon command
+        file.
+
+        All reports passed to :py:meth`write_reports` are formatted into one
+        buffer and written by as few system calls as possible, in a thread
+        so that a slow reader does not block the event loop.  If the reader
+        closes the pipe, it is reopened and the rest of the buffer written
+        once a reader is back.
+
+        :param path: str
+            Path of the command file, usually a FIFO
+        :param append: bool
+            Append to a regular file instead, creating it if needed, like
+            ``append_to_file`` of ``nsca.cfg``
+        :param atomic_writes: bool
+            Split writes at line boundaries into chunks of at most
+            :py:data`PIPE_BUF` bytes, which the kernel writes to a FIFO
+            atomically.  Only disable this if no other process writes to
+            the command file.
+        :param reopen_interval: float
+            Seconds to wait before trying again if the command file cannot be
+            opened, for example because Nagios is not running
+        """
+        self.path = path
+        self.append = append
+        self.atomic_writes = atomic_writes and not append
+        self.reopen_interval = reopen_interval
+        self._loop = loop
+        self._fd: Optional[int] = None
+
+        self.written_reports = 0
+        self.writes = 0
+        self.reopens = 0
+
+    def _open(self):
+        if self.append:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        else:
+            # Fail instead of blocking if no process has the FIFO open for
+            # reading, then write blocking from the writer thread.
+            flags = os.O_WRONLY | os.O_NONBLOCK
+        fd = os.open(self.path, flags, 0o660)
+        os.set_blocking(fd, True)
+        self._fd = fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _chunks(self, data: bytes) -> List[bytes]:
+        if not self.atomic_writes or len(data) <= PIPE_BUF:
+            return [data]
+
+        chunks: List[bytes] = list()
+        start = 0
+        while len(data) - start > PIPE_BUF:
+            end = data.rfind(b"\n", start, start + PIPE_BUF) + 1
+            if end <= start:
+                # A single line longer than PIPE_BUF cannot be written atomically
+                end = data.find(b"\n", start) + 1 or len(data)
+            chunks.append(data[start:end])
+            start = end
+        if start < len(data):
+            chunks.append(data[start:])
+        return chunks
+
+    def _write(self, data: bytes) -> bytes:
+        """Write ``data`` and return the part that is left to write after the
+        reader closed the command file"""
+        chunks = self._chunks(data)
+        for index, chunk in enumerate(chunks):
+            view = memoryview(chunk)
+            while view:
+                try:
+                    written = os.write(self._fd, view)
+                except BrokenPipeError:
+                    logger.warning(f"Command file {self.path} was closed by reader")
+                    self.close()
+                    self.reopens += 1
+                    # A partially written chunk is written again as a whole,
+                    # the reader of the broken pipe has not seen its end.
+                    return b"".join(chunks[index:])
+                self.writes += 1
+                view = view[written:]
+        return b""
+
+    async def _reopen(self):
+        # Wait here rather than in the writer thread, so that waiting for
+        # Nagios to come back can be cancelled.
+        while True:
+            try:
+                self._open()
+                return
+            except OSError as e:
+                if e.errno not in (errno.ENXIO, errno.ENOENT, errno.EAGAIN):
+                    raise
+                logger.warning(
+                    f"Cannot open command file {self.path}, is Nagios running? ({e})"
+                )
+                await asyncio.sleep(self.reopen_interval)
+
+    async def write_reports(self, reports: Sequence[Report]):
+        """Write all reports as external commands"""
+        if not reports:
+            return
+        data = "".join(format_command(report) for report in reports).encode("utf-8")
+        loop = self._loop or asyncio.get_event_loop()
+        while data:
+            if self._fd is None:
+                await self._reopen()
+            data = await loop.run_in_executor(None, self._write, data)
+        self.written_reports += len(reports)
+
+
+class CheckResultWriter:
+    def __init__(self, path: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Write reports to check result files in the ``check_result_path``
+        directory of Nagios, bypassing the command file.
+
+        All reports passed to :py:meth`write_reports` are written to a single
+        check result file.
+        """
+        self.path = path
+        self._loop = loop
+
+        self.written_reports = 0
+        self.writes = 0
+
+    def _create(self) -> (int, str):
+        # Nagios only picks up files named "c" followed by six characters
+        alphabet = string.ascii_letters + string.digits
+        while True:
+            name = "c" + "".join(random.choice(alphabet) for _ in range(6))
+            path = os.path.join(self.path, name)
+            try:
+                return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o660), path
+            except FileExistsError:
+                continue
+
+    def _write(self, data: bytes):
+        fd, path = self._create()
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        # Nagios reads a check result file only once its ".ok" file exists
+        os.close(os.open(f"{path}.ok", os.O_WRONLY | os.O_CREAT, 0o660))
+        self.writes += 1
+
+    async def write_reports(self, reports: Sequence[Report]):
+        """Write all reports to one new check result file"""
+        if not reports:
+            return
+        data = (
+            "### NSCA Passive Check Result ###\n"
+            f"# Time: {time.ctime()}\n"
+            f"file_time={int(time.time())}\n\n"
+            + "".join(format_check_result(report) for report in reports)
+        ).encode("utf-8")
+        loop = self._loop or asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._write, data)
+        self.written_reports += len(reports)
+
+
+def fresh_reports(
+    reports: Iterable[Report], max_packet_age: int, now: Optional[float] = None
+) -> List[Report]:
+    """Return the reports whose timestamp is no more than ``max_packet_age``
+    seconds away from ``now``, like the ``max_packet_age`` option of
+    ``nsca``.  A ``max_packet_age`` of 0 keeps all reports."""
+    reports = list(reports)
+    if max_packet_age <= 0:
+        return reports
+    if now is None:
+        now = time.time()
+    return [r for r in reports if abs(now - r.timestamp) <= max_packet_age]
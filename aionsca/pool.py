@@ -0,0 +1,312 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from typing import Iterable, List, Optional, Union
+
+from .client import Client, ReportTuple
+from .crypto import Method
+from .state import State
+
+logger = logging.getLogger(__name__)
+
+
+class _Session:
+    def __init__(self, index: int, client: Client):
+        self.index = index
+        self.client = client
+        self.alive = False
+        self.in_flight = 0
+        self.reconnect_task: Optional[asyncio.Task] = None
+
+    def __repr__(self):
+        return (
+            f"<_Session #{self.index}: "
+            f"alive={self.alive}, in_flight={self.in_flight}>"
+        )
+
+
+class Pool:
+    def __init__(
+        self,
+        size: int = 4,
+        host: str = "localhost",
+        port: int = 5667,
+        encryption_method: Union[Method, int, str] = Method.PLAINTEXT,
+        password: str = "",
+        reconnect_interval: float = 1.0,
+        acquire_timeout: Optional[float] = 10.0,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        **client_kwargs,
+    ):
+        """A pool of NSCA client connections
+
+        Reports are sent over the session with the fewest reports in flight.
+        Each session performs its own handshake and thus uses its own
+        initialization vector, timestamp and :py:class`Crypter`.  Sessions
+        whose connection fails are reconnected in the background while the
+        remaining sessions keep sending.
+
+        :param size: int
+            Number of concurrent connections to keep open
+        :param host: str
+            Address of NSCA host to send reports to
+        :param port: int
+            Port of NSCA host
+        :param encryption_method: Union[Method, int, str]
+            Method used for encrypting report, parsed with
+            :py:meth`aionsca.EncryptionMethod.parse`
+        :param password: str
+            Password used to encrypt reports
+        :param reconnect_interval: float
+            Seconds to wait between attempts to reconnect a failed session
+        :param acquire_timeout: Optional[float]
+            Seconds to wait for a connected session if all sessions are
+            currently reconnecting, or ``None`` to wait indefinitely
+        :param loop: Optional[asyncio.AbstractEventLoop]
+            Event loop to open connections in
+        :param client_kwargs:
+            Further keyword arguments passed to each session's
+            :py:class`Client`
+        """
+        if size < 1:
+            raise ValueError(f"Pool size must be at least 1, got {size}")
+
+        self._host = host
+        self._port = port
+        self._reconnect_interval = reconnect_interval
+        self._acquire_timeout = acquire_timeout
+        self._sessions = [
+            _Session(
+                index,
+                Client(
+                    host=host,
+                    port=port,
+                    encryption_method=encryption_method,
+                    password=password,
+                    loop=loop,
+                    **client_kwargs,
+                ),
+            )
+            for index in range(size)
+        ]
+        self._available = asyncio.Event()
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def connected(self) -> int:
+        """Number of sessions currently connected"""
+        return sum(1 for session in self._sessions if session.alive)
+
+    async def connect(self):
+        """Connect all sessions of this pool.
+
+        Sessions that fail to connect are reconnected in the background.
+        Raises a :py:class`ConnectionError` if no session could be connected.
+        """
+        self._closed = False
+        results = await asyncio.gather(
+            *(session.client.connect() for session in self._sessions),
+            return_exceptions=True,
+        )
+
+        error = None
+        for session, result in zip(self._sessions, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to connect session #{session.index}: {result}")
+                error = result
+                self._schedule_reconnect(session)
+            else:
+                self._mark_alive(session)
+
+        if not self.connected:
+            await self.disconnect()
+            raise ConnectionError(
+                f"Failed to connect to NSCA host {self._host}:{self._port}: {error}"
+            )
+
+    async def disconnect(self, flush=False):
+        """Disconnect all sessions, including those reconnecting in the
+        background.
+
+        :param flush: bool
+            Drain the send buffers of connected sessions first, see
+            :py:meth`Client.disconnect`
+        """
+        self._closed = True
+        reconnecting = list()
+        for session in self._sessions:
+            if session.reconnect_task is not None:
+                session.reconnect_task.cancel()
+                reconnecting.append(session.reconnect_task)
+                session.reconnect_task = None
+        # A cancelled reconnect may have opened a connection already
+        await asyncio.gather(*reconnecting, return_exceptions=True)
+
+        await asyncio.gather(
+            *(
+                session.client.disconnect(flush=flush and session.alive)
+                for session in self._sessions
+            )
+        )
+        for session in self._sessions:
+            session.alive = False
+        self._available.clear()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *_ex):
+        await self.disconnect(flush=True)
+
+    async def send_report(
+        self,
+        host: str,
+        service: Optional[str],
+        state: State,
+        message: str,
+        retries: int = 5,
+    ):
+        """Send a single report over the least busy session, see
+        :py:meth`Client.send_report`.
+
+        :param retries: int
+            Number of sessions to try before raising a
+            :py:class`ConnectionError`
+        """
+        (error,) = await self.send_reports(
+            [(host, service, state, message)], retries=retries
+        )
+        if error is not None:
+            raise error
+
+    async def send_reports(
+        self, reports: Iterable[ReportTuple], retries: int = 5
+    ) -> List[Optional[Exception]]:
+        """Send a batch of reports over the least busy session, see
+        :py:meth`Client.send_reports`.
+
+        Reports that could not be sent because the session's connection
+        failed are retried on another session.
+
+        :param retries: int
+            Number of sessions to try before giving up on a report
+        """
+        reports = list(reports)
+        results: List[Optional[Exception]] = [None] * len(reports)
+        pending = list(range(len(reports)))
+
+        for _ in range(retries):
+            try:
+                session = await self._acquire()
+            except ConnectionError as e:
+                for index in pending:
+                    results[index] = e
+                break
+
+            session.in_flight += len(pending)
+            try:
+                session_results = await session.client.send_reports(
+                    [reports[index] for index in pending], retries=1
+                )
+            finally:
+                session.in_flight -= len(pending)
+
+            failed = list()
+            for index, result in zip(pending, session_results):
+                results[index] = result
+                if isinstance(result, ConnectionError):
+                    failed.append(index)
+
+            if failed and session.alive:
+                logger.warning(
+                    f"Session #{session.index} failed, reconnecting in background"
+                )
+                session.alive = False
+                self._schedule_reconnect(session)
+
+            pending = failed
+            if not pending:
+                break
+
+        return results
+
+    def _least_busy(self) -> Optional[_Session]:
+        alive = [session for session in self._sessions if session.alive]
+        if alive:
+            return min(alive, key=lambda session: session.in_flight)
+        return None
+
+    async def _acquire(self) -> _Session:
+        # Only set up a timeout if all sessions are reconnecting
+        session = self._least_busy()
+        if session is not None:
+            return session
+
+        async def wait_for_session():
+            while True:
+                session = self._least_busy()
+                if session is not None:
+                    return session
+                self._available.clear()
+                await self._available.wait()
+
+        try:
+            return await asyncio.wait_for(
+                wait_for_session(), timeout=self._acquire_timeout
+            )
+        except asyncio.TimeoutError:
+            raise ConnectionError(
+                f"No connection to NSCA host {self._host}:{self._port} "
+                f"available after {self._acquire_timeout}s"
+            ) from None
+
+    def _mark_alive(self, session: _Session):
+        session.alive = True
+        self._available.set()
+
+    def _schedule_reconnect(self, session: _Session):
+        if self._closed:
+            return
+        if session.reconnect_task is None or session.reconnect_task.done():
+            session.reconnect_task = asyncio.ensure_future(self._reconnect(session))
+
+    async def _reconnect(self, session: _Session):
+        attempt = 0
+        while not self._closed:
+            attempt += 1
+            try:
+                await session.client.reconnect()
+            except (OSError, asyncio.IncompleteReadError) as e:
+                logger.warning(
+                    f"Failed to reconnect session #{session.index} "
+                    f"(attempt {attempt}): {e}"
+                )
+                await asyncio.sleep(self._reconnect_interval)
+            else:
+                logger.info(f"Reconnected session #{session.index}")
+                self._mark_alive(session)
+                return
@@ -22,6 +22,8 @@ import struct
 import binascii
 import random
 import string
+from enum import Enum
+from typing import Optional, Sequence, Tuple, Union
 
 from .state import State
 
@@ -37,19 +39,74 @@ def random_bytes_padded(s: str, max_length: int) -> bytes:
     len_diff = max_length - len(to_pad)
     assert len_diff >= 0
     if len_diff > 0:
-        to_pad += random_chars(len_diff - 1)
+        # Like send_nsca, fill with random characters but keep the last byte
+        # zeroed.
+        to_pad += random_chars(len_diff - 1) + b"\0"
 
     assert len(to_pad) == max_length
     return to_pad
 
 
+class Padding(Enum):
+    """Source of the bytes used to fill report fields after their content
+
+    ``RANDOM``
+        fresh random lowercase characters for every field, as generated by
+        :py:func`random_chars`
+    ``POOL``
+        random lowercase characters copied from a random offset into a pool
+        that is generated once
+    ``ZERO``
+        zero bytes.  Only use this if encryption is disabled or the
+        plaintext of the padding need not be hidden.
+    """
+
+    RANDOM = "random"
+    POOL = "pool"
+    ZERO = "zero"
+
+    def __str__(self):
+        return self.value
+
+    @staticmethod
+    def parse(value: Union[str, "Padding"]) -> "Padding":
+        if isinstance(value, Padding):
+            return value
+
+        try:
+            return Padding(str(value).lower())
+        except ValueError:
+            return Padding[str(value).upper()]
+
+
+_PADDING_POOL_SIZE = 1 << 16
+_padding_pool = memoryview(random_chars(_PADDING_POOL_SIZE))
+_zeros = memoryview(bytes(_PADDING_POOL_SIZE))
+
+
+def fill_padding(buffer: bytearray, start: int, end: int, padding: Padding):
+    """Fill ``buffer[start:end]`` with padding bytes"""
+    length = end - start
+    if length <= 0:
+        return
+
+    if padding is Padding.POOL:
+        offset = random.randrange(_PADDING_POOL_SIZE - length)
+        buffer[start:end] = _padding_pool[offset : offset + length]
+    elif padding is Padding.ZERO:
+        buffer[start:end] = _zeros[:length]
+    else:
+        buffer[start:end] = random_chars(length)
+
+
 def chop_padding(b: bytes) -> str:
     content: bytes = b.split(b"\0")[0]
-    return content.decode("utf-8")
+    return content.decode("utf-8", errors="replace")
 
 
 class InitPacket:
-    _FMT = "!128sL"
+    IV_SIZE = 128
+    _FMT = f"!{IV_SIZE}sL"
     SIZE = struct.calcsize(_FMT)
 
     @classmethod
@@ -84,53 +141,307 @@ class ReportPacket:
     _FMT = f"!hxxLLh{MAX_LENGTH_HOSTNAME}s{MAX_LENGTH_SERVICE}s{MAX_LENGTH_MESSAGE}sxx"
     SIZE = struct.calcsize(_FMT)
 
+    _HEADER_FMT = "!hxxLLh"
+    _OFFSET_CRC = 4
+    _OFFSET_HOSTNAME = struct.calcsize(_HEADER_FMT)
+    _OFFSET_SERVICE = _OFFSET_HOSTNAME + MAX_LENGTH_HOSTNAME
+    _OFFSET_MESSAGE = _OFFSET_SERVICE + MAX_LENGTH_SERVICE
+    _OFFSET_TRAILER = _OFFSET_MESSAGE + MAX_LENGTH_MESSAGE
+
     @classmethod
     def pack(
-        cls, hostname: str, service: str, state: State, message: str, timestamp: int
+        cls,
+        hostname: str,
+        service: str,
+        state: State,
+        message: str,
+        timestamp: int,
+        padding: Padding = Padding.POOL,
     ) -> bytes:
-        hostname = random_bytes_padded(hostname, cls.MAX_LENGTH_HOSTNAME)
-        service = random_bytes_padded(service, cls.MAX_LENGTH_SERVICE)
-        message = random_bytes_padded(message, cls.MAX_LENGTH_MESSAGE)
-        crc = 0
-        packet = bytearray(
-            struct.pack(
-                cls._FMT,
-                cls.PACKET_VERSION,
-                crc,
-                timestamp,
-                State(state).value,
-                hostname,
-                service,
-                message,
-            )
+        packet = bytearray(cls.SIZE)
+        cls.pack_into(
+            packet,
+            0,
+            hostname=hostname,
+            service=service,
+            state=state,
+            message=message,
+            timestamp=timestamp,
+            padding=padding,
         )
-        crc = binascii.crc32(packet) & 0xFFFFFFFF
-        struct.pack_into("!L", packet, 4, crc)
         return bytes(packet)
 
     @classmethod
-    def unpack(cls, packet: bytes) -> (str, str, State, str, int):
-        version, crc, timestamp, state, hostname, service, message = struct.unpack(
-            cls._FMT, packet
+    def pack_into(
+        cls,
+        buffer: bytearray,
+        offset: int,
+        hostname: str,
+        service: str,
+        state: State,
+        message: str,
+        timestamp: int,
+        padding: Padding = Padding.POOL,
+    ):
+        """Pack a report into ``buffer``, starting at ``offset``.
+
+        The packet is written in place, ``buffer`` must hold at least
+        :py:attr`SIZE` bytes after ``offset``.  The previous contents of that
+        range are overwritten entirely, so buffers can be reused.
+        """
+        struct.pack_into(
+            cls._HEADER_FMT,
+            buffer,
+            offset,
+            cls.PACKET_VERSION,
+            0,
+            timestamp,
+            State(state).value,
+        )
+        cls._pack_field(
+            buffer,
+            offset + cls._OFFSET_HOSTNAME,
+            hostname,
+            cls.MAX_LENGTH_HOSTNAME,
+            padding,
+        )
+        cls._pack_field(
+            buffer,
+            offset + cls._OFFSET_SERVICE,
+            service,
+            cls.MAX_LENGTH_SERVICE,
+            padding,
+        )
+        cls._pack_field(
+            buffer,
+            offset + cls._OFFSET_MESSAGE,
+            message,
+            cls.MAX_LENGTH_MESSAGE,
+            padding,
+        )
+        trailer = offset + cls._OFFSET_TRAILER
+        buffer[trailer : trailer + 2] = b"\0\0"
+
+        with memoryview(buffer) as view:
+            crc = binascii.crc32(view[offset : offset + cls.SIZE]) & 0xFFFFFFFF
+        struct.pack_into("!L", buffer, offset + cls._OFFSET_CRC, crc)
+
+    @classmethod
+    def pack_many(
+        cls,
+        reports: Sequence[Tuple[str, str, State, str]],
+        timestamp: int,
+        padding: Padding = Padding.POOL,
+    ) -> bytearray:
+        """Pack reports given as tuples of ``(hostname, service, state,
+        message)`` into one contiguous buffer of ``len(reports) * SIZE`` bytes.
+
+        The buffer can be encrypted by a single call to
+        :py:meth`Crypter.encrypt`, since NSCA uses ciphers in CFB mode
+        which encrypt a stream of concatenated packets the same way as each
+        packet on its own.
+        """
+        buffer = bytearray(len(reports) * cls.SIZE)
+        for offset, (hostname, service, state, message) in zip(
+            range(0, len(buffer), cls.SIZE), reports
+        ):
+            cls.pack_into(
+                buffer,
+                offset,
+                hostname=hostname,
+                service=service,
+                state=state,
+                message=message,
+                timestamp=timestamp,
+                padding=padding,
+            )
+        return buffer
+
+    @staticmethod
+    def _pack_field(
+        buffer: bytearray, offset: int, value: str, max_length: int, padding: Padding
+    ):
+        # Same layout as random_bytes_padded: the encoded value, a terminating
+        # zero byte, padding and a zero byte at the very end of the field.
+        encoded = value.encode("utf-8")[: max_length - 1]
+        end = offset + len(encoded)
+        buffer[offset:end] = encoded
+        buffer[end] = 0
+        fill_padding(buffer, end + 1, offset + max_length - 1, padding)
+        buffer[offset + max_length - 1] = 0
+
+    @classmethod
+    def checksum(cls, buffer, offset: int = 0) -> int:
+        """Compute the CRC32 of the packet starting at ``offset`` in
+        ``buffer``, with its CRC field taken as zero.
+
+        The packet is not copied, the CRC is computed over views of the
+        parts before and after the CRC field.
+        """
+        with memoryview(buffer) as view:
+            crc_start = offset + cls._OFFSET_CRC
+            crc_end = crc_start + 4
+            crc = binascii.crc32(view[offset:crc_start])
+            crc = binascii.crc32(b"\0\0\0\0", crc)
+            crc = binascii.crc32(view[crc_end : offset + cls.SIZE], crc)
+        return crc & 0xFFFFFFFF
+
+    @classmethod
+    def unpack(cls, packet: bytes, verify_crc: bool = True) -> "Report":
+        """Unpack a report packet.
+
+        The returned :py:class`Report` unpacks like the tuple
+        ``(hostname, service, state, message, timestamp)``.
+        """
+        if len(packet) != cls.SIZE:
+            raise struct.error(
+                f"unpack requires a buffer of {cls.SIZE} bytes, got {len(packet)}"
+            )
+        if not isinstance(packet, bytes):
+            packet = bytes(packet)
+        return cls.unpack_from(packet, 0, verify_crc=verify_crc)
+
+    @classmethod
+    def unpack_from(
+        cls, buffer: bytes, offset: int = 0, verify_crc: bool = True
+    ) -> "Report":
+        """Unpack the packet starting at ``offset`` in ``buffer``, see
+        :py:meth`unpack`.
+
+        Only the header is decoded right away, the text fields are decoded
+        from ``buffer`` when accessed.  The returned report keeps a reference
+        to ``buffer``, which must therefore not be modified afterwards.
+
+        If ``verify_crc`` is set, the packet's checksum is checked before
+        anything else is decoded.  A mismatch raises
+        :py:class`ReportChecksumMismatchError`, which usually means that the
+        packet was encrypted with a different password or method.
+        """
+        if verify_crc:
+            (expected,) = struct.unpack_from("!L", buffer, offset + cls._OFFSET_CRC)
+            actual = cls.checksum(buffer, offset)
+            if expected != actual:
+                raise ReportChecksumMismatchError(expected, actual)
+
+        version, _crc, timestamp, state = struct.unpack_from(
+            cls._HEADER_FMT, buffer, offset
         )
         if version != cls.PACKET_VERSION:
             raise ReportUnexpectedVersionError(version)
-        # TODO: CRC check
-        if crc or False:
-            pass
 
+        return Report(buffer, offset, State(state), timestamp)
+
+
+class Report:
+    """A report received from an NSCA client
+
+    The text fields ``hostname``, ``service`` and ``message`` are decoded from
+    the packet only when first accessed.  Invalid UTF-8, e.g. a multi-byte
+    character cut off by a client truncating a long field, is replaced by
+    U+FFFD rather than raising in the consumer.  For compatibility, a report behaves
+    like the tuple ``(hostname, service, state, message, timestamp)``:
+
+    >>> hostname, service, state, message, timestamp = report
+    """
+
+    __slots__ = (
+        "_buffer",
+        "_offset",
+        "state",
+        "timestamp",
+        "_hostname",
+        "_service",
+        "_message",
+    )
+
+    _FIELDS = ("hostname", "service", "state", "message", "timestamp")
+
+    def __init__(self, buffer: bytes, offset: int, state: State, timestamp: int):
+        self._buffer = buffer
+        self._offset = offset
+        self.state = state
+        self.timestamp = timestamp
+        self._hostname: Optional[str] = None
+        self._service: Optional[str] = None
+        self._message: Optional[str] = None
+
+    @classmethod
+    def from_fields(
+        cls, hostname: str, service: str, state: State, message: str, timestamp: int
+    ) -> "Report":
+        """Create a report from already decoded fields"""
+        report = cls(b"", 0, State(state), timestamp)
+        report._hostname = hostname
+        report._service = service
+        report._message = message
+        return report
+
+    def _decode(self, start: int, length: int) -> str:
+        start += self._offset
+        end = self._buffer.find(b"\0", start, start + length)
+        if end < 0:
+            end = start + length
+        return self._buffer[start:end].decode("utf-8", errors="replace")
+
+    @property
+    def hostname(self) -> str:
+        if self._hostname is None:
+            self._hostname = self._decode(
+                ReportPacket._OFFSET_HOSTNAME, ReportPacket.MAX_LENGTH_HOSTNAME
+            )
+        return self._hostname
+
+    @property
+    def service(self) -> str:
+        if self._service is None:
+            self._service = self._decode(
+                ReportPacket._OFFSET_SERVICE, ReportPacket.MAX_LENGTH_SERVICE
+            )
+        return self._service
+
+    @property
+    def message(self) -> str:
+        if self._message is None:
+            self._message = self._decode(
+                ReportPacket._OFFSET_MESSAGE, ReportPacket.MAX_LENGTH_MESSAGE
+            )
+        return self._message
+
+    def _astuple(self) -> Tuple[str, str, State, str, int]:
+        return self.hostname, self.service, self.state, self.message, self.timestamp
+
+    def __iter__(self):
+        return iter(self._astuple())
+
+    def __len__(self):
+        return 5
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return getattr(self, self._FIELDS[index])
+        return self._astuple()[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (Report, tuple)):
+            return self._astuple() == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._astuple())
+
+    def __reduce__(self):
+        return Report.from_fields, self._astuple()
+
+    def __repr__(self):
         return (
-            chop_padding(hostname),
-            chop_padding(service),
-            State(state),
-            chop_padding(message),
-            timestamp,
+            f"Report(hostname={self.hostname!r}, service={self.service!r}, "
+            f"state={self.state!r}, message={self.message!r}, "
+            f"timestamp={self.timestamp!r})"
         )
 
 
 class PacketDecodeError(ValueError):
-    def __init__(self, *args, **kwargs):
-        super().__init__(self, *args, **kwargs)
+    pass
 
 
 class ReportChecksumMismatchError(PacketDecodeError):
@@ -138,8 +449,7 @@ class ReportChecksumMismatchError(PacketDecodeError):
         self.expected = expected
         self.actual = actual
         super().__init__(
-            self,
-            f"Checksum mismatch in packet: expected {expected:04x}, got {actual:04x}",
+            f"Checksum mismatch in packet: expected {expected:08x}, got {actual:08x}"
         )
 
 
@@ -147,6 +457,4 @@ class ReportUnexpectedVersionError(PacketDecodeError):
     def __init__(self, version: int):
         self.version = version
         self.bytes = struct.pack("!h", self.version)
-        super().__init__(
-            self, f"Unexpected version number: {version} (bytes: {self.bytes})"
-        )
+        super().__init__(f"Unexpected version number: {version} (bytes: {self.bytes})")
@@ -0,0 +1,233 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import OrderedDict
+from enum import Enum
+from itertools import count
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    List,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+T = TypeVar("T")
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    DROP_NEWEST = "drop-newest"
+    COALESCE = "coalesce"
+
+    def __str__(self):
+        return self.value
+
+    @staticmethod
+    def parse(value: Union[str, "OverflowPolicy"]) -> "OverflowPolicy":
+        """Parse an overflow policy from its value or name:
+        >>> assert OverflowPolicy.parse("drop-oldest") == OverflowPolicy.parse("DROP_OLDEST")
+        """
+
+        if isinstance(value, OverflowPolicy):
+            return value
+
+        try:
+            return OverflowPolicy(str(value).lower())
+        except ValueError:
+            return OverflowPolicy[str(value).upper().replace("-", "_")]
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ReportQueue(Generic[T]):
+    def __init__(
+        self,
+        maxsize: int,
+        policy: Union[OverflowPolicy, str] = OverflowPolicy.BLOCK,
+        key: Optional[Callable[[T], Hashable]] = None,
+        supersedes: Optional[Callable[[T, T], bool]] = None,
+    ):
+        """A bounded FIFO queue that handles overflow according to an
+        :py:class`OverflowPolicy`
+
+        :param maxsize: int
+            Maximum number of items in the queue
+        :param policy: Union[OverflowPolicy, str]
+            What to do when an item is put into a full queue:
+
+            ``BLOCK``
+                :py:meth`put` waits until space is available
+            ``DROP_OLDEST``
+                the oldest queued item is dropped to make room
+            ``DROP_NEWEST``
+                the new item is dropped
+            ``COALESCE``
+                a queued item with the same key as the new item is replaced
+                in place, whether or not the queue is full.  If there is no
+                such item and the queue is full, the oldest item is dropped.
+        :param key: Optional[Callable[[T], Hashable]]
+            Function returning the key by which items are coalesced, required
+            for policy ``COALESCE``
+        :param supersedes: Optional[Callable[[T, T], bool]]
+            Called as ``supersedes(queued, new)`` for a queued item with the
+            same key as a new item, returns whether the new item may replace
+            the queued one.  If not, the new item is appended instead.  By
+            default, newer items always replace older ones.
+        """
+        if maxsize < 1:
+            raise ValueError(f"Queue size must be at least 1, got {maxsize}")
+
+        self.maxsize = maxsize
+        self.policy = OverflowPolicy.parse(policy)
+        if self.policy is OverflowPolicy.COALESCE and key is None:
+            raise ValueError(f"Overflow policy {self.policy} requires a key function")
+        self._key = key
+        self._supersedes = supersedes
+
+        self._items: Dict[int, T] = OrderedDict()
+        self._latest: Dict[Any, int] = dict()
+        self._seq = count()
+        self._unfinished = 0
+
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def full(self) -> bool:
+        return len(self._items) >= self.maxsize
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def put_nowait(self, item: T) -> bool:
+        """Put an item into the queue without waiting.
+
+        Returns ``False`` if the item was dropped.  Raises :py:class`QueueFull`
+        if the queue is full and the policy is ``BLOCK``.
+        """
+        if self.policy is OverflowPolicy.COALESCE and self._coalesce(item):
+            return True
+
+        if self.full():
+            if self.policy is OverflowPolicy.BLOCK:
+                raise QueueFull()
+            elif self.policy is OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+                return False
+            else:
+                self._pop_oldest()
+                self._unfinished -= 1
+                self.dropped += 1
+
+        self._append(item)
+        return True
+
+    async def put(self, item: T) -> bool:
+        """Put an item into the queue, waiting for space if the queue is full
+        and the policy is ``BLOCK``.
+
+        Returns ``False`` if the item was dropped.
+        """
+        while True:
+            try:
+                return self.put_nowait(item)
+            except QueueFull:
+                await self._not_full.wait()
+
+    async def get_batch(self, max_items: int) -> List[T]:
+        """Remove and return up to ``max_items`` items, waiting until at least
+        one item is available.
+
+        Call :py:meth`task_done` with the number of returned items once they
+        are processed.
+        """
+        while not self._items:
+            await self._not_empty.wait()
+
+        batch = list()
+        while self._items and len(batch) < max_items:
+            batch.append(self._pop_oldest())
+        return batch
+
+    def task_done(self, n: int = 1):
+        self._unfinished -= n
+        if self._unfinished <= 0:
+            self._unfinished = 0
+            self._idle.set()
+
+    async def join(self):
+        """Wait until all items put into the queue have been processed"""
+        await self._idle.wait()
+
+    def _append(self, item: T):
+        seq = next(self._seq)
+        self._items[seq] = item
+        if self._key is not None:
+            self._latest[self._key(item)] = seq
+
+        self._unfinished += 1
+        self.high_water = max(self.high_water, len(self._items))
+        self._idle.clear()
+        self._not_empty.set()
+        if self.full():
+            self._not_full.clear()
+
+    def _coalesce(self, item: T) -> bool:
+        seq = self._latest.get(self._key(item))
+        if seq is None:
+            return False
+        if self._supersedes is not None and not self._supersedes(
+            self._items[seq], item
+        ):
+            return False
+
+        self._items[seq] = item
+        self.coalesced += 1
+        return True
+
+    def _pop_oldest(self) -> T:
+        seq, item = self._items.popitem(last=False)
+        if self._key is not None:
+            key = self._key(item)
+            if self._latest.get(key) == seq:
+                del self._latest[key]
+
+        if not self._items:
+            self._not_empty.clear()
+        self._not_full.set()
+        return item
@@ -0,0 +1,127 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from typing import List, Optional, Sequence, Union
+
+from .client import Client
+from .pool import Pool
+from .protocol import Report
+from .server import Server
+
+logger = logging.getLogger(__name__)
+
+
+class Relay:
+    def __init__(
+        self,
+        servers: Sequence[Server],
+        upstream: Union[Client, Pool],
+        batch_size: int = 1000,
+        max_in_flight: Optional[int] = None,
+    ):
+        """Forward reports received by local servers to an upstream NSCA host
+
+        Reports from all connections to ``servers`` are decoded and sent on
+        in batches over the persistent connections of ``upstream``, so that
+        the upstream host sees a few long-lived connections instead of one
+        per local sender.  Reports are stamped with the upstream host's time
+        when they are sent on.
+
+        :param servers: Sequence[Server]
+            Servers accepting local connections, for example one on a TCP
+            port and one on a Unix domain socket
+        :param upstream: Union[Client, Pool]
+            Client or pool connected to the upstream NSCA host
+        :param batch_size: int
+            Maximum number of reports sent upstream at once
+        :param max_in_flight: Optional[int]
+            Maximum number of batches sent upstream concurrently, defaults to
+            the size of ``upstream`` if it is a :py:class`Pool`, 1 otherwise.
+            While that many batches are in flight, reports queue up in the
+            servers, which stop reading once their queue is full.
+        """
+        self.servers = list(servers)
+        self.upstream = upstream
+        self.batch_size = batch_size
+        if max_in_flight is None:
+            max_in_flight = upstream.size if isinstance(upstream, Pool) else 1
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._tasks: List[asyncio.Task] = list()
+
+        self.relayed_reports = 0
+        self.failed_reports = 0
+
+    async def start(self):
+        """Start the servers and connect upstream"""
+        await self.upstream.connect()
+        for server in self.servers:
+            await server.start_server()
+
+    async def close(self):
+        """Stop the servers, wait for batches in flight and disconnect
+        upstream"""
+        for server in self.servers:
+            await server.close()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.upstream.disconnect(flush=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_ex):
+        await self.close()
+
+    async def run(self):
+        """Forward reports until cancelled"""
+        await asyncio.gather(*(self._forward_from(server) for server in self.servers))
+
+    async def _forward_from(self, server: Server):
+        async for batch in server.reports_batched(self.batch_size):
+            await self._in_flight.acquire()
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.append(task)
+            task.add_done_callback(self._sent)
+
+    def _sent(self, task: asyncio.Task):
+        self._in_flight.release()
+        self._tasks.remove(task)
+
+    async def _send(self, batch: List[Report]):
+        reports = [
+            (report.hostname, report.service, report.state, report.message)
+            for report in batch
+        ]
+        try:
+            results = await self.upstream.send_reports(reports)
+        except Exception as e:
+            results = [e] * len(reports)
+
+        errors = [e for e in results if e is not None]
+        self.relayed_reports += len(reports) - len(errors)
+        if errors:
+            self.failed_reports += len(errors)
+            logger.warning(
+                f"Failed to relay {len(errors)} of {len(reports)} report(s): "
+                f"{errors[0]}"
+            )
@@ -1,15 +1,264 @@
-from asyncio import StreamReader, StreamWriter, Queue, IncompleteReadError, start_server
+from asyncio import BufferedProtocol, Future, Task, ensure_future, get_event_loop, sleep
+from collections import deque
+from concurrent.futures import Executor
 from datetime import datetime
 from logging import getLogger
-from itertools import count
-from os import getrandom
+from os import unlink
+import socket
+from time import perf_counter
+from typing import Deque, Dict, List, Optional, Sequence, Set, Union
 
-from .protocol import InitPacket, ReportPacket, PacketDecodeError
-from .crypto import get_crypter_by_method, Method
+from .protocol import InitPacket, ReportPacket, ReportChecksumMismatchError
+from .crypto import (
+    Crypter,
+    KeyScheduleCache,
+    get_crypter_by_method,
+    key_schedules,
+    Method,
+)
+from .queue import OverflowPolicy, QueueFull, ReportQueue
+from .stats import Stats
+
+try:
+    from os import getrandom
+except ImportError:
+    # Only available on Linux
+    from os import urandom as getrandom
 
 logger = getLogger(__name__)
 
 
+class _ReportProtocol(BufferedProtocol):
+    """Receives report packets from a single client.
+
+    Incoming data is read into a buffer of several packets.  All complete
+    packets in the buffer are decrypted at once and unpacked in one go, the
+    remainder of an incomplete packet is kept for the next read.
+
+    The buffer starts out with room for two packets, as most clients send a
+    single one.  It grows to the server's ``read_packets`` once a read fills
+    it completely.
+    """
+
+    def __init__(self, server: "Server"):
+        self._server = server
+        self._buffer = bytearray(ReportPacket.SIZE * min(2, server.read_packets))
+        self._view = memoryview(self._buffer)
+        self._filled = 0
+        self._received = 0
+        self._transport = None
+        self._crypter: Optional[Crypter] = None
+        self._peer = None
+        self._backlog: List = list()
+        self._decrypt_started = 0.0
+        self._admitted = False
+        self._last_read = 0.0
+        self._packet_started: Optional[float] = None
+
+    @property
+    def _peer_host(self) -> Optional[str]:
+        return self._peer[0] if isinstance(self._peer, tuple) else None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._peer = transport.get_extra_info("peername")
+
+        refusal = self._server._admit(self)
+        if refusal is not None:
+            logger.warning(f"Refusing connection from {self._peer}: {refusal}")
+            transport.abort()
+            return
+        self._admitted = True
+        self._last_read = self._server._time()
+
+        timestamp = int(datetime.now().timestamp())
+        iv = getrandom(InitPacket.IV_SIZE)
+
+        self._crypter = get_crypter_by_method(
+            method=self._server.encryption_method,
+            iv=iv,
+            password=self._server.password,
+            rng=getrandom,
+            backend=self._server.crypto_backend,
+            key_cache=self._server.key_cache,
+        )
+
+        transport.write(InitPacket.pack(iv, timestamp))
+
+    def get_buffer(self, sizehint: int):
+        return self._view[self._filled :]
+
+    def buffer_updated(self, nbytes: int):
+        if self._transport.is_closing():
+            return
+
+        server = self._server
+        stats = server.stats
+        self._filled += nbytes
+        self._last_read = server._time()
+        if stats is not None:
+            stats.count("bytes_received", nbytes)
+        complete = self._filled - self._filled % ReportPacket.SIZE
+        if not complete:
+            if self._packet_started is None:
+                self._packet_started = self._last_read
+            return
+
+        if stats is not None:
+            # Time from the first byte of the oldest packet to the last byte
+            started = self._packet_started
+            stats.observe("read", 0.0 if started is None else self._last_read - started)
+
+        executor = server.crypto_executor
+        if executor is not None and complete >= server.crypto_offload_threshold:
+            # Decrypt in the executor and stop reading until that is done, so
+            # that packets are decrypted in the order they were received.
+            encrypted = bytes(self._view[:complete])
+            self._keep_remainder(complete)
+            self._transport.pause_reading()
+            loop = server.loop or get_event_loop()
+            future = loop.run_in_executor(executor, self._crypter.decrypt, encrypted)
+            if stats is not None:
+                self._decrypt_started = perf_counter()
+            future.add_done_callback(self._on_decrypted)
+            return
+
+        if stats is not None:
+            start = perf_counter()
+        decrypted = self._crypter.decrypt(self._view[:complete])
+        if stats is not None:
+            stats.observe("decrypt", perf_counter() - start)
+        self._keep_remainder(complete)
+        self._unpack(decrypted)
+
+    def _keep_remainder(self, complete: int):
+        remainder = self._filled - complete
+        full_size = ReportPacket.SIZE * self._server.read_packets
+        if self._filled == len(self._buffer) and len(self._buffer) < full_size:
+            # The client sends more than fits, read more packets at once
+            buffer = bytearray(full_size)
+            buffer[:remainder] = self._view[complete : self._filled]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+        else:
+            self._buffer[:remainder] = self._view[complete : self._filled]
+        self._filled = remainder
+        self._packet_started = self._last_read if remainder else None
+
+    def _on_decrypted(self, future: Future):
+        try:
+            decrypted = future.result()
+        except Exception:
+            logger.exception(f"Failed to decrypt packets from {self._peer}")
+            self._transport.close()
+            return
+
+        stats = self._server.stats
+        if stats is not None:
+            stats.observe("decrypt", perf_counter() - self._decrypt_started)
+        self._unpack(decrypted)
+        if not self._backlog and not self._transport.is_closing():
+            self._transport.resume_reading()
+
+    def _unpack(self, decrypted: bytes):
+        stats = self._server.stats
+        if stats is not None:
+            start = perf_counter()
+        complete = len(decrypted)
+        verify_crc = self._server.verify_crc
+        reports = list()
+        for offset in range(0, complete, ReportPacket.SIZE):
+            try:
+                reports.append(
+                    ReportPacket.unpack_from(decrypted, offset, verify_crc=verify_crc)
+                )
+            except ReportChecksumMismatchError as e:
+                self._server._rejected_reports += 1
+                logger.warning(
+                    f"Rejecting connection from {self._peer}: {e}. "
+                    f"Are encryption method and password configured correctly?"
+                )
+                self._transport.close()
+                break
+            except ValueError:
+                logger.exception(
+                    f"Failed to decode packet #{self._received + len(reports) + 1} "
+                    f"from {self._peer}"
+                )
+                self._transport.close()
+                break
+
+        if stats is not None:
+            stats.observe("unpack", perf_counter() - start)
+        if reports:
+            self._received += len(reports)
+            if stats is not None:
+                stats.count("reports_received", len(reports))
+            self._deliver(reports)
+
+    def _deliver(self, reports: List):
+        server = self._server
+        queue = server._received_reports
+        for index, report in enumerate(reports):
+            try:
+                queue.put_nowait(report)
+            except QueueFull:
+                if server.stats is not None:
+                    server._arrived(index)
+                # Stop reading from this client until the consumer catches up,
+                # so that it gets throttled by TCP flow control.
+                self._backlog = reports[index:]
+                self._transport.pause_reading()
+                self._server._paused.append(self)
+                return
+
+        if server.stats is not None:
+            server._arrived(len(reports))
+        self._backlog = list()
+
+    def _resume(self) -> bool:
+        """Deliver reports held back while paused, and resume reading if all
+        of them were delivered.  Returns whether reading was resumed."""
+        self._deliver(self._backlog)
+        if self._backlog:
+            return False
+
+        if not self._transport.is_closing():
+            self._transport.resume_reading()
+        return True
+
+    def connection_lost(self, exc: Optional[Exception]):
+        if self._admitted:
+            self._admitted = False
+            self._server._release(self)
+
+    def _timed_out(self, now: float) -> Optional[str]:
+        if not self._transport.is_reading():
+            # Paused for backpressure or decryption, not the client's fault
+            return None
+        server = self._server
+        if (
+            server.read_timeout is not None
+            and self._packet_started is not None
+            and now - self._packet_started > server.read_timeout
+        ):
+            return f"packet not completed within {server.read_timeout}s"
+        if (
+            server.idle_timeout is not None
+            and now - self._last_read > server.idle_timeout
+        ):
+            return f"idle for more than {server.idle_timeout}s"
+        return None
+
+    def eof_received(self):
+        if self._filled:
+            logger.warning(
+                f"Connection from {self._peer} closed in the middle of "
+                f"packet #{self._received + 1} ({self._filled} bytes received)"
+            )
+        return False
+
+
 class Server:
     def __init__(
         self,
@@ -18,66 +267,383 @@ class Server:
         password="",
         encryption_method: Method = Method.PLAINTEXT,
         loop=None,
+        read_packets: int = 64,
+        max_queue_size: int = 100000,
+        overflow_policy: Union[OverflowPolicy, str] = OverflowPolicy.BLOCK,
+        verify_crc: bool = True,
+        reuse_port: bool = False,
+        crypto_executor: Optional[Executor] = None,
+        crypto_offload_threshold: int = 16 * ReportPacket.SIZE,
+        crypto_backend: Optional[Union[str, Sequence[str]]] = None,
+        key_cache: Optional[KeyScheduleCache] = key_schedules,
+        read_timeout: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+        max_connections: Optional[int] = None,
+        max_connections_per_host: Optional[int] = None,
+        backlog: int = 100,
+        stats: Optional[Stats] = None,
+        path: Optional[str] = None,
     ):
+        """An NSCA server receiving reports from clients
+
+        :param read_packets: int
+            Size of each connection's receive buffer in packets, i.e. the
+            maximum number of packets decoded at once
+        :param max_queue_size: int
+            Maximum number of received reports waiting to be consumed by
+            :py:meth`reports` or :py:meth`reports_batched`
+        :param overflow_policy: Union[OverflowPolicy, str]
+            What happens to received reports if the queue is full.  With
+            ``BLOCK``, the server stops reading from a client until there is
+            space in the queue again.  Otherwise reports are shed as described
+            for :py:class`aionsca.queue.ReportQueue`, coalescing by
+            ``(host, service)``.
+        :param verify_crc: bool
+            Check the checksum of each received packet and close the
+            connection on a mismatch.  May be disabled for trusted links.
+        :param reuse_port: bool
+            Bind the listening socket with ``SO_REUSEPORT``, so that several
+            servers can listen on the same port, see
+            :py:class`aionsca.workers.MultiprocessServer`
+        :param crypto_executor: Optional[Executor]
+            If set, data of at least ``crypto_offload_threshold`` bytes
+            received in one read is decrypted in this executor instead of on
+            the event loop
+        :param crypto_offload_threshold: int
+            Minimum number of bytes to be decrypted in ``crypto_executor``
+        :param crypto_backend: Optional[Union[str, Sequence[str]]]
+            Library or libraries used for decryption, see
+            :py:func`aionsca.crypto.get_crypter_by_method`
+        :param key_cache: Optional[KeyScheduleCache]
+            Cache of key schedules shared by connections using the same
+            password, so that they need not key the cipher again.  Defaults
+            to the process-wide :py:data`aionsca.crypto.key_schedules`, pass
+            ``None`` to disable.  Only used for ciphers that gain from it,
+            currently Blowfish.
+        :param read_timeout: Optional[float]
+            Close connections that take longer than ``read_timeout`` seconds
+            to send the rest of a packet they started
+        :param idle_timeout: Optional[float]
+            Close connections that sent nothing for ``idle_timeout`` seconds,
+            unless the server stopped reading from them
+        :param max_connections: Optional[int]
+            Maximum number of concurrent connections.  Once reached, the
+            server stops accepting connections until one is closed, so that
+            further clients wait in the listen ``backlog``.
+        :param max_connections_per_host: Optional[int]
+            Maximum number of concurrent connections from the same address.
+            Further connections from that address are closed right after they
+            were accepted.
+        :param backlog: int
+            Number of connections the kernel queues until they are accepted
+        :param stats: Optional[Stats]
+            Collect counters and durations of the read, decrypt, unpack and
+            queue wait stages in this :py:class`aionsca.stats.Stats`
+        :param path: Optional[str]
+            Listen on the Unix domain socket ``path`` instead of ``host`` and
+            ``port``.  Limits per host do not apply to its connections.
+        """
         self.host = host
         self.port = port
         self.loop = loop
         self.password = str(password).encode("utf-8")
         self.encryption_method = Method.parse(encryption_method)
+        self.read_packets = max(1, read_packets)
+        self.verify_crc = verify_crc
+        self.reuse_port = reuse_port
+        self.crypto_executor = crypto_executor
+        self.crypto_offload_threshold = crypto_offload_threshold
+        self.crypto_backend = crypto_backend
+        self.key_cache = key_cache
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.backlog = backlog
+        self.stats = stats
+        self.path = path
 
         self._server = None
-        self._received_reports = Queue()
+        overflow_policy = OverflowPolicy.parse(overflow_policy)
+        self._received_reports = ReportQueue(
+            max_queue_size,
+            policy=overflow_policy,
+            # Only coalescing needs a key, don't decode each report otherwise
+            key=(
+                (lambda report: (report.hostname, report.service))
+                if overflow_policy is OverflowPolicy.COALESCE
+                else None
+            ),
+        )
+        self._paused: List[_ReportProtocol] = list()
+        self._rejected_reports = 0
+
+        self._connections: Set[_ReportProtocol] = set()
+        # Listening sockets accepted from by this server, see _accept()
+        self._listening: List[socket.socket] = list()
+        self._accepting = False
+        self._connecting = 0
+        self._connections_per_host: Dict[str, int] = dict()
+        self._reaper_task: Optional[Task] = None
+        self._peak_connections = 0
+        self._refused_connections = 0
+        self._timed_out_connections = 0
+
+        # Number of reports put into the queue at once, and when
+        self._arrivals: Deque[List] = deque()
 
     async def start_server(self):
         if self._server is None:
-            self._server = await start_server(
-                self._on_client_connected,
-                host=self.host,
-                port=self.port,
-                loop=self.loop,
-            )
+            loop = self.loop or get_event_loop()
+            # With max_connections, the event loop only creates the listening
+            # sockets and this server accepts from them itself, so that it can
+            # stop accepting while max_connections are open.
+            manual_accept = self.max_connections is not None
+            if self.path is not None:
+                self._server = await loop.create_unix_server(
+                    lambda: _ReportProtocol(self),
+                    path=self.path,
+                    backlog=self.backlog,
+                    start_serving=not manual_accept,
+                )
+            else:
+                self._server = await loop.create_server(
+                    lambda: _ReportProtocol(self),
+                    host=self.host,
+                    port=self.port,
+                    reuse_port=self.reuse_port or None,
+                    backlog=self.backlog,
+                    start_serving=not manual_accept,
+                )
+            if manual_accept:
+                for sock in self._server.sockets:
+                    listening = sock.dup()
+                    listening.setblocking(False)
+                    listening.listen(self.backlog)
+                    self._listening.append(listening)
+                self._resume_accepting()
+            timeouts = [
+                t for t in (self.read_timeout, self.idle_timeout) if t is not None
+            ]
+            if timeouts:
+                self._reaper_task = ensure_future(self._run_reaper(min(timeouts) / 2))
 
     async def __aenter__(self):
         await self.start_server()
         return self
 
     async def __aexit__(self, *_ex):
-        self._server.close()
-        await self._server.wait_closed()
-        self._server = None
+        await self.close()
+
+    async def close(self):
+        """Stop listening and wait until the listening socket is closed"""
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+        if self._server is not None:
+            self._pause_accepting()
+            for sock in self._listening:
+                sock.close()
+            self._listening = list()
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if self.path is not None:
+                try:
+                    unlink(self.path)
+                except FileNotFoundError:
+                    pass
 
     async def reports(self):
+        """Asynchronously iterate over received reports"""
+        async for batch in self.reports_batched():
+            for report in batch:
+                yield report
+
+    async def reports_batched(self, max_reports: int = 1024):
+        """Asynchronously iterate over lists of up to ``max_reports``
+        received reports"""
         while True:
-            report = await self._received_reports.get()
-            self._received_reports.task_done()
-            yield report
+            batch = await self._received_reports.get_batch(max_reports)
+            self._received_reports.task_done(len(batch))
+            if self.stats is not None:
+                self._departed(len(batch))
+            self._resume_paused()
+            yield batch
 
-    async def _on_client_connected(self, reader: StreamReader, writer: StreamWriter):
-        timestamp = int(datetime.now().timestamp())
-        iv = getrandom(128)
+    @property
+    def queue_depth(self) -> int:
+        """Number of received reports waiting to be consumed"""
+        return len(self._received_reports)
+
+    @property
+    def queue_high_water(self) -> int:
+        """Largest number of reports that were waiting to be consumed at once"""
+        return self._received_reports.high_water
+
+    @property
+    def shed_reports(self) -> int:
+        """Number of received reports dropped because the queue was full"""
+        return self._received_reports.dropped
+
+    @property
+    def rejected_reports(self) -> int:
+        """Number of received packets rejected because of a checksum
+        mismatch"""
+        return self._rejected_reports
+
+    @property
+    def paused_connections(self) -> int:
+        """Number of connections not read from because the queue is full"""
+        return len(self._paused)
+
+    @property
+    def active_connections(self) -> int:
+        """Number of currently open connections"""
+        return len(self._connections)
 
-        crypter = get_crypter_by_method(
-            method=self.encryption_method, iv=iv, password=self.password, rng=getrandom
+    @property
+    def active_connections_per_host(self) -> Dict[str, int]:
+        """Number of currently open connections by client address"""
+        return dict(self._connections_per_host)
+
+    @property
+    def peak_connections(self) -> int:
+        """Largest number of connections that were open at once"""
+        return self._peak_connections
+
+    @property
+    def refused_connections(self) -> int:
+        """Number of connections closed because of the per-host connection
+        limit"""
+        return self._refused_connections
+
+    @property
+    def timed_out_connections(self) -> int:
+        """Number of connections closed by ``read_timeout`` or
+        ``idle_timeout``"""
+        return self._timed_out_connections
+
+    def _arrived(self, count: int):
+        if count:
+            self._arrivals.append([count, perf_counter()])
+
+    def _departed(self, count: int):
+        """Record the queue wait of the oldest of ``count`` reports taken from
+        the queue.  Only approximate if reports are shed or coalesced."""
+        arrivals = self._arrivals
+        if arrivals:
+            self.stats.observe("queue_wait", perf_counter() - arrivals[0][1])
+        while count and arrivals:
+            taken = min(count, arrivals[0][0])
+            arrivals[0][0] -= taken
+            count -= taken
+            if not arrivals[0][0]:
+                arrivals.popleft()
+
+    def _time(self) -> float:
+        return (self.loop or get_event_loop()).time()
+
+    def _at_capacity(self) -> bool:
+        return (
+            self.max_connections is not None
+            and len(self._connections) + self._connecting >= self.max_connections
         )
 
-        init_packet = InitPacket.pack(iv, timestamp)
-        writer.write(init_packet)
-        await writer.drain()
+    def _pause_accepting(self):
+        if self._accepting:
+            loop = self.loop or get_event_loop()
+            for sock in self._listening:
+                loop.remove_reader(sock.fileno())
+            self._accepting = False
 
-        for packet_num in count(1):
+    def _resume_accepting(self):
+        if not self._accepting and self._listening and not self._at_capacity():
+            loop = self.loop or get_event_loop()
+            for sock in self._listening:
+                loop.add_reader(sock.fileno(), self._accept, sock)
+            self._accepting = True
+
+    def _accept(self, listening: socket.socket):
+        loop = self.loop or get_event_loop()
+        while not self._at_capacity():
             try:
-                report_packet = crypter.decrypt(
-                    await reader.readexactly(ReportPacket.SIZE)
-                )
-                logger.debug(
-                    f"Received report #{packet_num} for on socket {writer.get_extra_info('socket', '???')}"
+                sock, _ = listening.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # Out of file descriptors or memory, try again later instead
+                # of spinning on the readable socket
+                logger.error(f"Failed to accept connection: {e}")
+                self._pause_accepting()
+                loop.call_later(1.0, self._resume_accepting)
+                return
+            sock.setblocking(False)
+            self._connecting += 1
+            ensure_future(self._connect(sock))
+
+        # Leave further connections in the listen backlog until one closes
+        self._pause_accepting()
+
+    async def _connect(self, sock: socket.socket):
+        loop = self.loop or get_event_loop()
+        try:
+            await loop.connect_accepted_socket(lambda: _ReportProtocol(self), sock)
+        except Exception as e:
+            logger.warning(f"Failed to set up accepted connection: {e}")
+            sock.close()
+        finally:
+            # The protocol was admitted in connection_made() by now
+            self._connecting -= 1
+            self._resume_accepting()
+
+    def _admit(self, protocol: _ReportProtocol) -> Optional[str]:
+        """Register a new connection, or return why it is refused"""
+        host = protocol._peer_host
+        if host is not None:
+            count = self._connections_per_host.get(host, 0)
+            if (
+                self.max_connections_per_host is not None
+                and count >= self.max_connections_per_host
+            ):
+                self._refused_connections += 1
+                return (
+                    f"limit of {self.max_connections_per_host} connections "
+                    f"per host reached"
                 )
-                report = ReportPacket.unpack(report_packet)
-                self._received_reports.put_nowait(report)
-            except IncompleteReadError as e:
-                if len(e.partial) != 0:
-                    logger.warning(f"IncompleteReadError for packet #{packet_num}: {e}")
-                break
-            except PacketDecodeError:
-                logger.exception(f"Failed to decode packet ({report_packet!r})")
+            self._connections_per_host[host] = count + 1
+
+        self._connections.add(protocol)
+        self._peak_connections = max(self._peak_connections, len(self._connections))
+        return None
+
+    def _release(self, protocol: _ReportProtocol):
+        self._connections.discard(protocol)
+        host = protocol._peer_host
+        if host is not None:
+            count = self._connections_per_host.get(host, 0) - 1
+            if count > 0:
+                self._connections_per_host[host] = count
+            else:
+                self._connections_per_host.pop(host, None)
+        self._resume_accepting()
+
+    async def _run_reaper(self, interval: float):
+        while True:
+            await sleep(interval)
+            now = self._time()
+            for protocol in list(self._connections):
+                reason = protocol._timed_out(now)
+                if reason is not None:
+                    logger.info(f"Closing connection from {protocol._peer}: {reason}")
+                    self._timed_out_connections += 1
+                    protocol._transport.abort()
+                    # Release right away, connection_lost is called later
+                    self._release(protocol)
+                    protocol._admitted = False
+
+    def _resume_paused(self):
+        while self._paused and not self._received_reports.full():
+            protocol = self._paused.pop(0)
+            if not protocol._resume():
                 break
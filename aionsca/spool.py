@@ -0,0 +1,337 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import mmap
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from .state import State
+from .protocol import Padding, PacketDecodeError, ReportPacket
+
+logger = logging.getLogger(__name__)
+
+ReportTuple = Tuple[str, str, State, str]
+
+
+class Spool:
+    RECORD_SIZE = ReportPacket.SIZE
+
+    # Fraction of max_size a spool is compacted to once it outgrows max_size,
+    # so that a full spool is not rewritten on every append
+    _COMPACT_TARGET = 0.9
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 64 * 1024 * 1024,
+        max_age: Optional[float] = 24 * 60 * 60,
+        fsync_interval: float = 1.0,
+        key: Optional[Callable[[ReportTuple], Hashable]] = None,
+        supersedes: Optional[Callable[[ReportTuple, ReportTuple], bool]] = None,
+    ):
+        """An append-only file of reports that could not be sent
+
+        Reports are stored unencrypted as packed :py:class`ReportPacket`
+        records, stamped with the time they were spooled.  They are read back
+        through a memory map in the order they were appended.
+
+        Records are appended with a single write each time.  The file is
+        synced to disk by a timer ``fsync_interval`` seconds after the first
+        append following a sync, and on :py:meth`sync` and :py:meth`close`.
+        All methods block on disk I/O and may be called from any thread, so
+        :py:class`aionsca.Client` calls them in an executor.
+
+        :param path: str
+            Path of the spool file, created if it does not exist.  Reports
+            left in an existing file are kept.
+        :param max_size: int
+            Maximum size of the spool file in bytes.  When it is exceeded,
+            the spool is compacted and the oldest reports are dropped.
+        :param max_age: Optional[float]
+            Reports spooled more than ``max_age`` seconds ago are dropped
+            instead of being sent, or ``None`` to keep them forever
+        :param fsync_interval: float
+            Maximum time in seconds that appended reports stay unsynced, or 0
+            to sync on every append
+        :param key: Optional[Callable[[ReportTuple], Hashable]]
+            Function returning the key by which reports are coalesced during
+            compaction, for example ``lambda r: (r[0], r[1])`` to keep only
+            the latest report for each host and service.  No reports are
+            coalesced by default.
+        :param supersedes: Optional[Callable[[ReportTuple, ReportTuple], bool]]
+            Called as ``supersedes(older, newer)`` for two reports with the
+            same key, returns whether the older report may be dropped, see
+            :py:class`aionsca.queue.ReportQueue`
+        """
+        if max_size < self.RECORD_SIZE:
+            raise ValueError(
+                f"Spool size must be at least {self.RECORD_SIZE} bytes, got {max_size}"
+            )
+
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
+        self._key = key
+        self._supersedes = supersedes
+
+        self._lock = threading.Lock()
+        self._sync_timer: Optional[threading.Timer] = None
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        self._size = os.fstat(self._fd).st_size
+        torn = self._size % self.RECORD_SIZE
+        if torn:
+            logger.warning(f"Discarding incomplete record at the end of spool {path}")
+            self._size -= torn
+            os.ftruncate(self._fd, self._size)
+
+        # Offset of the first record not sent yet, and end of the records
+        # handed out by take() and not yet committed
+        self._head = 0
+        self._claim_end: Optional[int] = None
+        self._synced = True
+
+        self.dropped = 0
+        self.expired = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        """Number of spooled reports not sent yet"""
+        return (self._size - self._head) // self.RECORD_SIZE
+
+    @property
+    def size(self) -> int:
+        """Size of the spool file in bytes"""
+        return self._size
+
+    @property
+    def claimed(self) -> bool:
+        """Whether reports handed out by :py:meth`take` are being sent"""
+        return self._claim_end is not None
+
+    def append(self, reports: Sequence[ReportTuple]):
+        """Append reports given as tuples of ``(hostname, service, state,
+        message)`` to the spool"""
+        if not reports:
+            return
+
+        records = ReportPacket.pack_many(
+            reports, timestamp=int(time.time()), padding=Padding.ZERO
+        )
+        with self._lock:
+            os.write(self._fd, records)
+            self._size += len(records)
+            self._synced = False
+
+            if self._size > self.max_size:
+                self._compact()
+            elif self.fsync_interval <= 0:
+                self._sync()
+            elif self._sync_timer is None:
+                self._sync_timer = threading.Timer(self.fsync_interval, self.sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+
+    def take(self, max_reports: int) -> List[ReportTuple]:
+        """Return up to ``max_reports`` of the oldest reports not sent yet.
+
+        The reports stay in the spool until :py:meth`commit` is called after
+        they were sent, or are handed out again after :py:meth`release`.
+        Expired and corrupt records are skipped.  An empty list is returned
+        once all reports were handed out.
+        """
+        with self._lock:
+            return self._take(max_reports)
+
+    def _take(self, max_reports: int) -> List[ReportTuple]:
+        if self._claim_end is not None:
+            raise RuntimeError("Reports taken from the spool were not committed")
+
+        reports: List[ReportTuple] = list()
+        end = self._head
+        if self._head < self._size:
+            min_timestamp = self._min_timestamp()
+            with mmap.mmap(self._fd, self._size, access=mmap.ACCESS_READ) as records:
+                while end < self._size and len(reports) < max_reports:
+                    report = self._read(records, end, min_timestamp)
+                    end += self.RECORD_SIZE
+                    if report is not None:
+                        reports.append(report[:4])
+
+        self._claim_end = end
+        return reports
+
+    def commit(self):
+        """Remove the reports returned by the last :py:meth`take` from the
+        spool.  The spool file is truncated once all reports were removed."""
+        with self._lock:
+            if self._claim_end is None:
+                return
+            self._head = self._claim_end
+            self._claim_end = None
+            if self._head >= self._size:
+                self._truncate()
+
+    def release(self):
+        """Keep the reports returned by the last :py:meth`take` in the spool"""
+        with self._lock:
+            self._claim_end = None
+
+    def compact(self):
+        """Rewrite the spool file without reports that were sent, expired or
+        coalesced, and without the oldest reports if the file is still too
+        large.  Then sync it to disk."""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        if self._head >= self._size:
+            self._truncate()
+            self._sync()
+            return
+
+        kept: List[Tuple[int, ReportTuple]] = list()
+        latest: Dict[Hashable, int] = dict()
+        min_timestamp = self._min_timestamp()
+        with mmap.mmap(self._fd, self._size, access=mmap.ACCESS_READ) as records:
+            for offset in range(self._head, self._size, self.RECORD_SIZE):
+                report = self._read(records, offset, min_timestamp)
+                if report is None:
+                    continue
+
+                if self._key is not None:
+                    report = report[:4]
+                    key = self._key(report)
+                    index = latest.get(key)
+                    if index is not None and (
+                        self._supersedes is None
+                        or self._supersedes(kept[index][1], report)
+                    ):
+                        kept[index] = None
+                        self.coalesced += 1
+                    latest[key] = len(kept)
+
+                kept.append((offset, report))
+
+            kept = [record for record in kept if record is not None]
+
+            max_records = int(self.max_size * self._COMPACT_TARGET) // self.RECORD_SIZE
+            if len(kept) > max_records:
+                dropped = len(kept) - max_records
+                logger.warning(
+                    f"Spool {self.path} is full, dropping {dropped} report(s)"
+                )
+                self.dropped += dropped
+                kept = kept[dropped:]
+
+            claim_end = None
+            if self._claim_end is not None:
+                claim_end = self.RECORD_SIZE * sum(
+                    1 for offset, _ in kept if offset < self._claim_end
+                )
+
+            tmp_path = f"{self.path}.tmp"
+            fd = os.open(
+                tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o600
+            )
+            try:
+                os.write(
+                    fd,
+                    b"".join(
+                        records[offset : offset + self.RECORD_SIZE]
+                        for offset, _ in kept
+                    ),
+                )
+                os.fsync(fd)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.close(fd)
+                raise
+
+        os.close(self._fd)
+        self._fd = fd
+        self._size = len(kept) * self.RECORD_SIZE
+        self._head = 0
+        self._claim_end = claim_end
+        self._synced = True
+        self._cancel_sync_timer()
+
+    def sync(self):
+        """Flush the spool file to disk"""
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        self._cancel_sync_timer()
+        if not self._synced and self._fd >= 0:
+            os.fsync(self._fd)
+            self._synced = True
+
+    def _cancel_sync_timer(self):
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+
+    def close(self):
+        """Sync and close the spool file.  Unsent reports are kept."""
+        with self._lock:
+            if self._fd < 0:
+                return
+            if self._head > 0 and self._claim_end is None:
+                self._compact()
+            else:
+                self._sync()
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_ex):
+        self.close()
+
+    def _min_timestamp(self) -> Optional[int]:
+        if self.max_age is None:
+            return None
+        return int(time.time() - self.max_age)
+
+    def _read(
+        self, records: mmap.mmap, offset: int, min_timestamp: Optional[int]
+    ) -> Optional[Tuple[str, str, State, str, int]]:
+        try:
+            report = ReportPacket.unpack_from(records, offset)
+            if min_timestamp is not None and report.timestamp < min_timestamp:
+                self.expired += 1
+                return None
+            return tuple(report)
+        except (PacketDecodeError, ValueError) as e:
+            logger.warning(f"Skipping corrupt record in spool {self.path}: {e}")
+            self.dropped += 1
+            return None
+
+    def _truncate(self):
+        os.ftruncate(self._fd, 0)
+        self._size = 0
+        self._head = 0
+        self._synced = False
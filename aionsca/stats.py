@@ -0,0 +1,125 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Any, Callable, Dict, List, Optional
+
+# Signature of hooks: hook(name, value), called with the duration in seconds
+# for each observed stage and with the increment for each counter.
+StatsHook = Callable[[str, float], None]
+
+
+class Histogram:
+    """Counts durations in buckets whose bounds are powers of two
+    microseconds: bucket ``i`` counts durations below ``2 ** i`` µs."""
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets: List[int] = list()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        index = int(seconds * 1e6).bit_length()
+        buckets = self.buckets
+        if index >= len(buckets):
+            buckets.extend([0] * (index + 1 - len(buckets)))
+        buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """Upper bound in seconds of the bucket containing the ``p``-th
+        percentile, ``0 <= p <= 100``"""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min((1 << index) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "buckets": {
+                (1 << index) / 1e6: n for index, n in enumerate(self.buckets) if n
+            },
+        }
+
+
+class Stats:
+    def __init__(self, hook: Optional[StatsHook] = None):
+        """Counters and duration histograms of the stages of sending or
+        receiving reports
+
+        Pass an instance as ``stats`` to :py:class`aionsca.Client`,
+        :py:class`aionsca.Pool` or :py:class`aionsca.server.Server` to enable
+        instrumentation, which is skipped entirely without one.  Several
+        clients may share an instance.
+
+        :param hook: Optional[StatsHook]
+            Called as ``hook(name, value)`` for every observation, with the
+            duration in seconds for stages and the increment for counters,
+            for example to forward them to metricq
+        """
+        self.hook = hook
+        self.counters: Dict[str, int] = dict()
+        self.histograms: Dict[str, Histogram] = dict()
+
+    def count(self, name: str, n: int = 1):
+        """Add ``n`` to the counter ``name``"""
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.hook is not None:
+            self.hook(name, n)
+
+    def observe(self, stage: str, seconds: float):
+        """Record that stage ``stage`` took ``seconds``"""
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.add(seconds)
+        if self.hook is not None:
+            self.hook(stage, seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current counters and a summary of each histogram as a
+        dict of plain values"""
+        return {
+            "counters": dict(self.counters),
+            "stages": {
+                stage: histogram.snapshot()
+                for stage, histogram in self.histograms.items()
+            },
+        }
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
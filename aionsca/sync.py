@@ -0,0 +1,267 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, List, Optional, Tuple
+
+from .client import Client, ReportTuple, prepare_report
+from .state import State
+
+logger = logging.getLogger(__name__)
+
+
+class SyncClient:
+    def __init__(
+        self,
+        *args,
+        batch_size: int = 1000,
+        max_pending: int = 100000,
+        retries: int = 5,
+        **kwargs,
+    ):
+        """A thread-safe, blocking interface to a :py:class`Client`
+
+        The client runs on an event loop in a background thread and keeps its
+        connection open.  Reports from any number of threads are appended to a
+        shared queue without taking a lock, and sent in batches of up to
+        ``batch_size`` reports.
+
+        :param args, kwargs:
+            Passed to :py:class`Client`
+        :param batch_size: int
+            Maximum number of reports sent at once
+        :param max_pending: int
+            Maximum number of reports waiting to be sent.  :py:meth`submit`
+            drops reports beyond that, :py:meth`send` still queues them.
+        :param retries: int
+            Number of tries to send a batch, see :py:meth`Client.send_reports`
+        """
+        self._client_args = args
+        self._client_kwargs = kwargs
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._retries = retries
+
+        # Producers append (report, future) from any thread, the sender task
+        # pops from the other end.  A report of None is a flush marker.
+        self._pending: Deque[Tuple[Optional[ReportTuple], Optional[Future]]] = deque()
+        self._wakeup_scheduled = False
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[Client] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._sender_task: Optional[asyncio.Task] = None
+
+        self.dropped_reports = 0
+        self.failed_reports = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of reports waiting to be sent"""
+        return len(self._pending)
+
+    def connect(self, timeout: Optional[float] = None):
+        """Start the background thread and connect to the NSCA host.
+
+        If connecting fails, the error is raised, but the client stays usable:
+        reports queued afterwards are sent once the host can be reached.
+        """
+        if self._thread is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_loop, name="aionsca-sync-client", daemon=True
+            )
+            self._thread.start()
+        self._call(self._connect(), timeout)
+
+    def close(self, flush: bool = True, timeout: Optional[float] = None):
+        """Disconnect and stop the background thread.
+
+        :param flush: bool
+            Send all pending reports first
+        """
+        if self._thread is None:
+            return
+        try:
+            if flush:
+                self.flush(timeout)
+            self._call(self._disconnect(), timeout)
+        finally:
+            # The background thread closes the loop once it has stopped
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning("Background thread did not stop in time")
+            self._thread = None
+            self._loop = None
+            self._fail_pending(ConnectionError("Client was closed"))
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *_ex):
+        self.close()
+
+    def send(
+        self,
+        host: str,
+        service: Optional[str],
+        state: State,
+        message: str,
+        timeout: Optional[float] = None,
+    ):
+        """Send a report and block until it was sent, see
+        :py:meth`Client.send_report`.
+
+        Raises :py:class`ConnectionError` if it could not be sent.  Reports
+        sent concurrently from several threads are batched.
+        """
+        future: Future = Future()
+        self._put(prepare_report(host, service, state, message), future)
+        future.result(timeout)
+
+    def submit(
+        self, host: str, service: Optional[str], state: State, message: str
+    ) -> bool:
+        """Queue a report to be sent in the background, without blocking.
+
+        Raises :py:class`TypeError` or :py:class`ValueError` for reports that
+        cannot be sent.  Reports that fail to send are logged and counted in
+        :py:attr`failed_reports`.
+
+        :return: bool
+            ``False`` if the report was dropped because ``max_pending``
+            reports are already waiting
+        """
+        report = prepare_report(host, service, state, message)
+        if len(self._pending) >= self._max_pending:
+            self.dropped_reports += 1
+            return False
+        self._put(report, None)
+        return True
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until all reports queued before this call were sent or
+        failed to send"""
+        future: Future = Future()
+        self._put(None, future)
+        future.result(timeout)
+
+    def _put(self, report: Optional[ReportTuple], future: Optional[Future]):
+        if self._loop is None:
+            raise RuntimeError("SyncClient is not connected")
+        self._pending.append((report, future))
+        # Wake up the sender only once until it has run, not for every report
+        if not self._wakeup_scheduled:
+            self._wakeup_scheduled = True
+            self._loop.call_soon_threadsafe(self._wake_sender)
+
+    def _call(self, coroutine, timeout: Optional[float]):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    def _run_loop(self):
+        loop = self._loop
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    async def _connect(self):
+        if self._client is None:
+            self._client = Client(*self._client_args, **self._client_kwargs)
+            self._wakeup = asyncio.Event()
+        # Start sending even if connecting fails, the client reconnects when
+        # sending.  Otherwise reports queued afterwards would never be sent.
+        if self._sender_task is None:
+            self._sender_task = asyncio.ensure_future(self._run_sender())
+        await self._client.connect()
+
+    async def _disconnect(self):
+        if self._sender_task is not None:
+            self._sender_task.cancel()
+            self._sender_task = None
+        await self._client.disconnect(flush=True)
+        self._client = None
+
+    def _wake_sender(self):
+        self._wakeup_scheduled = False
+        self._wakeup.set()
+
+    async def _run_sender(self):
+        pending = self._pending
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while pending:
+                batch: List[ReportTuple] = list()
+                futures: List[Optional[Future]] = list()
+                marker: Optional[Future] = None
+                while pending and len(batch) < self._batch_size:
+                    report, future = pending.popleft()
+                    if report is None:
+                        marker = future
+                        break
+                    batch.append(report)
+                    futures.append(future)
+
+                if batch:
+                    await self._send(batch, futures)
+                if marker is not None and not marker.done():
+                    marker.set_result(None)
+
+    async def _send(self, batch: List[ReportTuple], futures: List[Optional[Future]]):
+        try:
+            results = await self._client.send_reports(batch, retries=self._retries)
+        except asyncio.CancelledError:
+            for future in futures:
+                if future is not None and not future.done():
+                    future.set_exception(ConnectionError("Client was closed"))
+            raise
+        except Exception as e:
+            results = [e] * len(batch)
+
+        errors = 0
+        for future, error in zip(futures, results):
+            if error is not None:
+                errors += 1
+            if future is None or future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+        if errors:
+            self.failed_reports += errors
+            logger.warning(f"Failed to send {errors} of {len(batch)} report(s)")
+
+    def _fail_pending(self, error: Exception):
+        while self._pending:
+            _report, future = self._pending.popleft()
+            if future is not None and not future.done():
+                future.set_exception(error)
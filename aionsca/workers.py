@@ -0,0 +1,222 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Union
+
+from .crypto import Method
+from .protocol import Report
+from .server import Server
+
+logger = logging.getLogger(__name__)
+
+
+def _run_worker(
+    index: int, conn: Connection, server_kwargs: Dict[str, Any], batch_size: int
+):
+    # The parent process decides when workers shut down.  A worker forked
+    # from a running event loop inherits its signal handlers and wakeup fd,
+    # which would swallow the SIGTERM sent by MultiprocessServer.close().
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    async def serve():
+        try:
+            server = Server(reuse_port=True, **server_kwargs)
+            await server.start_server()
+        except Exception as e:
+            conn.send(e)
+            return
+
+        conn.send(None)
+        async with server:
+            async for batch in server.reports_batched(batch_size):
+                # Blocks this worker's event loop while the pipe is full,
+                # which stops it from reading reports faster than the parent
+                # consumes them.
+                conn.send(batch)
+
+    try:
+        asyncio.run(serve())
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        conn.close()
+        logger.debug(f"Worker #{index} (pid {os.getpid()}) exited")
+
+
+class MultiprocessServer:
+    def __init__(
+        self,
+        host=None,
+        port=5667,
+        password="",
+        encryption_method: Union[Method, int, str] = Method.PLAINTEXT,
+        workers: Optional[int] = None,
+        batch_size: int = 1024,
+        max_pending_batches: int = 64,
+        **server_kwargs,
+    ):
+        """An NSCA server that decodes reports in several worker processes
+
+        Each worker runs its own event loop and :py:class`Server`, all
+        listening on the same port with ``SO_REUSEPORT``, so that the kernel
+        distributes incoming connections among them.  Decoded reports are
+        sent to this process in batches over pipes and are consumed just like
+        those of a :py:class`Server`.
+
+        :param workers: Optional[int]
+            Number of worker processes, defaults to the number of CPUs
+        :param batch_size: int
+            Maximum number of reports sent from a worker in one message
+        :param max_pending_batches: int
+            Stop reading from the workers while this many batches are waiting
+            to be consumed
+        :param server_kwargs:
+            Further keyword arguments passed to each worker's
+            :py:class`Server`
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self._server_kwargs = dict(
+            host=host,
+            port=port,
+            password=password,
+            encryption_method=Method.parse(encryption_method),
+            **server_kwargs,
+        )
+        self._batch_size = batch_size
+        self._max_pending_batches = max_pending_batches
+
+        self._processes: List[multiprocessing.Process] = list()
+        self._connections: List[Connection] = list()
+        self._batches: Optional[asyncio.Queue] = None
+        self._reading = False
+
+    async def start_server(self):
+        if self._processes:
+            return
+
+        loop = asyncio.get_event_loop()
+        context = multiprocessing.get_context("fork")
+        self._batches = asyncio.Queue()
+
+        for index in range(self.workers):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_run_worker,
+                args=(index, sender, self._server_kwargs, self._batch_size),
+                name=f"aionsca-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            sender.close()
+            self._processes.append(process)
+            self._connections.append(receiver)
+
+        errors = await asyncio.gather(
+            *(
+                loop.run_in_executor(None, connection.recv)
+                for connection in self._connections
+            ),
+            return_exceptions=True,
+        )
+        for error in errors:
+            if error is not None:
+                await self.close()
+                if isinstance(error, EOFError):
+                    raise RuntimeError("Worker process exited during startup")
+                raise error
+
+        logger.info(
+            f"Started {self.workers} worker process(es) listening on "
+            f"{self._server_kwargs['host']}:{self._server_kwargs['port']}"
+        )
+        self._start_reading()
+
+    async def close(self):
+        self._stop_reading()
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(None, process.join) for process in self._processes)
+        )
+        for connection in self._connections:
+            connection.close()
+
+        self._processes = list()
+        self._connections = list()
+
+    async def __aenter__(self):
+        await self.start_server()
+        return self
+
+    async def __aexit__(self, *_ex):
+        await self.close()
+
+    async def reports(self):
+        """Asynchronously iterate over received reports"""
+        async for batch in self.reports_batched():
+            for report in batch:
+                yield report
+
+    async def reports_batched(self):
+        """Asynchronously iterate over batches of received reports, as sent
+        by the worker processes"""
+        while True:
+            batch: List[Report] = await self._batches.get()
+            if not self._reading and self._batches.qsize() < self._max_pending_batches:
+                self._start_reading()
+            yield batch
+
+    def _start_reading(self):
+        loop = asyncio.get_event_loop()
+        for connection in self._connections:
+            if not connection.closed:
+                loop.add_reader(connection.fileno(), self._on_readable, connection)
+        self._reading = True
+
+    def _stop_reading(self):
+        loop = asyncio.get_event_loop()
+        for connection in self._connections:
+            if not connection.closed:
+                loop.remove_reader(connection.fileno())
+        self._reading = False
+
+    def _on_readable(self, connection: Connection):
+        try:
+            batch = connection.recv()
+        except (EOFError, OSError):
+            logger.error("Worker process exited unexpectedly")
+            asyncio.get_event_loop().remove_reader(connection.fileno())
+            connection.close()
+            return
+
+        self._batches.put_nowait(batch)
+        if self._batches.qsize() >= self._max_pending_batches:
+            self._stop_reading()
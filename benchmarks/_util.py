@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Helpers shared by the benchmarks: timing, results and JSON output.
+
+Each benchmark module defines ``collect(quick) -> List[Dict]`` returning its
+results, and can be run on its own or through ``run.py``.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    # Benchmark the working tree, not an installed aionsca
+    sys.path.insert(0, ROOT)
+
+
+def best_of(stmt: Callable[[], Any], number: int, repeat: int = 5) -> float:
+    """Best time in seconds of ``repeat`` runs of ``number`` calls each,
+    divided by ``number``"""
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def result(suite: str, name: str, value: float, unit: str, **params) -> Dict:
+    """A single measurement, printed and stored as one JSON object"""
+    entry = dict(suite=suite, name=name, value=value, unit=unit, **params)
+    details = " ".join(f"{key}={value}" for key, value in params.items())
+    print(f"{suite:<9} {name:<36} {value:>14,.2f} {unit:<10} {details}")
+    return entry
+
+
+def error(suite: str, name: str, exception: BaseException, **params) -> Dict:
+    """A measurement that failed, recorded instead of a value so that the
+    rest of the suite still runs"""
+    message = f"{type(exception).__name__}: {exception}"
+    details = " ".join(f"{key}={value}" for key, value in params.items())
+    print(f"{suite:<9} {name:<36} failed: {message} {details}".rstrip())
+    return dict(suite=suite, name=name, value=None, error=message, **params)
+
+
+def metadata() -> Dict[str, Any]:
+    """Describe the environment of a benchmark run"""
+    try:
+        commit = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        date=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        commit=commit,
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        cpus=os.cpu_count(),
+    )
+
+
+def write_json(path: str, results: List[Dict]):
+    with open(path, "w") as fp:
+        json.dump(dict(metadata=metadata(), results=results), fp, indent=2)
+        fp.write("\n")
+
+
+def argument_parser(description: Optional[str]) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--json", metavar="PATH", help="write results to PATH as JSON")
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer iterations, for smoke tests"
+    )
+    return parser
+
+
+def main(description: Optional[str], collect: Callable[[bool], List[Dict]]):
+    """Run a single benchmark module from the command line"""
+    args = argument_parser(description).parse_args()
+    results = collect(args.quick)
+    if args.json:
+        write_json(args.json, results)
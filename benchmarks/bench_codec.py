@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure packing and unpacking of report packets.
+
+ReportPacket.pack is compared for each padding mode with the original
+implementation that builds each field with random_bytes_padded and copies it
+into the packet by struct.pack."""
+
+import binascii
+import struct
+from typing import Dict, List
+
+import _util
+from aionsca import State
+from aionsca.protocol import (
+    Padding,
+    ReportPacket,
+    chop_padding,
+    random_bytes_padded,
+)
+
+REPORT = dict(
+    hostname="compute-node-0042.cluster.example.org",
+    service="metricq source heartbeat",
+    state=State.WARNING,
+    message="Last metric received 42 seconds ago",
+    timestamp=1568208000,
+)
+
+
+def pack_legacy(hostname, service, state, message, timestamp):
+    hostname = random_bytes_padded(hostname, ReportPacket.MAX_LENGTH_HOSTNAME)
+    service = random_bytes_padded(service, ReportPacket.MAX_LENGTH_SERVICE)
+    message = random_bytes_padded(message, ReportPacket.MAX_LENGTH_MESSAGE)
+    packet = bytearray(
+        struct.pack(
+            ReportPacket._FMT,
+            ReportPacket.PACKET_VERSION,
+            0,
+            timestamp,
+            State(state).value,
+            hostname,
+            service,
+            message,
+        )
+    )
+    crc = binascii.crc32(packet) & 0xFFFFFFFF
+    struct.pack_into("!L", packet, 4, crc)
+    return bytes(packet)
+
+
+def bench(
+    results: List[Dict],
+    name: str,
+    stmt,
+    number: int,
+    batch_size: int = 1,
+    unit: str = "packets/s",
+):
+    seconds = _util.best_of(stmt, number) / batch_size
+    results.append(
+        _util.result("codec", name, 1 / seconds, unit, us=round(seconds * 1e6, 3))
+    )
+
+
+def collect(quick: bool = False) -> List[Dict]:
+    number = 200 if quick else 10000
+    results: List[Dict] = list()
+
+    bench(results, "pack legacy", lambda: pack_legacy(**REPORT), number)
+    for padding in Padding:
+        bench(
+            results,
+            f"pack padding={padding}",
+            lambda: ReportPacket.pack(**REPORT, padding=padding),
+            number,
+        )
+
+    buffer = bytearray(ReportPacket.SIZE)
+    for padding in Padding:
+        bench(
+            results,
+            f"pack_into padding={padding}",
+            lambda: ReportPacket.pack_into(buffer, 0, **REPORT, padding=padding),
+            number,
+        )
+
+    batch = [
+        (REPORT["hostname"], REPORT["service"], REPORT["state"], REPORT["message"])
+    ] * 1000
+    for padding in Padding:
+        bench(
+            results,
+            f"pack_many padding={padding}",
+            lambda: ReportPacket.pack_many(
+                batch, timestamp=REPORT["timestamp"], padding=padding
+            ),
+            max(1, number // len(batch)),
+            batch_size=len(batch),
+        )
+
+    packet = ReportPacket.pack(**REPORT)
+    bench(results, "unpack header", lambda: ReportPacket.unpack(packet), number)
+    bench(
+        results,
+        "unpack all fields",
+        lambda: tuple(ReportPacket.unpack(packet)),
+        number,
+    )
+    bench(
+        results,
+        "unpack without crc",
+        lambda: tuple(ReportPacket.unpack(packet, verify_crc=False)),
+        number,
+    )
+
+    packets = ReportPacket.pack_many(batch, timestamp=REPORT["timestamp"])
+    offsets = range(0, len(packets), ReportPacket.SIZE)
+    bench(
+        results,
+        "unpack_from batch",
+        lambda: [tuple(ReportPacket.unpack_from(packets, o)) for o in offsets],
+        max(1, number // len(batch)),
+        batch_size=len(batch),
+    )
+
+    bench(
+        results,
+        "random_bytes_padded message",
+        lambda: random_bytes_padded(REPORT["message"], ReportPacket.MAX_LENGTH_MESSAGE),
+        number,
+        unit="fields/s",
+    )
+    field = random_bytes_padded(REPORT["message"], ReportPacket.MAX_LENGTH_MESSAGE)
+    bench(
+        results,
+        "chop_padding message",
+        lambda: chop_padding(field),
+        number,
+        unit="fields/s",
+    )
+    return results
+
+
+if __name__ == "__main__":
+    _util.main(__doc__, collect)
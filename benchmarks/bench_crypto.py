@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure encryption and decryption throughput of every encryption method
+with each available backend."""
+
+import os
+from typing import Dict, List
+
+import _util
+from aionsca.crypto import Method, available_backends, get_crypter_by_method
+from aionsca.protocol import InitPacket, ReportPacket
+
+
+def collect(quick: bool = False) -> List[Dict]:
+    packets = 100 if quick else 1000
+    number = 1 if quick else 5
+    iv = os.urandom(InitPacket.IV_SIZE)
+    data = os.urandom(packets * ReportPacket.SIZE)
+    results: List[Dict] = list()
+
+    for method in Method:
+        backends = available_backends(method)
+        if not backends:
+            print(f"crypto    {method!s:<36} (no backend available)")
+            continue
+
+        for backend in backends:
+            for operation in ("encrypt", "decrypt"):
+                try:
+                    crypter = get_crypter_by_method(
+                        method, iv=iv, password=b"benchmark", backend=backend
+                    )
+                except ValueError as e:
+                    print(f"crypto    {method!s:<36} {backend} failed: {e}")
+                    break
+
+                function = getattr(crypter, operation)
+                seconds = _util.best_of(lambda: function(data), number, repeat=3)
+                results.append(
+                    _util.result(
+                        "crypto",
+                        f"{operation} {method!s}",
+                        len(data) / seconds / 2**20,
+                        "MiB/s",
+                        backend=backend,
+                        packets_per_s=round(packets / seconds),
+                    )
+                )
+    return results
+
+
+if __name__ == "__main__":
+    _util.main(__doc__, collect)
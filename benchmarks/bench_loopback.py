@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Send reports from a Client or Pool to a Server over the loopback interface
+and measure throughput and latency for several batch sizes and numbers of
+connections.
+
+The latency of a report is the time from the start of sending its batch until
+the server's consumer has received it."""
+
+import asyncio
+import socket
+import time
+from typing import Dict, List, Union
+
+import _util
+from aionsca import Client, Pool, State
+from aionsca.server import Server
+
+BATCH_SIZES = (1, 10, 100, 1000)
+CONNECTIONS = (1, 4)
+# Seconds after which a configuration is given up, e.g. if reports were lost
+TIMEOUT = 60
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def loopback(total: int, batch_size: int, connections: int) -> Dict:
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port)
+    sender: Union[Client, Pool]
+    if connections > 1:
+        sender = Pool(size=connections, host="127.0.0.1", port=port)
+    else:
+        sender = Client(host="127.0.0.1", port=port)
+
+    latencies: List[float] = list()
+
+    async def receive():
+        async for batch in server.reports_batched(4096):
+            now = time.perf_counter()
+            latencies.extend(now - float(report.message) for report in batch)
+            if len(latencies) >= total:
+                return now
+
+    async def send(batches: int):
+        for _ in range(batches):
+            sent = str(time.perf_counter())
+            await sender.send_reports(
+                [("loopback", "benchmark", State.OK, sent)] * batch_size
+            )
+
+    async with server:
+        await sender.connect()
+        batches = total // batch_size
+        receiver = asyncio.ensure_future(receive())
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                send(batches // connections + (i < batches % connections))
+                for i in range(connections)
+            )
+        )
+        end = await receiver
+        await sender.disconnect()
+
+    latencies.sort()
+    return dict(
+        rate=len(latencies) / (end - start),
+        p50_ms=round(percentile(latencies, 50) * 1e3, 3),
+        p99_ms=round(percentile(latencies, 99) * 1e3, 3),
+    )
+
+
+def collect(quick: bool = False) -> List[Dict]:
+    total = 1000 if quick else 20000
+    results: List[Dict] = list()
+    for connections in CONNECTIONS:
+        for batch_size in BATCH_SIZES:
+            params = dict(batch_size=batch_size, connections=connections)
+            try:
+                measured = asyncio.run(
+                    asyncio.wait_for(loopback(total, **params), TIMEOUT)
+                )
+            except Exception as e:
+                results.append(_util.error("loopback", "send_reports", e, **params))
+                continue
+            results.append(
+                _util.result(
+                    "loopback",
+                    "send_reports",
+                    measured.pop("rate"),
+                    "reports/s",
+                    **params,
+                    **measured,
+                )
+            )
+    return results
+
+
+if __name__ == "__main__":
+    _util.main(__doc__, collect)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare writing reports to a Nagios command FIFO the way the C nsca daemon
+does without aggregate_writes (open, write one line, close for every report)
+with the batched writes of aionsca.nagios.CommandFileWriter."""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import _util
+from aionsca import State
+from aionsca.nagios import CommandFileWriter, format_command
+from aionsca.protocol import Report
+
+
+def drain(path: str, stop: threading.Event):
+    """Read the FIFO like Nagios does, reopening it after each writer"""
+    while not stop.is_set():
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            while os.read(fd, 1 << 16):
+                pass
+        finally:
+            os.close(fd)
+
+
+def write_per_report(path: str, reports):
+    for report in reports:
+        with open(path, "w") as command_file:
+            command_file.write(format_command(report))
+            command_file.flush()
+
+
+def write_batched(path: str, reports, batch_size: int, atomic_writes: bool):
+    async def write():
+        writer = CommandFileWriter(path, atomic_writes=atomic_writes)
+        for start in range(0, len(reports), batch_size):
+            await writer.write_reports(reports[start : start + batch_size])
+        writer.close()
+
+    asyncio.run(write())
+
+
+def collect(quick: bool = False) -> List[Dict]:
+    count = 2000 if quick else 20000
+    batch_size = 1024
+    reports = [
+        Report.from_fields(
+            f"compute-node-{i:04d}.cluster.example.org",
+            "metricq source heartbeat",
+            State.WARNING,
+            "Last metric received 42 seconds ago",
+            1568208000,
+        )
+        for i in range(count)
+    ]
+    results: List[Dict] = list()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "nagios.cmd")
+        os.mkfifo(path)
+        stop = threading.Event()
+        reader = threading.Thread(target=drain, args=(path, stop), daemon=True)
+        reader.start()
+
+        for name, run in [
+            ("per report (nsca)", lambda: write_per_report(path, reports)),
+            ("batched atomic", lambda: write_batched(path, reports, batch_size, True)),
+            ("batched", lambda: write_batched(path, reports, batch_size, False)),
+        ]:
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+            results.append(_util.result("nagios", name, count / seconds, "reports/s"))
+
+        stop.set()
+        # Unblock the reader waiting for the next writer
+        os.close(os.open(path, os.O_WRONLY))
+    return results
+
+
+if __name__ == "__main__":
+    _util.main(__doc__, collect)
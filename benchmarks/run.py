@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run the aionsca benchmark suite and optionally write all results to a JSON
+file, so that runs on different versions can be compared."""
+
+import importlib
+from typing import Dict, List
+
+import _util
+
+SUITES = ("codec", "crypto", "loopback", "nagios")
+
+
+def main():
+    parser = _util.argument_parser(__doc__)
+    parser.add_argument(
+        "suites",
+        nargs="*",
+        metavar="SUITE",
+        help=f"suites to run, any of {', '.join(SUITES)} (default: all)",
+    )
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+
+    results: List[Dict] = list()
+    for suite in args.suites or SUITES:
+        try:
+            module = importlib.import_module(f"bench_{suite}")
+            results.extend(module.collect(args.quick))
+        except Exception as e:
+            results.append(_util.error(suite, "collect", e))
+
+    if args.json:
+        _util.write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,65 +20,16 @@
 # You should have received a copy of the GNU General Public License
 # along with metricq.  If not, see <http://www.gnu.org/licenses/>.
 
-import asyncio
-import logging
 import sys
-from functools import wraps
-from typing import Dict, TextIO, Optional
+from typing import Optional
 
 import click
 import click_log
 
 from aionsca import Client, EncryptionMethod
+from aionsca.cli import comain, get_logger, parse_config_file
 
-
-def comain(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
-
-    return wrapper
-
-
-class LogFormatter(logging.Formatter):
-    colors = {
-        "error": dict(fg="red"),
-        "exception": dict(fg="red"),
-        "critical": dict(fg="red"),
-        "debug": dict(fg="blue"),
-        "warning": dict(fg="yellow"),
-    }
-
-    def format(self, record: logging.LogRecord):
-        if not record.exc_info:
-            level = record.levelname.lower()
-            msg = record.getMessage()
-            if level in self.colors:
-                prefix = click.style(f"{level}:{record.name}: ", **self.colors[level])
-                msg = "\n".join(prefix + x for x in msg.splitlines())
-            return msg
-        return logging.Formatter.format(self, record)
-
-
-logger = logging.getLogger()
-handler = click_log.ClickHandler()
-handler.formatter = LogFormatter()
-logger.addHandler(handler)
-
-
-def parse_config_file(fp: TextIO) -> Dict[str, str]:
-    config: Dict[str, str] = dict()
-    line: str
-    for line in fp:
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        try:
-            key, value = line.split("=", 1)
-            config[key] = value.strip()
-        except ValueError as e:
-            raise ValueError(f"Invalid config key {line}") from e
-    return config
+logger = get_logger()
 
 
 @click.command()
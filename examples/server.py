@@ -21,50 +21,16 @@
 # along with metricq.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
-import logging
-from functools import wraps
 from textwrap import indent
 from datetime import datetime
 
 import click
 import click_log
 
-
+from aionsca.cli import comain, get_logger
 from aionsca.server import Server
 
-
-def comain(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
-
-    return wrapper
-
-
-class LogFormatter(logging.Formatter):
-    colors = {
-        "error": dict(fg="red"),
-        "exception": dict(fg="red"),
-        "critical": dict(fg="red"),
-        "debug": dict(fg="blue"),
-        "warning": dict(fg="yellow"),
-    }
-
-    def format(self, record: logging.LogRecord):
-        if not record.exc_info:
-            level = record.levelname.lower()
-            msg = record.getMessage()
-            if level in self.colors:
-                prefix = click.style(f"{level}:{record.name}: ", **self.colors[level])
-                msg = "\n".join(prefix + x for x in msg.splitlines())
-            return msg
-        return logging.Formatter.format(self, record)
-
-
-logger = logging.getLogger()
-handler = click_log.ClickHandler()
-handler.formatter = LogFormatter()
-logger.addHandler(handler)
+logger = get_logger()
 
 
 @click.command()
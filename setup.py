@@ -38,6 +38,18 @@ setup(
     python_requires=">=3.7",
     packages=find_packages(),
     scripts=[],
-    install_requires=["pycrypto~=2.0"],
-    extras_require={"examples": ["click~=7.0", "click-log>=0.3.2"]},
+    entry_points={
+        "console_scripts": [
+            "aionsca-send-nsca=aionsca.cli.send_nsca:main",
+            "aionsca-server=aionsca.cli.server:main",
+            "aionsca-relay=aionsca.cli.relay:main",
+        ]
+    },
+    install_requires=["pycryptodomex>=3.4"],
+    extras_require={
+        "examples": ["click~=7.0", "click-log>=0.3.2"],
+        "cli": ["click>=7.0", "click-log>=0.3.2"],
+        "cryptography": ["cryptography>=2.0"],
+        "pycrypto": ["pycrypto~=2.0"],
+    },
 )
@@ -0,0 +1,212 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import errno
+import socket
+import struct
+import time
+
+from aionsca import Client, EncryptionMethod, Pool, State, Stats
+from aionsca.protocol import InitPacket, ReportPacket
+from aionsca.server import Server
+
+from test_loopback import free_port, receive
+
+
+def encrypted_pair(**client_kwargs):
+    port = free_port()
+    options = dict(password="secret", encryption_method=EncryptionMethod.RIJNDAEL128)
+    server = Server(host="127.0.0.1", port=port, **options)
+    client = Client(host="127.0.0.1", port=port, **options, **client_kwargs)
+    return server, client
+
+
+def test_reconnect_during_send():
+    server, client = encrypted_pair()
+    reports = [("host", f"service-{i}", State.OK, "x" * 1000) for i in range(100)]
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, 20 * len(reports)))
+            async with client:
+                await asyncio.gather(
+                    *(client.send_reports(reports) for _ in range(20)),
+                    *(client.reconnect() for _ in range(20)),
+                )
+            return await asyncio.wait_for(receiver, 10)
+
+    received = asyncio.run(run())
+    assert server.rejected_reports == 0
+    assert len(received) >= 20 * len(reports)
+
+
+def test_pool_reconnect_during_send():
+    port = free_port()
+    options = dict(password="secret", encryption_method=EncryptionMethod.RIJNDAEL128)
+    server = Server(host="127.0.0.1", port=port, **options)
+    pool = Pool(size=2, host="127.0.0.1", port=port, **options)
+    reports = [("host", f"service-{i}", State.OK, "x" * 1000) for i in range(100)]
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, 20 * len(reports)))
+            async with pool:
+                sends = [pool.send_reports(reports) for _ in range(20)]
+                for session in pool._sessions:
+                    pool._schedule_reconnect(session)
+                results = await asyncio.gather(*sends)
+            assert all(result == [None] * len(reports) for result in results)
+            return await asyncio.wait_for(receiver, 10)
+
+    received = asyncio.run(run())
+    assert server.rejected_reports == 0
+    assert len(received) >= 20 * len(reports)
+
+
+def test_monitor_replays_unflushed_reports():
+    reports = [("host", f"service-{i}", State.OK, "x" * 1000) for i in range(1000)]
+    connections = list()
+    received = list()
+
+    async def handle(reader, writer):
+        writer.write(InitPacket.pack(bytes(InitPacket.IV_SIZE), int(time.time())))
+        connections.append(writer)
+        if len(connections) == 1:
+            # Never read, then reset the connection with reports still
+            # buffered by the client
+            await asyncio.sleep(0.2)
+            sock = writer.get_extra_info("socket")
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+            writer.transport.abort()
+            return
+        while len(received) < len(reports):
+            packet = await reader.readexactly(ReportPacket.SIZE)
+            received.append(ReportPacket.unpack(packet).service)
+        writer.close()
+
+    async def run():
+        port = free_port()
+        server = await asyncio.start_server(handle, "127.0.0.1", port)
+        client = Client(host="127.0.0.1", port=port, health_check_interval=0.05)
+        await client.connect()
+        client._writer.transport.set_write_buffer_limits(high=1 << 30)
+        assert await client.send_reports(reports) == [None] * len(reports)
+        for _ in range(100):
+            if len(received) == len(reports):
+                break
+            await asyncio.sleep(0.05)
+        await client.disconnect()
+        server.close()
+
+    asyncio.run(run())
+    # The health check may reconnect again once the test server closed the
+    # second connection
+    assert len(connections) >= 2
+    assert received == [service for _, service, _, _ in reports]
+
+
+def test_send_retries_after_keepalive_timeout():
+    server, client = encrypted_pair(retry_backoff=0.01)
+    reports = [("host", f"service-{i}", State.OK, "message") for i in range(10)]
+
+    async def timed_out():
+        raise TimeoutError(errno.ETIMEDOUT, "Connection timed out")
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, len(reports)))
+            async with client:
+                client._writer.drain = timed_out
+                results = await client.send_reports(reports)
+            return results, await asyncio.wait_for(receiver, 10)
+
+    results, received = asyncio.run(run())
+    assert results == [None] * len(reports)
+    assert [service for _, service, _, _ in received][-len(reports) :] == [
+        service for _, service, _, _ in reports
+    ]
+
+
+def test_retry_deadline_bounds_reconnect():
+    async def silent(reader, writer):
+        # Accept the connection, but never send the init packet
+        await reader.read()
+
+    async def run():
+        port = free_port()
+        server = await asyncio.start_server(silent, "127.0.0.1", port)
+        client = Client(host="127.0.0.1", port=port, retry_deadline=0.2)
+        start = time.monotonic()
+        results = await client.send_reports([("host", None, State.OK, "message")])
+        elapsed = time.monotonic() - start
+        await client.disconnect()
+        server.close()
+        return results, elapsed
+
+    (error,), elapsed = asyncio.run(run())
+    assert isinstance(error, ConnectionError)
+    assert elapsed < 2
+
+
+def test_first_connect_is_not_a_reconnect():
+    stats = Stats()
+    server, client = encrypted_pair(stats=stats)
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, 2))
+            # Connects on the first send
+            await client.send_reports([("host", None, State.OK, "first")])
+            assert stats.counters.get("reconnects", 0) == 0
+            await client.reconnect()
+            await client.send_reports([("host", None, State.OK, "second")])
+            await client.disconnect()
+            await asyncio.wait_for(receiver, 10)
+
+    asyncio.run(run())
+    assert stats.counters["reconnects"] == 1
+
+
+def test_pool_disconnect_while_reconnecting():
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port)
+    pool = Pool(size=3, host="127.0.0.1", port=port)
+
+    async def run():
+        async with server:
+            await pool.connect()
+            assert server.active_connections == 3
+            # One session failed, another one is replacing its connection
+            pool._sessions[0].alive = False
+            for session in pool._sessions[:2]:
+                pool._schedule_reconnect(session)
+            await pool.disconnect()
+            assert all(session.reconnect_task is None for session in pool._sessions)
+            assert pool.connected == 0
+            for _ in range(100):
+                if server.active_connections == 0:
+                    break
+                await asyncio.sleep(0.01)
+            return server.active_connections
+
+    assert asyncio.run(run()) == 0
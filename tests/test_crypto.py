@@ -0,0 +1,132 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import warnings
+
+import pytest
+
+from aionsca.crypto import (
+    KeyScheduleCache,
+    Method,
+    available_backends,
+    get_crypter_by_method,
+)
+from aionsca.protocol import InitPacket, ReportPacket
+
+IV = bytes(range(InitPacket.IV_SIZE))
+# Long enough that the Triple DES key does not degenerate to single DES
+PASSWORD = b"a password of at least 24 bytes"
+DATA = os.urandom(3 * ReportPacket.SIZE)
+
+OPENSSL_METHODS = [Method.DES, Method.TRIPLE_DES, Method.RIJNDAEL128]
+
+
+def crypter(method, backend, **kwargs):
+    return get_crypter_by_method(
+        method, iv=IV, password=PASSWORD, backend=backend, **kwargs
+    )
+
+
+@pytest.mark.parametrize("method", OPENSSL_METHODS)
+def test_openssl_without_deprecation_warnings(method):
+    if "cryptography" not in available_backends(method):
+        pytest.skip("cryptography is not installed")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        crypter(method, "cryptography").encrypt(DATA)
+
+
+@pytest.mark.parametrize("method", OPENSSL_METHODS)
+def test_openssl_matches_pep272(method):
+    backends = available_backends(method)
+    if "cryptography" not in backends or "pycryptodomex" not in backends:
+        pytest.skip("cryptography or pycryptodomex is not installed")
+    assert crypter(method, "cryptography").encrypt(DATA) == crypter(
+        method, "pycryptodomex"
+    ).encrypt(DATA)
+
+
+CACHED_METHODS = [
+    Method.DES,
+    Method.TRIPLE_DES,
+    Method.CAST128,
+    Method.BLOWFISH,
+    Method.RC2,
+]
+
+
+@pytest.mark.parametrize("backend", ["pycryptodomex", "pycrypto"])
+@pytest.mark.parametrize("method", CACHED_METHODS)
+@pytest.mark.parametrize(
+    "password", [b"x", b"8 bytes!", b"a password of at least 24 bytes" * 5]
+)
+def test_cached_key_schedule_matches_cfb8(backend, method, password, monkeypatch):
+    if backend not in available_backends(method):
+        pytest.skip(f"{backend} is not installed")
+
+    def new(**kwargs):
+        return get_crypter_by_method(
+            method, iv=IV, password=password, backend=backend, **kwargs
+        )
+
+    # Also check ciphers for which caching is disabled since it does not pay off
+    monkeypatch.setattr(type(new()), "cache_key_schedule", True)
+
+    key_cache = KeyScheduleCache()
+    packets = os.urandom(5 * ReportPacket.SIZE)
+    for connection in range(2):
+        # The second connection uses the cached key schedule
+        ciphertext = new().encrypt(packets)
+        cached = new(key_cache=key_cache)
+        assert cached._ecb is not None
+        reference = new()
+        assert reference._ecb is None
+
+        # Decrypt a stream received in chunks of uneven sizes
+        plaintext = b""
+        offset = 0
+        for size in (1, 7, ReportPacket.SIZE, 2 * ReportPacket.SIZE - 3, 4096):
+            chunk = ciphertext[offset : offset + size]
+            offset += size
+            decrypted = cached.decrypt(chunk)
+            assert decrypted == reference.decrypt(chunk)
+            plaintext += decrypted
+        plaintext += cached.decrypt(ciphertext[offset:])
+        assert plaintext == packets
+
+    assert key_cache.hits == 1
+
+
+@pytest.mark.parametrize("password", [b"x", b"8 bytes!", b"xxxxxxxxxxxxxxxxyz"])
+def test_degenerate_triple_des_key(password):
+    # These keys degenerate to single DES, which pycryptodome refuses
+    backends = available_backends(Method.TRIPLE_DES)
+    if "cryptography" not in backends or "pycryptodomex" not in backends:
+        pytest.skip("cryptography or pycryptodomex is not installed")
+
+    def new(backend):
+        return get_crypter_by_method(
+            Method.TRIPLE_DES, iv=IV, password=password, backend=backend
+        )
+
+    ciphertext = new("pycryptodomex").encrypt(DATA)
+    assert ciphertext == new("cryptography").encrypt(DATA)
+    assert new("pycryptodomex").decrypt(ciphertext) == DATA
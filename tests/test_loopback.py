@@ -0,0 +1,116 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import socket
+import tempfile
+
+import pytest
+
+from aionsca import Client, EncryptionMethod, Pool, State
+from aionsca.server import Server
+
+REPORTS = [
+    ("loopback", f"service-{i}", State(i % 4), f"message {i}") for i in range(250)
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def receive(server: Server, count: int):
+    received = list()
+    async for batch in server.reports_batched():
+        received.extend(
+            (report.hostname, report.service, report.state, report.message)
+            for report in batch
+        )
+        if len(received) >= count:
+            return received
+
+
+async def send_and_receive(server: Server, sender):
+    async with server:
+        receiver = asyncio.ensure_future(receive(server, len(REPORTS)))
+        async with sender:
+            results = await sender.send_reports(REPORTS)
+        assert results == [None] * len(REPORTS)
+        return await asyncio.wait_for(receiver, 10)
+
+
+@pytest.mark.parametrize(
+    "method",
+    [
+        EncryptionMethod.PLAINTEXT,
+        EncryptionMethod.XOR,
+        EncryptionMethod.RIJNDAEL128,
+        EncryptionMethod.CAST128,
+        # Decrypted by the server with a cached key schedule
+        EncryptionMethod.BLOWFISH,
+    ],
+)
+def test_client_tcp(method):
+    port = free_port()
+    server = Server(
+        host="127.0.0.1", port=port, password="secret", encryption_method=method
+    )
+    client = Client(
+        host="127.0.0.1", port=port, password="secret", encryption_method=method
+    )
+    received = asyncio.run(send_and_receive(server, client))
+    assert received == REPORTS
+
+
+def test_pool_tcp():
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port)
+    pool = Pool(size=3, host="127.0.0.1", port=port)
+    received = asyncio.run(send_and_receive(server, pool))
+    assert sorted(received) == sorted(REPORTS)
+
+
+def test_client_unix_socket():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "nsca.sock")
+        server = Server(path=path)
+        client = Client(path=path)
+        received = asyncio.run(send_and_receive(server, client))
+        assert received == REPORTS
+        assert not os.path.exists(path)
+
+
+def test_truncated_multibyte_message():
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port)
+    client = Client(host="127.0.0.1", port=port)
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, 1))
+            async with client:
+                await client.send_reports([("host", None, State.OK, "ä" * 3000)])
+            return await asyncio.wait_for(receiver, 10)
+
+    ((_, _, _, message),) = asyncio.run(run())
+    assert message.endswith("ä�")
@@ -0,0 +1,124 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+
+from aionsca import State
+from aionsca.nagios import (
+    CheckResultWriter,
+    CommandFileWriter,
+    format_command,
+    fresh_reports,
+)
+from aionsca.protocol import Report, ReportPacket
+
+
+def reports(count: int):
+    return [
+        ReportPacket.unpack(
+            ReportPacket.pack("host", f"service-{i}", State.OK, "message", 1)
+        )
+        for i in range(count)
+    ]
+
+
+def test_format_service_command():
+    report = Report.from_fields("host", "disk", State.WARNING, "line 1\r\nline 2", 7)
+    assert format_command(report) == (
+        "[7] PROCESS_SERVICE_CHECK_RESULT;host;disk;1;line 1\\nline 2\n"
+    )
+
+
+def test_format_host_command():
+    report = Report.from_fields("host", "", State.CRITICAL, "down", 7)
+    assert format_command(report) == "[7] PROCESS_HOST_CHECK_RESULT;host;2;down\n"
+
+
+def test_append_to_file(tmp_path):
+    path = str(tmp_path / "nagios.cmd")
+    writer = CommandFileWriter(path, append=True)
+    batch = reports(10)
+    asyncio.run(writer.write_reports(batch))
+    writer.close()
+    with open(path) as fp:
+        assert fp.read() == "".join(format_command(report) for report in batch)
+    assert writer.written_reports == 10
+
+
+def test_fifo_without_reader_can_be_cancelled(tmp_path):
+    path = str(tmp_path / "nagios.cmd")
+    os.mkfifo(path)
+    writer = CommandFileWriter(path, reopen_interval=0.05)
+
+    async def run():
+        task = asyncio.ensure_future(writer.write_reports(reports(1)))
+        await asyncio.sleep(0.2)
+        assert not task.done()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert writer.written_reports == 0
+
+
+def test_check_result_file(tmp_path):
+    writer = CheckResultWriter(str(tmp_path))
+    batch = [
+        Report.from_fields("host", "disk", State.WARNING, "line 1\nline 2", 7),
+        Report.from_fields("host", "", State.OK, "up", 8),
+    ]
+    asyncio.run(writer.write_reports(batch))
+    assert (writer.written_reports, writer.writes) == (2, 1)
+
+    (name,) = [name for name in os.listdir(tmp_path) if not name.endswith(".ok")]
+    assert len(name) == 7 and name.startswith("c")
+    assert os.path.exists(tmp_path / f"{name}.ok")
+    header, *entries = (tmp_path / name).read_text().split("\n\n")
+    assert header.startswith("### NSCA Passive Check Result ###\n")
+    assert entries[0].split("\n") == [
+        "host_name=host",
+        "service_description=disk",
+        "check_type=1",
+        "check_options=0",
+        "scheduled_check=0",
+        "reschedule_check=0",
+        "latency=0",
+        "start_time=7.0",
+        "finish_time=7.0",
+        "early_timeout=0",
+        "exited_ok=1",
+        "return_code=1",
+        "output=line 1\\nline 2",
+    ]
+    assert "service_description" not in entries[1]
+    assert "output=up" in entries[1].split("\n")
+
+
+def test_fresh_reports():
+    batch = [
+        Report.from_fields("host", f"service-{t}", State.OK, "message", t)
+        for t in (60, 90, 100, 110, 140)
+    ]
+    assert fresh_reports(batch, 10, now=100) == batch[1:4]
+    assert fresh_reports(batch, 0, now=100) == batch
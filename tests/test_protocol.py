@@ -0,0 +1,156 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import binascii
+import struct
+
+import pytest
+
+from aionsca import State
+from aionsca.protocol import (
+    BYTES_LOWERCASE,
+    Padding,
+    ReportChecksumMismatchError,
+    ReportPacket,
+    random_bytes_padded,
+)
+
+REPORTS = [
+    ("host", "service", State.OK, "message"),
+    ("", "", State.CRITICAL, ""),
+    ("h" * 100, "s" * 200, State.WARNING, "m" * 5000),
+    ("hóst", "sérvice", State.UNKNOWN, "ä" * 3000),
+]
+
+FIELDS = [
+    (ReportPacket._OFFSET_HOSTNAME, ReportPacket.MAX_LENGTH_HOSTNAME),
+    (ReportPacket._OFFSET_SERVICE, ReportPacket.MAX_LENGTH_SERVICE),
+    (ReportPacket._OFFSET_MESSAGE, ReportPacket.MAX_LENGTH_MESSAGE),
+]
+
+
+def legacy_pack(hostname, service, state, message, timestamp) -> bytes:
+    """How packets were packed before pack_into, with random padding"""
+    packet = bytearray(
+        struct.pack(
+            ReportPacket._FMT,
+            ReportPacket.PACKET_VERSION,
+            0,
+            timestamp,
+            State(state).value,
+            random_bytes_padded(hostname, ReportPacket.MAX_LENGTH_HOSTNAME),
+            random_bytes_padded(service, ReportPacket.MAX_LENGTH_SERVICE),
+            random_bytes_padded(message, ReportPacket.MAX_LENGTH_MESSAGE),
+        )
+    )
+    struct.pack_into("!L", packet, 4, binascii.crc32(packet) & 0xFFFFFFFF)
+    return bytes(packet)
+
+
+def split_padding(packet: bytes):
+    """Return the packet with checksum and padding zeroed, and the padding"""
+    packet = bytearray(packet)
+    packet[ReportPacket._OFFSET_CRC : ReportPacket._OFFSET_CRC + 4] = bytes(4)
+    padding = bytearray()
+    for offset, length in FIELDS:
+        start = packet.index(0, offset, offset + length) + 1
+        end = max(start, offset + length - 1)
+        padding += packet[start:end]
+        packet[start:end] = bytes(end - start)
+    return bytes(packet), bytes(padding)
+
+
+def assert_equivalent(packet: bytes, padding: Padding, reference: bytes):
+    """Assert that ``packet`` equals the ``reference`` packet except for
+    padding, and carries a valid checksum"""
+    assert len(packet) == ReportPacket.SIZE
+    (crc,) = struct.unpack_from("!L", packet, ReportPacket._OFFSET_CRC)
+    assert crc == ReportPacket.checksum(packet)
+    content, pad = split_padding(packet)
+    assert content == split_padding(reference)[0]
+    if padding is Padding.ZERO:
+        assert not any(pad)
+    else:
+        assert set(pad) <= set(BYTES_LOWERCASE)
+
+
+@pytest.mark.parametrize("padding", list(Padding))
+def test_pack_matches_legacy_pack(padding):
+    for report in REPORTS:
+        packet = ReportPacket.pack(*report, 1234, padding=padding)
+        assert_equivalent(packet, padding, legacy_pack(*report, 1234))
+
+
+@pytest.mark.parametrize("padding", list(Padding))
+def test_pack_into_reused_buffer(padding):
+    size = ReportPacket.SIZE
+    # Previous contents must be overwritten entirely
+    buffer = bytearray(b"\xff" * (len(REPORTS) * size + 3))
+    for index, report in enumerate(REPORTS):
+        ReportPacket.pack_into(
+            buffer, 3 + index * size, *report, timestamp=1234, padding=padding
+        )
+    assert buffer[:3] == b"\xff" * 3
+    for index, report in enumerate(REPORTS):
+        packet = bytes(buffer[3 + index * size : 3 + (index + 1) * size])
+        assert_equivalent(packet, padding, legacy_pack(*report, 1234))
+
+
+@pytest.mark.parametrize("padding", list(Padding))
+def test_pack_many_matches_pack(padding):
+    size = ReportPacket.SIZE
+    buffer = ReportPacket.pack_many(REPORTS, 1234, padding=padding)
+    assert len(buffer) == len(REPORTS) * size
+    for index, report in enumerate(REPORTS):
+        packet = bytes(buffer[index * size : (index + 1) * size])
+        assert_equivalent(packet, padding, legacy_pack(*report, 1234))
+        assert ReportPacket.unpack(packet) == ReportPacket.unpack(
+            ReportPacket.pack(*report, 1234, padding=padding)
+        )
+
+    if padding is Padding.ZERO:
+        # Without random padding, the bytes are exactly the same
+        assert bytes(buffer) == b"".join(
+            ReportPacket.pack(*report, 1234, padding=padding) for report in REPORTS
+        )
+
+
+def corrupted_packet() -> bytes:
+    packet = bytearray(ReportPacket.pack("host", "service", State.OK, "message", 1))
+    packet[ReportPacket._OFFSET_MESSAGE] ^= 0x01
+    return bytes(packet)
+
+
+def test_unpack_rejects_corrupted_packet():
+    with pytest.raises(ReportChecksumMismatchError):
+        ReportPacket.unpack(corrupted_packet())
+
+
+def test_unpack_without_crc_verification():
+    report = ReportPacket.unpack(corrupted_packet(), verify_crc=False)
+    assert report == ("host", "service", State.OK, "lessage", 1)
+
+
+def test_unpack_truncated_multibyte_character():
+    # The message is cut off in the middle of an "ä" (2 bytes in UTF-8)
+    packet = ReportPacket.pack("host", "service", State.OK, "ä" * 3000, 1)
+    hostname, service, state, message, timestamp = ReportPacket.unpack(packet)
+    assert (hostname, service, state, timestamp) == ("host", "service", State.OK, 1)
+    assert message == "ä" * ((ReportPacket.MAX_LENGTH_MESSAGE - 2) // 2) + "�"
@@ -0,0 +1,232 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from aionsca import Client, State
+from aionsca.client import same_state
+from aionsca.queue import OverflowPolicy, QueueFull, ReportQueue
+from aionsca.server import Server
+
+from test_loopback import free_port, receive
+
+
+def report(service: str, state: State = State.OK, message: str = ""):
+    return ("host", service, state, message)
+
+
+def key(item):
+    return item[0], item[1]
+
+
+def test_parse_policy():
+    assert OverflowPolicy.parse("drop-oldest") is OverflowPolicy.DROP_OLDEST
+    assert OverflowPolicy.parse("DROP_NEWEST") is OverflowPolicy.DROP_NEWEST
+    assert OverflowPolicy.parse(OverflowPolicy.BLOCK) is OverflowPolicy.BLOCK
+
+
+def test_block():
+    async def run():
+        queue = ReportQueue(2, policy="block")
+        assert queue.put_nowait(1) and queue.put_nowait(2)
+        with pytest.raises(QueueFull):
+            queue.put_nowait(3)
+
+        put = asyncio.ensure_future(queue.put(3))
+        await asyncio.sleep(0.01)
+        assert not put.done()
+        assert await queue.get_batch(1) == [1]
+        assert await asyncio.wait_for(put, 1)
+        assert await queue.get_batch(10) == [2, 3]
+        assert (queue.dropped, queue.coalesced, queue.high_water) == (0, 0, 2)
+
+    asyncio.run(run())
+
+
+def test_drop_oldest():
+    async def run():
+        queue = ReportQueue(3, policy=OverflowPolicy.DROP_OLDEST)
+        assert all([queue.put_nowait(item) for item in range(5)])
+        assert queue.dropped == 2
+        assert await queue.get_batch(10) == [2, 3, 4]
+
+        # Dropped items are never processed, so they do not block join()
+        queue.task_done(3)
+        await asyncio.wait_for(queue.join(), 1)
+
+    asyncio.run(run())
+
+
+def test_drop_newest():
+    async def run():
+        queue = ReportQueue(3, policy=OverflowPolicy.DROP_NEWEST)
+        assert [queue.put_nowait(item) for item in range(5)] == [True] * 3 + [False] * 2
+        assert queue.dropped == 2
+        assert queue.high_water == 3
+        assert await queue.get_batch(10) == [0, 1, 2]
+
+    asyncio.run(run())
+
+
+def test_coalesce_requires_key():
+    with pytest.raises(ValueError):
+        ReportQueue(3, policy=OverflowPolicy.COALESCE)
+
+
+def test_coalesce():
+    async def run():
+        queue = ReportQueue(3, policy=OverflowPolicy.COALESCE, key=key)
+        queue.put_nowait(report("a", message="1"))
+        queue.put_nowait(report("b"))
+        # Replaced in place, even though the queue is not full
+        queue.put_nowait(report("a", message="2"))
+        assert len(queue) == 2 and queue.coalesced == 1
+
+        queue.put_nowait(report("c"))
+        # Full, and no queued report for "d": the oldest one is dropped
+        queue.put_nowait(report("d"))
+        assert queue.dropped == 1
+        assert await queue.get_batch(10) == [report("b"), report("c"), report("d")]
+
+        # Reports taken from the queue are no longer replaced
+        queue.put_nowait(report("b", message="new"))
+        assert queue.coalesced == 1
+        assert await queue.get_batch(10) == [report("b", message="new")]
+
+    asyncio.run(run())
+
+
+def test_coalesce_keeps_state_changes():
+    async def run():
+        queue = ReportQueue(
+            10, policy=OverflowPolicy.COALESCE, key=key, supersedes=same_state
+        )
+        queue.put_nowait(report("a", State.OK, "1"))
+        queue.put_nowait(report("a", State.CRITICAL, "2"))
+        queue.put_nowait(report("a", State.CRITICAL, "3"))
+        queue.put_nowait(report("a", State.OK, "4"))
+        assert queue.coalesced == 1
+        assert await queue.get_batch(10) == [
+            report("a", State.OK, "1"),
+            report("a", State.CRITICAL, "3"),
+            report("a", State.OK, "4"),
+        ]
+
+    asyncio.run(run())
+
+
+def test_same_state():
+    assert same_state(report("a", State.OK, "1"), report("a", State.OK, "2"))
+    assert not same_state(report("a", State.OK), report("a", State.WARNING))
+
+
+def test_client_submit_counters():
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port)
+    client = Client(
+        host="127.0.0.1", port=port, queue_size=3, overflow_policy="coalesce"
+    )
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, 3))
+            async with client:
+                # Nothing is sent before the first await that yields
+                await client.submit("host", "a", State.OK, "1")
+                await client.submit("host", "a", State.OK, "2")
+                await client.submit("host", "a", State.CRITICAL, "3")
+                await client.submit("host", "b", State.OK, "4")
+                await client.submit("host", "c", State.OK, "5")
+                assert client.queue_depth == 3
+                await asyncio.wait_for(client.flush(), 5)
+                assert client.queue_depth == 0
+            return await asyncio.wait_for(receiver, 5)
+
+    received = asyncio.run(run())
+    assert [message for _, _, _, message in received] == ["3", "4", "5"]
+    assert client.coalesced_reports == 1
+    assert client.dropped_reports == 1
+    assert client.failed_reports == 0
+
+
+@pytest.mark.parametrize("keep_state_changes", [True, False])
+def test_send_report_coalescing(keep_state_changes):
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port)
+    client = Client(
+        host="127.0.0.1",
+        port=port,
+        coalesce=True,
+        keep_state_changes=keep_state_changes,
+    )
+
+    async def run():
+        async with server:
+            async with client:
+                # Reports wait for the send lock and can be superseded
+                async with client._send_lock:
+                    sends = [
+                        asyncio.ensure_future(client.send_report("host", *args))
+                        for args in (
+                            ("a", State.OK, "1"),
+                            ("a", State.OK, "2"),
+                            ("a", State.CRITICAL, "3"),
+                        )
+                    ]
+                    await asyncio.sleep(0.01)
+                return await asyncio.gather(*sends)
+
+    results = asyncio.run(run())
+    if keep_state_changes:
+        assert results == [False, True, True]
+        assert client.coalesced_reports == 1
+    else:
+        assert results == [False, False, True]
+        assert client.coalesced_reports == 2
+
+
+@pytest.mark.parametrize("policy", ["drop-oldest", "drop-newest"])
+def test_server_sheds_reports(policy):
+    port = free_port()
+    server = Server(
+        host="127.0.0.1", port=port, max_queue_size=10, overflow_policy=policy
+    )
+    client = Client(host="127.0.0.1", port=port)
+    reports = [report(f"service-{i}") for i in range(50)]
+
+    async def run():
+        async with server:
+            async with client:
+                await client.send_reports(reports)
+            # Nobody consumes the queue until all reports were received
+            for _ in range(100):
+                if server.shed_reports == 40:
+                    break
+                await asyncio.sleep(0.05)
+            return await asyncio.wait_for(receive(server, 10), 5)
+
+    received = asyncio.run(run())
+    assert server.shed_reports == 40
+    expected = reports[-10:] if policy == "drop-oldest" else reports[:10]
+    assert [service for _, service, _, _ in received] == [
+        service for _, service, _, _ in expected
+    ]
@@ -0,0 +1,131 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+from aionsca import EncryptionMethod, State
+from aionsca.server import Server
+
+pytest.importorskip("click")
+pytest.importorskip("click_log")
+
+from aionsca.cli.send_nsca import InputParser  # noqa: E402
+
+from test_loopback import free_port, receive  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LINES = "host\tservice\t1\tline 1\\nline 2\nhost\t0\tup\n"
+BLOCKS = "host\tservice\t1\tline 1\nline 2\n\x17host\t0\tup\n\x17"
+EXPECTED = [("host", "service", 1, "line 1\nline 2"), ("host", None, 0, "up")]
+
+
+def parse(text: str, chunk_size: int):
+    parser = InputParser()
+    reports = list()
+    for start in range(0, len(text), chunk_size):
+        reports.extend(parser.feed(text[start : start + chunk_size]))
+    reports.extend(parser.close())
+    return parser, reports
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 17, 1000])
+def test_parse_lines(chunk_size):
+    parser, reports = parse(LINES, chunk_size)
+    assert reports == EXPECTED
+    assert parser.block_mode is False
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 17, 1000])
+def test_parse_blocks(chunk_size):
+    # Reads ending before the first separator must not be parsed as lines
+    parser, reports = parse(BLOCKS, chunk_size)
+    assert reports == EXPECTED
+    assert parser.block_mode is True
+
+
+def test_parse_unterminated_and_invalid():
+    parser, reports = parse("host\t0\tup\nnot a report\nhost\tsvc\t2\tdown", 1000)
+    assert reports == [("host", None, 0, "up"), ("host", "svc", 2, "down")]
+    assert parser.invalid == 1
+
+
+def send_nsca(tmp_path, *args, stdin: str = ""):
+    config = tmp_path / "send_nsca.cfg"
+    config.write_text("password=secret\nencryption_method=1\n")
+    return subprocess.run(
+        [sys.executable, "-m", "aionsca.cli.send_nsca", "-c", str(config), *args],
+        input=stdin,
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        timeout=30,
+    )
+
+
+def test_exit_code_sent(tmp_path):
+    port = free_port()
+    server = Server(
+        host="127.0.0.1",
+        port=port,
+        password="secret",
+        encryption_method=EncryptionMethod.XOR,
+    )
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, 2))
+            result = await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: send_nsca(
+                    tmp_path, "-H", "127.0.0.1", "-p", str(port), stdin=BLOCKS
+                ),
+            )
+            return result, await asyncio.wait_for(receiver, 10)
+
+    result, received = asyncio.run(run())
+    assert result.returncode == 0
+    assert "2 data packet(s) sent to host successfully." in result.stdout
+    assert received == [
+        ("host", "service", State.WARNING, "line 1\nline 2"),
+        ("host", "", State.OK, "up"),
+    ]
+
+
+def test_exit_code_connection_refused(tmp_path):
+    result = send_nsca(
+        tmp_path, "-H", "127.0.0.1", "-p", str(free_port()), "-to", "1", stdin=LINES
+    )
+    assert result.returncode == State.CRITICAL.value
+
+
+def test_exit_code_missing_config_file(tmp_path):
+    result = send_nsca(tmp_path, "-c", str(tmp_path / "missing.cfg"))
+    assert result.returncode == State.CRITICAL.value
+
+
+def test_exit_code_invalid_usage(tmp_path):
+    result = send_nsca(tmp_path, "--connections", "0")
+    assert result.returncode == State.UNKNOWN.value
@@ -0,0 +1,126 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from aionsca import Client, State
+from aionsca.protocol import InitPacket, ReportPacket
+from aionsca.server import Server
+
+from test_loopback import free_port, receive
+
+
+def test_max_connections_defers_accepting():
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port, max_connections=2)
+    clients = [Client(host="127.0.0.1", port=port) for _ in range(4)]
+
+    async def send(client: Client, index: int):
+        async with client:
+            await client.send_reports([("host", f"service-{index}", State.OK, "")])
+            await asyncio.sleep(0.1)
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, len(clients)))
+            await asyncio.gather(
+                *(send(client, index) for index, client in enumerate(clients))
+            )
+            received = await asyncio.wait_for(receiver, 10)
+            return sorted(service for _, service, _, _ in received)
+
+    assert asyncio.run(run()) == [f"service-{i}" for i in range(len(clients))]
+    assert server.peak_connections == 2
+    assert server.refused_connections == 0
+
+
+def test_waiting_client_is_accepted_once_a_connection_closes():
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port, max_connections=1)
+    first = Client(host="127.0.0.1", port=port)
+    second = Client(host="127.0.0.1", port=port)
+
+    async def run():
+        async with server:
+            await first.connect()
+            waiting = asyncio.ensure_future(second.connect())
+            await asyncio.sleep(0.2)
+            assert not waiting.done()
+            assert server.active_connections == 1
+            await first.disconnect()
+            await asyncio.wait_for(waiting, 5)
+            assert server.active_connections == 1
+            await second.disconnect()
+
+    asyncio.run(run())
+    assert server.refused_connections == 0
+
+
+@pytest.mark.parametrize("verify_crc", [True, False])
+def test_corrupted_packet(verify_crc):
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port, verify_crc=verify_crc)
+    packet = bytearray(ReportPacket.pack("host", "service", State.OK, "message", 1))
+    packet[ReportPacket._OFFSET_MESSAGE] ^= 0x01
+
+    async def run():
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, 1))
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            await reader.readexactly(InitPacket.SIZE)
+            writer.write(packet)
+            writer.write_eof()
+            # Wait for the server to close the connection
+            await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            try:
+                return await asyncio.wait_for(receiver, 0.5)
+            except asyncio.TimeoutError:
+                return []
+
+    received = asyncio.run(run())
+    if verify_crc:
+        assert received == []
+        assert server.rejected_reports == 1
+    else:
+        assert received == [("host", "service", State.OK, "lessage")]
+        assert server.rejected_reports == 0
+
+
+def test_event_loop_accepts_without_max_connections():
+    port = free_port()
+    server = Server(host="127.0.0.1", port=port, max_connections_per_host=1)
+    first = Client(host="127.0.0.1", port=port)
+
+    async def run():
+        async with server:
+            assert server._server.is_serving()
+            assert not server._listening
+            await first.connect()
+            # Refused by the per host limit, the server closes it right away
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            assert await asyncio.wait_for(reader.read(), 5) == b""
+            writer.close()
+            await first.disconnect()
+
+    asyncio.run(run())
+    assert server.refused_connections == 1
@@ -0,0 +1,97 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+from aionsca import Client, Spool, State
+from aionsca.server import Server
+
+from test_loopback import free_port, receive
+
+REPORTS = [("host", f"service-{i}", State.WARNING, f"message {i}") for i in range(10)]
+
+
+def test_take_commit_release(tmp_path):
+    with Spool(str(tmp_path / "spool")) as spool:
+        spool.append(REPORTS)
+        assert len(spool) == len(REPORTS)
+        assert spool.take(4) == REPORTS[:4]
+        spool.release()
+        assert spool.take(4) == REPORTS[:4]
+        spool.commit()
+        assert spool.take(100) == REPORTS[4:]
+        spool.commit()
+        assert len(spool) == 0
+        assert spool.size == 0
+
+
+def test_reports_survive_reopening(tmp_path):
+    path = str(tmp_path / "spool")
+    with Spool(path) as spool:
+        spool.append(REPORTS)
+        spool.take(3)
+        spool.commit()
+    with Spool(path) as spool:
+        assert spool.take(100) == REPORTS[3:]
+
+
+def test_sync_without_further_appends(tmp_path):
+    with Spool(str(tmp_path / "spool"), fsync_interval=0.05) as spool:
+        spool.append(REPORTS)
+        assert not spool._synced
+        time.sleep(0.3)
+        assert spool._synced
+
+
+def test_compact_drops_oldest(tmp_path):
+    max_size = 5 * Spool.RECORD_SIZE
+    with Spool(str(tmp_path / "spool"), max_size=max_size) as spool:
+        spool.append(REPORTS)
+        assert spool.size <= max_size
+        kept = spool.take(100)
+        assert kept == REPORTS[-len(kept) :]
+        assert spool.dropped == len(REPORTS) - len(kept)
+
+
+def test_client_replays_spool(tmp_path):
+    port = free_port()
+    spool = Spool(str(tmp_path / "spool"))
+    client = Client(
+        host="127.0.0.1", port=port, spool=spool, retry_backoff=0.01, retry_deadline=0.1
+    )
+
+    async def run():
+        # Nothing is listening yet, the reports are spooled
+        assert await client.send_reports(REPORTS[:5]) == [None] * 5
+        assert len(spool) == 5
+
+        server = Server(host="127.0.0.1", port=port)
+        async with server:
+            receiver = asyncio.ensure_future(receive(server, len(REPORTS)))
+            assert await client.send_reports(REPORTS[5:]) == [None] * 5
+            received = await asyncio.wait_for(receiver, 10)
+            await client.disconnect()
+            return received
+
+    received = asyncio.run(run())
+    spool.close()
+    assert len(spool) == 0
+    assert received == REPORTS
@@ -0,0 +1,131 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from aionsca import State, SyncClient
+from aionsca.server import Server
+
+from test_loopback import free_port
+
+
+@contextmanager
+def server_thread(port: int):
+    """Run a server on its own event loop in a background thread, collecting
+    the services of received reports"""
+    received = list()
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    async def serve():
+        async with Server(host="127.0.0.1", port=port) as server:
+            started.set()
+            async for batch in server.reports_batched():
+                received.extend(report.service for report in batch)
+
+    def run():
+        task = loop.create_task(serve())
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert started.wait(5)
+    try:
+        yield received
+    finally:
+        loop.call_soon_threadsafe(lambda: [t.cancel() for t in asyncio.all_tasks()])
+        thread.join(5)
+
+
+def wait_for_count(received, count: int):
+    deadline = time.monotonic() + 5
+    while len(received) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return len(received)
+
+
+def test_send_and_submit_from_threads():
+    port = free_port()
+    with server_thread(port) as received:
+        client = SyncClient(host="127.0.0.1", port=port, batch_size=16)
+        client.connect(timeout=5)
+
+        def produce(thread: int):
+            for i in range(50):
+                service = f"service-{thread}-{i}"
+                if thread % 2:
+                    client.send("host", service, State.OK, "message", timeout=5)
+                else:
+                    assert client.submit("host", service, State.OK, "message")
+
+        threads = [threading.Thread(target=produce, args=(t,)) for t in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        client.flush(timeout=5)
+        assert client.queue_depth == 0
+        assert wait_for_count(received, 200) == 200
+        client.close(timeout=5)
+
+    assert sorted(received) == sorted(
+        f"service-{t}-{i}" for t in range(4) for i in range(50)
+    )
+    assert client.failed_reports == 0
+
+
+def test_send_after_failed_connect():
+    port = free_port()
+    client = SyncClient(host="127.0.0.1", port=port, retries=20)
+    with pytest.raises(OSError):
+        client.connect(timeout=5)
+    try:
+        with server_thread(port) as received:
+            client.send("host", "service", State.OK, "message", timeout=10)
+            assert client.submit("host", "submitted", State.OK, "message")
+            client.flush(timeout=5)
+            assert wait_for_count(received, 2) == 2
+    finally:
+        client.close(flush=False, timeout=5)
+    assert received == ["service", "submitted"]
+
+
+def test_close_waits_for_blocked_loop():
+    port = free_port()
+    with server_thread(port):
+        client = SyncClient(host="127.0.0.1", port=port)
+        client.connect(timeout=5)
+        loop, thread = client._loop, client._thread
+        # Keep the background loop busy for longer than close() waits
+        loop.call_soon_threadsafe(time.sleep, 0.5)
+        with pytest.raises(TimeoutError):
+            client.close(flush=False, timeout=0.1)
+        thread.join(5)
+        assert loop.is_closed()
@@ -0,0 +1,74 @@
+# aionsca
+# Copyright (C) 2019 ZIH, Technische Universitaet Dresden, Federal Republic of Germany
+#
+# All rights reserved.
+#
+# This file is part of metricq.
+#
+# metricq is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# metricq is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with metricq.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import signal
+
+from aionsca import Pool, State
+from aionsca.workers import MultiprocessServer
+
+from test_loopback import free_port
+
+REPORTS = [("host", f"service-{i}", State.OK, "message") for i in range(200)]
+
+
+def test_start_send_close():
+    port = free_port()
+    server = MultiprocessServer(
+        host="127.0.0.1",
+        port=port,
+        password="secret",
+        encryption_method="xor",
+        workers=2,
+    )
+
+    async def run():
+        # Like aionsca-server, handle SIGTERM in the parent's event loop
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, lambda: None)
+        try:
+            await server.start_server()
+            try:
+                received = list()
+                async with Pool(
+                    size=4,
+                    host="127.0.0.1",
+                    port=port,
+                    password="secret",
+                    encryption_method="xor",
+                ) as pool:
+                    assert await pool.send_reports(REPORTS) == [None] * len(REPORTS)
+
+                async def receive():
+                    async for batch in server.reports_batched():
+                        received.extend(report.service for report in batch)
+                        if len(received) >= len(REPORTS):
+                            return
+
+                await asyncio.wait_for(receive(), 10)
+            finally:
+                # Must not wait forever for workers ignoring SIGTERM
+                await asyncio.wait_for(server.close(), 10)
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+        return received
+
+    received = asyncio.run(run())
+    assert sorted(received) == sorted(service for _, service, _, _ in REPORTS)